@@ -0,0 +1,19 @@
+"""Lets the benchmarks run from a checkout without installing didata_cli.
+
+Importing this module puts the checkout first on sys.path, so the
+benchmarks use its didata_cli and its tests.replay.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def subprocess_env(env):
+    """``env`` with the checkout first on PYTHONPATH, for benchmarks that start didata."""
+    env = dict(env)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT, env['PYTHONPATH']]) if env.get('PYTHONPATH') else ROOT
+    return env
@@ -0,0 +1,170 @@
+"""Wall time, API requests and peak memory of didata commands.
+
+Every command runs in process under click's CliRunner against a replayed
+SyntheticFleet (see tests/replay.py), so no account or network is
+needed. Results are compared with benchmarks/baseline.json and the script
+exits 1 if any command got slower, made more API requests or used more
+memory than the baseline allows. Wall time is kept as a multiple of a
+fixed reference workload timed in the same run, so the baseline holds on
+machines faster or slower than the one that wrote it.
+
+    python benchmarks/commands.py [--runs N] [--only NAME] [--update-baseline]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from xml.etree import ElementTree
+
+from click.testing import CliRunner
+
+import checkout  # noqa: F401
+
+from didata_cli.cli import cli, DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# name, fleet size, command line
+SCENARIOS = [
+    ('server-list', 10000, ['server', 'list']),
+    ('server-list-jsonl', 10000, ['server', 'list', '--output', 'jsonl']),
+    ('server-list-dumpall', 2000, ['server', 'list', '--dumpall']),
+    ('server-list-datacenter', 10000, ['server', 'list', '--datacenterId', 'NA9']),
+    ('server-list-limit', 10000, ['server', 'list', '--limit', '10']),
+    ('server-list-query', 10000, ['server', 'list', '--query', 'cpu.count>=2', '--output', 'jsonl']),
+    ('server-stats', 10000, ['server', 'stats', '--groupBy', 'datacenter,os', '--output', 'csv']),
+    ('location-list', 10, ['location', 'list']),
+    ('network-list-domains', 10, ['network', 'list-network-domains']),
+    ('backup-report', 1000, ['backup', 'report', '--datacenterId', 'NA9']),
+]
+
+
+def run_scenario(fleet_size, args, trace_memory=False):
+    """Run one command, returning (seconds, API requests, peak KiB or None)."""
+    adapter = ReplayAdapter(fleet=SyntheticFleet(fleet_size))
+    client = DiDataCLIClient()
+    client.adapter_factory = lambda size: adapter
+    cache_dir = tempfile.mkdtemp()
+    env = {'DIDATA_USER': 'benchuser', 'DIDATA_PASSWORD': 'benchpass', 'DIDATA_CACHE_DIR': cache_dir}
+    try:
+        if trace_memory:
+            tracemalloc.start()
+        started = time.time()
+        result = CliRunner().invoke(cli, args, obj=client, env=env)
+        elapsed = time.time() - started
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(cache_dir)
+    if result.exit_code != 0:
+        raise RuntimeError('didata {0} exited with {1}:\n{2}'.format(
+            ' '.join(args), result.exit_code, result.output), result.exc_info)
+    return elapsed, adapter.requests, peak
+
+
+def reference_workload():
+    # parsing XML and dumping JSON, as every command does, but without any
+    # didata or libcloud code that a change could speed up or slow down
+    body = ''.join('<server id="{0}"><name>server{0}</name><cpu count="2"/></server>'.format(index)
+                   for index in range(20000))
+    root = ElementTree.fromstring('<servers>{0}</servers>'.format(body))
+    json.dumps([dict(element.attrib, name=element.findtext('name')) for element in root])
+
+
+def time_reference():
+    started = time.time()
+    reference_workload()
+    return time.time() - started
+
+
+def measure(fleet_size, args, runs):
+    timings = []
+    # timed next to the command, so both see the same load on the machine
+    references = []
+    for _ in range(runs):
+        references.append(time_reference())
+        elapsed, requests, _ = run_scenario(fleet_size, args)
+        timings.append(elapsed)
+    reference = min(references)
+    # tracemalloc slows everything down, so memory gets a run of its own
+    _, _, peak = run_scenario(fleet_size, args, trace_memory=True)
+    return {'seconds': round(min(timings), 4), 'reference': reference, 'relative': round(min(timings) / reference, 3),
+            'requests': requests, 'peak_kb': peak}
+
+
+def _grew(value, baseline, tolerance, floor):
+    # millisecond commands and small peaks vary by more than any sensible
+    # fraction from run to run, so growth must also exceed an absolute floor
+    return value > baseline * (1 + tolerance) and value - baseline > floor
+
+
+def regressions(name, result, baseline, time_tolerance, memory_tolerance, time_floor=0.02, memory_floor=64):
+    problems = []
+    if result['requests'] > baseline['requests']:
+        problems.append('{0}: {1} API requests, baseline {2}'.format(name, result['requests'], baseline['requests']))
+    if _grew(result['relative'], baseline['relative'], time_tolerance, time_floor / result['reference']):
+        problems.append('{0}: {1:.2f}x the reference workload, baseline {2:.2f}x'.format(
+            name, result['relative'], baseline['relative']))
+    if _grew(result['peak_kb'], baseline['peak_kb'], memory_tolerance, memory_floor):
+        problems.append('{0}: {1} KiB peak, baseline {2} KiB'.format(name, result['peak_kb'], baseline['peak_kb']))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--only', action='append', help='Only run the named scenario (repeatable)')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--time-tolerance', type=float, default=0.5,
+                        help='Allowed slowdown, relative to the reference workload, as a fraction of the baseline '
+                             '(default 0.5)')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                        help='Allowed peak memory growth as a fraction of the baseline (default 0.2)')
+    parser.add_argument('--time-floor', type=float, default=0.02,
+                        help='Slowdown in seconds that is never a regression (default 0.02)')
+    parser.add_argument('--memory-floor', type=int, default=64,
+                        help='Peak memory growth in KiB that is never a regression (default 64)')
+    options = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    problems = []
+    for name, fleet_size, args in SCENARIOS:
+        if options.only and name not in options.only:
+            continue
+        result = results[name] = measure(fleet_size, args, options.runs)
+        print('{0:<24} {1:8.1f} ms {2:7.2f}x {3:6d} requests {4:8d} KiB peak'.format(
+            name, result['seconds'] * 1000, result['relative'], result['requests'], result['peak_kb']))
+        if name in baseline and not options.update_baseline:
+            problems.extend(regressions(name, result, baseline[name],
+                                        options.time_tolerance, options.memory_tolerance,
+                                        options.time_floor, options.memory_floor))
+
+    if options.update_baseline:
+        # seconds only mean something on this machine
+        baseline.update((name, dict((key, value) for key, value in result.items()
+                                    if key not in ('seconds', 'reference')))
+                        for name, result in results.items())
+        with open(options.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline written to {0}'.format(options.baseline))
+    elif problems:
+        print('\nRegressions:\n  ' + '\n  '.join(problems))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Micro-benchmarks for flattening node extra data.
+
+Compares utils.flattenDict against the previous recursive implementation
+on payloads shaped like DimensionDataNodeDriver node.extra after
+output.plain().
+
+    python benchmarks/flatten.py [--nodes N] [--repeat N]
+"""
+import argparse
+import timeit
+
+import checkout  # noqa: F401
+
+from didata_cli.utils import flattenDict, iter_flat_items
+
+
+def legacy_flatten(d, result=None):
+    # the recursive flattenDict this module replaced
+    if result is None:
+        result = {}
+    for key in d:
+        value = d[key]
+        if isinstance(value, dict):
+            value1 = {}
+            for keyIn in value:
+                value1[".".join([key, keyIn])] = value[keyIn]
+            legacy_flatten(value1, result)
+        elif isinstance(value, (tuple, list)):
+            for indexB, element in enumerate(value):
+                if isinstance(element, dict):
+                    value1 = {}
+                    for keyIn in element:
+                        value1[".".join([key, keyIn])] = value[indexB][keyIn]
+                    for keyA in value1:
+                        legacy_flatten(value1, result)
+        else:
+            result[key] = value
+    return result
+
+
+def node_extra(i, disk_count=4):
+    return {
+        'description': 'web server {0}'.format(i),
+        'sourceImageId': 'a1b2c3d4-0000-0000-0000-{0:012d}'.format(i),
+        'networkId': None,
+        'networkDomainId': 'nd-{0}'.format(i % 20),
+        'datacenterId': 'NA{0}'.format(i % 4 + 9),
+        'deployedTime': '2016-03-01T10:00:00.000Z',
+        'cpu': {'cpu_count': 2 + i % 4, 'cores_per_socket': 1, 'performance': 'STANDARD'},
+        'memoryMb': 4096,
+        'OS_id': 'UBUNTU1464',
+        'OS_type': 'UNIX',
+        'OS_displayName': 'UBUNTU14/64',
+        'status': {'action': None, 'request_time': None, 'user_name': None, 'number_of_steps': None,
+                   'step_name': None, 'step_number': None, 'step_percent_complete': None,
+                   'failure_reason': None},
+        'disks': [{'id': 'disk-{0}-{1}'.format(i, d), 'scsi_id': d, 'size_gb': 10 * (d + 1),
+                   'speed': 'STANDARD', 'state': 'NORMAL'} for d in range(disk_count)],
+        'vmWareTools': {'status': 'RUNNING', 'version_status': 'CURRENT', 'api_version': 9354},
+        'ipv6': '2607:f480:111:1575::{0:x}'.format(i),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+    payloads = [node_extra(i) for i in range(options.nodes)]
+    whitelist = ['cpu.cpu_count', 'memoryMb', 'disks.0.size_gb', 'datacenterId']
+
+    cases = [
+        ('legacy recursive', lambda: [legacy_flatten(p) for p in payloads]),
+        ('flattenDict', lambda: [flattenDict(p) for p in payloads]),
+        ('flattenDict keys=4', lambda: [flattenDict(p, keys=whitelist) for p in payloads]),
+        ('list(iter_flat_items)', lambda: [list(iter_flat_items(p)) for p in payloads]),
+    ]
+    for name, case in cases:
+        best = min(timeit.repeat(case, number=1, repeat=options.repeat))
+        print('{0:<22} {1:8.2f} ms  ({2:6.1f} us/node)'.format(
+            name, best * 1000, best * 1e6 / options.nodes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Time and memory of parsing server list pages into nodes.
+
+Compares libcloud's Node objects, which server list used for every
+server, with the compact NodeRecords parsed with just the summary fields
+and with the fields the inventory needs. Pages come from a SyntheticFleet
+(see tests/replay.py) and every parsed server is kept, as a listing
+of the whole fleet does.
+
+    python benchmarks/records.py [--nodes N] [--repeat N]
+"""
+import argparse
+import timeit
+import tracemalloc
+from xml.etree import ElementTree
+
+from libcloud.compute.drivers.dimensiondata import DimensionDataNodeDriver
+
+import checkout  # noqa: F401
+
+from didata_cli.nodes import parse_nodes, RECORD_FIELDS, SUMMARY_FIELDS
+from tests.replay import SyntheticFleet
+from didata_cli.utils import MAX_PAGE_SIZE, _add_dropped_details
+
+
+def libcloud_nodes(driver, page):
+    nodes = driver._to_nodes(page)
+    _add_dropped_details(page, nodes)
+    return nodes
+
+
+def peak_kb(parse, pages):
+    tracemalloc.start()
+    kept = [parse(page) for page in pages]
+    peak = tracemalloc.get_traced_memory()[1] // 1024
+    tracemalloc.stop()
+    del kept
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+    fleet = SyntheticFleet(options.nodes)
+    page_count = (options.nodes + MAX_PAGE_SIZE - 1) // MAX_PAGE_SIZE
+    pages = [ElementTree.fromstring(fleet.servers_xml({'pageSize': MAX_PAGE_SIZE, 'pageNumber': number}))
+             for number in range(1, page_count + 1)]
+    driver = DimensionDataNodeDriver('benchuser', 'benchpass')
+
+    cases = [
+        ('libcloud Node', lambda page: libcloud_nodes(driver, page)),
+        ('NodeRecord summary', lambda page: parse_nodes(page, SUMMARY_FIELDS)),
+        ('NodeRecord inventory', lambda page: parse_nodes(page, RECORD_FIELDS)),
+    ]
+    for name, parse in cases:
+        best = min(timeit.repeat(lambda: [parse(page) for page in pages], number=1, repeat=options.repeat))
+        print('{0:<22} {1:8.1f} ms  ({2:5.1f} us/node) {3:8d} KiB kept'.format(
+            name, best * 1000, best * 1e6 / options.nodes, peak_kb(parse, pages)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Wall time of short didata invocations.
+
+Scripts call the CLI thousands of times a day, so interpreter start, imports
+and client set up matter more than any single command.
+
+    python benchmarks/startup.py [--runs N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import checkout
+
+INVOCATIONS = [
+    ['--help'],
+    ['server', '--help'],
+]
+
+
+def time_invocation(args, runs):
+    env = checkout.subprocess_env(dict(os.environ, DIDATA_USER='benchuser', DIDATA_PASSWORD='benchpass'))
+    command = [sys.executable, '-c', 'from didata_cli.cli import cli; cli()'] + args
+    timings = []
+    for _ in range(runs):
+        started = time.time()
+        subprocess.check_call(command, env=env, stdout=subprocess.PIPE)
+        timings.append(time.time() - started)
+    timings.sort()
+    return timings[0], timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    options = parser.parse_args()
+    for args in INVOCATIONS:
+        best, median = time_invocation(args, options.runs)
+        print('didata {0:<16} min {1:7.1f} ms   median {2:7.1f} ms'.format(
+            ' '.join(args), best * 1000, median * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+import errno
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+from io import StringIO
+
+DEFAULT_IDLE_TIMEOUT = 900
+# start up and fall back quickly when the agent is busy or gone
+CONNECT_TIMEOUT = 2.0
+
+# commands that need the caller's terminal, manage the agent itself, or run
+# until interrupted, which only the caller's process notices
+LOCAL_COMMANDS = ['agent', 'shell', 'watch']
+
+
+def socket_path():
+    path = os.environ.get('DIDATA_AGENT_SOCKET')
+    if not path:
+        path = os.path.join(os.path.expanduser('~'), '.didata', 'agent.sock')
+    return path
+
+
+def _has_option(argv, environ, option, envvar):
+    return envvar in environ or any(arg == option or arg.startswith(option + '=') for arg in argv)
+
+
+def can_forward(argv, environ):
+    """Whether ``argv`` can run on the agent without the caller's terminal."""
+    if environ.get('DIDATA_NO_AGENT') or not hasattr(socket, 'AF_UNIX'):
+        return False
+    if any(arg in LOCAL_COMMANDS for arg in argv) or '-' in argv:
+        return False
+    # the agent cannot prompt for credentials
+    return _has_option(argv, environ, '--user', 'DIDATA_USER') and \
+        _has_option(argv, environ, '--password', 'DIDATA_PASSWORD')
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+
+def _send(sock, message):
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def _frames(sock):
+    for line in sock.makefile('rb'):
+        yield json.loads(line.decode('utf-8'))
+
+
+def forward(argv, path=None, environ=None, stdout=None, stderr=None, cwd=None):
+    """Run a didata command line on the agent, streaming its output.
+
+    Returns the command's exit code, or None when it should run in this
+    process instead because no agent is listening, it is busy with another
+    command or the command cannot be forwarded.
+    """
+    environ = os.environ if environ is None else environ
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    if not can_forward(argv, environ):
+        return None
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = _connect(path)
+    if sock is None:
+        return None
+    try:
+        _send(sock, {
+            'argv': list(argv),
+            # relative paths in argv are the caller's
+            'cwd': cwd or os.getcwd(),
+            'env': dict((key, value) for key, value in environ.items() if key.startswith('DIDATA_')),
+            'tty': {'out': stdout.isatty(), 'err': stderr.isatty()},
+        })
+        for frame in _frames(sock):
+            if frame.get('busy'):
+                return None
+            if 'exit' in frame:
+                return frame['exit']
+            stream = stdout if 'out' in frame else stderr
+            stream.write(frame.get('out', frame.get('err')))
+            stream.flush()
+    finally:
+        sock.close()
+    # the command may have done part of its work, so it is not retried here
+    stderr.write('didata agent closed the connection before the command finished\n')
+    return 1
+
+
+def control(command, path=None):
+    """Send ``status`` or ``stop`` to the agent; None when it is not running."""
+    path = path or socket_path()
+    sock = _connect(path) if os.path.exists(path) else None
+    if sock is None:
+        return None
+    try:
+        _send(sock, {'control': command})
+        for frame in _frames(sock):
+            return frame
+    finally:
+        sock.close()
+
+
+class _FrameWriter(object):
+    """File-like object that sends everything written to it to the client."""
+
+    encoding = 'utf-8'
+
+    def __init__(self, sock, name, tty):
+        self.sock = sock
+        self.name = name
+        self.tty = tty
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        if data:
+            _send(self.sock, {self.name: data})
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty
+
+
+class Agent(object):
+    """Serves didata commands on a Unix socket from one long lived client.
+
+    Commands run one at a time, with the drivers, pooled connections and
+    inventory of the shared DiDataCLIClient staying warm between them. A
+    command that arrives while another is running is turned away and runs
+    in its caller's process instead, so a long --wait does not hold up
+    every other didata invocation. The agent exits once it has been idle
+    for ``idle_timeout`` seconds.
+    """
+
+    def __init__(self, path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT, client=None):
+        from didata_cli.cli import DiDataCLIClient
+        self.path = path or socket_path()
+        self.idle_timeout = idle_timeout
+        self.client = client or DiDataCLIClient()
+        self.started = time.time()
+        self.commands = 0
+        self.running = False
+        self.sock = None
+        # held while a command runs
+        self.busy = threading.Lock()
+        self._worker = None
+
+    def bind(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if control('status', self.path) is not None:
+            raise RuntimeError('An agent is already listening on {0}'.format(self.path))
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the owner may connect, from the moment the socket exists
+        umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.sock.listen(8)
+
+    def serve(self):
+        if self.sock is None:
+            self.bind()
+        self.running = True
+        self.sock.settimeout(self.idle_timeout)
+        try:
+            while self.running:
+                try:
+                    conn, _ = self.sock.accept()
+                except socket.timeout:
+                    if self._worker is not None and self._worker.is_alive():
+                        continue
+                    break
+                self.handle(conn)
+        finally:
+            if self._worker is not None:
+                self._worker.join()
+            self.sock.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _same_user(self, conn):
+        peercred = getattr(socket, 'SO_PEERCRED', None)
+        if peercred is None:
+            # the socket's file permissions still keep other users out
+            return True
+        creds = conn.getsockopt(socket.SOL_SOCKET, peercred, struct.calcsize('3i'))
+        return struct.unpack('3i', creds)[1] == os.getuid()
+
+    def handle(self, conn):
+        """Answer a control request, or start a command on its own thread unless one is running."""
+        try:
+            conn.settimeout(CONNECT_TIMEOUT)
+            request = next(_frames(conn), None) if self._same_user(conn) else None
+            conn.settimeout(None)
+            if request is None:
+                conn.close()
+                return
+            if 'control' in request:
+                if request['control'] == 'stop':
+                    self.running = False
+                _send(conn, {'pid': os.getpid(), 'uptime': time.time() - self.started,
+                             'commands': self.commands, 'idle_timeout': self.idle_timeout, 'exit': 0})
+                conn.close()
+                return
+            if not self.busy.acquire(False):
+                _send(conn, {'busy': True})
+                conn.close()
+                return
+        except socket.error:
+            # the client went away
+            conn.close()
+            return
+        self.commands += 1
+        self._worker = threading.Thread(target=self._run_command, args=(request, conn))
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _run_command(self, request, conn):
+        try:
+            try:
+                code = self.run(request, conn)
+            finally:
+                self.busy.release()
+            _send(conn, {'exit': code})
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def run(self, request, conn):
+        import click
+        from didata_cli.cli import cli
+        tty = request.get('tty', {})
+        out = _FrameWriter(conn, 'out', tty.get('out', False))
+        err = _FrameWriter(conn, 'err', tty.get('err', False))
+        saved_streams = sys.stdin, sys.stdout, sys.stderr
+        saved_environ = dict((key, value) for key, value in os.environ.items() if key.startswith('DIDATA_'))
+        saved_cwd = os.getcwd()
+        sys.stdin, sys.stdout, sys.stderr = StringIO(), out, err
+        self._set_environ(request.get('env', {}))
+        try:
+            os.chdir(request.get('cwd') or saved_cwd)
+            result = cli.main(args=request['argv'], prog_name='didata', obj=self.client, standalone_mode=False)
+            return result if isinstance(result, int) else 0
+        except click.ClickException as e:
+            e.show(file=err)
+            return e.exit_code
+        except click.exceptions.Exit as e:
+            return e.exit_code
+        except click.Abort:
+            err.write('Aborted!\n')
+            return 1
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            err.write('{0}\n'.format(e.code))
+            return 1
+        except Exception:
+            err.write(traceback.format_exc())
+            return 1
+        finally:
+            os.chdir(saved_cwd)
+            sys.stdin, sys.stdout, sys.stderr = saved_streams
+            self._set_environ(saved_environ)
+
+    @staticmethod
+    def _set_environ(values):
+        for key in [key for key in os.environ if key.startswith('DIDATA_')]:
+            del os.environ[key]
+        os.environ.update(values)
+
+
+def main():
+    """Entry point of the didata script: use the agent when one is running."""
+    from didata_cli.completion import complete, completing
+    prog_name = os.path.basename(sys.argv[0])
+    if completing(prog_name, os.environ):
+        # answered here when the values are in the completion index,
+        # otherwise by click in this process rather than on the agent
+        if not complete(prog_name, os.environ):
+            from didata_cli.cli import cli
+            cli()
+        sys.exit(0)
+    code = forward(sys.argv[1:])
+    if code is None:
+        from didata_cli.cli import cli
+        cli()
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the didata agent in the foreground')
+    parser.add_argument('--socket', default=None)
+    parser.add_argument('--idleTimeout', type=int, default=DEFAULT_IDLE_TIMEOUT)
+    options = parser.parse_args()
+    Agent(options.socket, options.idleTimeout).serve()
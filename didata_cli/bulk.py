@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BulkResult = namedtuple('BulkResult', ['item', 'value', 'error', 'elapsed'])
+
+
+class WorkerPool(object):
+    """Runs a function over many items on a bounded set of threads.
+
+    ``per_key_limit`` additionally caps how many items sharing the same key
+    (e.g. a datacenter id) may be in flight at once. ``throttle`` is called
+    by the threads before each API call, to hold them back while the API is
+    being rate limited.
+    """
+
+    def __init__(self, concurrency=10, per_key_limit=None, throttle=None):
+        self.concurrency = max(1, int(concurrency))
+        self.per_key_limit = per_key_limit
+        self._throttle = throttle
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def throttle(self):
+        """Block until another API call can be made."""
+        if self._throttle is not None:
+            self._throttle()
+
+    def key_slot(self, key):
+        if not self.per_key_limit or key is None:
+            return _NullSlot()
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.BoundedSemaphore(int(self.per_key_limit))
+            return self._key_locks[key]
+
+    def _call(self, func, item):
+        started = time.time()
+        try:
+            value = func(item, self)
+        except Exception as e:
+            return BulkResult(item, None, e, time.time() - started)
+        return BulkResult(item, value, None, time.time() - started)
+
+    def imap(self, func, items):
+        """Yield a BulkResult for every item as soon as it completes.
+
+        ``func`` is called as ``func(item, pool)`` so it can take a
+        ``pool.key_slot(key)`` once it knows which key the item belongs to.
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._call, func, item) for item in items]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def map(self, func, items):
+        return list(self.imap(func, items))
+
+
+class _NullSlot(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class ProgressFile(object):
+    """Remembers which items a bulk run finished, so a rerun can skip them."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = set(line.strip() for line in f if line.strip())
+
+    def mark_done(self, item_id):
+        if not self.path:
+            return
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write('{0}\n'.format(item_id))
+            self.done.add(item_id)
+
+
+def read_id_file(id_file):
+    ids = []
+    for line in id_file:
+        line = line.split('#', 1)[0].strip()
+        if line:
+            ids.append(line)
+    return ids
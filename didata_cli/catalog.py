@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from didata_cli.inventory import get_cache_dir, account_key, write_json_atomic
+
+# locations and backup policies change a few times a year at most
+DEFAULT_CATALOG_TTL = 24 * 60 * 60
+
+CLIENT_TYPES = 'client_types'
+STORAGE_POLICIES = 'storage_policies'
+SCHEDULE_POLICIES = 'schedule_policies'
+BACKUP_LISTS = [CLIENT_TYPES, STORAGE_POLICIES, SCHEDULE_POLICIES]
+
+Location = namedtuple('Location', ['id', 'name', 'country'])
+
+
+def backup_key(datacenter, service_plan, kind):
+    # what a server can use only depends on where it is and its service plan
+    return 'backup/{0}/{1}/{2}'.format(datacenter, service_plan, kind)
+
+
+def fetch_locations(driver):
+    return [[location.id, location.name, location.country] for location in driver.list_locations()]
+
+
+def fetch_backup_list(driver, kind, server_id):
+    """Names of the client types or policies available to a server with backups enabled."""
+    if kind == CLIENT_TYPES:
+        return [client_type.type for client_type in driver.ex_list_available_client_types(server_id)]
+    if kind == STORAGE_POLICIES:
+        return [policy.name for policy in driver.ex_list_available_storage_policies(server_id)]
+    return [policy.name for policy in driver.ex_list_available_schedule_policies(server_id)]
+
+
+class CatalogCache(object):
+    """On-disk cache of the lists that hardly ever change, for one region and user.
+
+    Entries are fetched at most once per process, even when several worker
+    threads ask for the same one at the same time, and kept on disk for
+    ``ttl`` seconds unless the cache is disabled.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_CATALOG_TTL, enabled=True):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled
+        self.fetches = 0
+        self._entries = None
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_account(cls, region, user, **kwargs):
+        path = os.path.join(get_cache_dir(), 'catalog-{0}.json'.format(account_key(region, user)))
+        return cls(path, **kwargs)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry['created'] <= self.ttl
+
+    def _lookup(self, key):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self.load() if self.enabled else {}
+            entry = self._entries.get(key)
+            return entry if self._fresh(entry) else None
+
+    def _store(self, key, value):
+        entry = {'created': time.time(), 'value': value}
+        with self._lock:
+            if self._entries is None:
+                self._entries = {}
+            self._entries[key] = entry
+            if self.enabled:
+                # another process may have cached other entries meanwhile
+                entries = self.load()
+                entries[key] = entry
+                write_json_atomic(self.path, entries)
+
+    def get(self, key, fetch):
+        """The cached value for ``key``, calling ``fetch()`` for it when missing or expired."""
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry['value']
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # another thread may have fetched it while this one waited
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry['value']
+            value = fetch()
+            self.fetches += 1
+            self._store(key, value)
+            return value
+
+    def locations(self, driver):
+        return [Location(*location) for location in self.get('locations', lambda: fetch_locations(driver))]
+
+    def backup_list(self, driver, kind, datacenter, service_plan, server_id):
+        """The names in one of BACKUP_LISTS for servers in ``datacenter`` on ``service_plan``.
+
+        ``server_id`` is any server there with backups enabled, asked when
+        the list is not cached.
+        """
+        return self.get(backup_key(datacenter, service_plan, kind),
+                        lambda: fetch_backup_list(driver, kind, server_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
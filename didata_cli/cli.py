@@ -1,38 +1,195 @@
+import time
+# when the CLI started importing, for the startup phase of --profile
+STARTED = time.time()
+
 import click
-from libcloud.compute.drivers.dimensiondata import DimensionDataNodeDriver
-from libcloud.backup.drivers.dimensiondata import DimensionDataBackupDriver
-from libcloud.common.dimensiondata import DEFAULT_REGION
-import os
+from didata_cli.inventory import InventoryCache, DEFAULT_TTL
+from didata_cli.catalog import CatalogCache, DEFAULT_CATALOG_TTL
+from didata_cli.profile import Profiler, activate, active, phase, redacted_argv
+from didata_cli.regions import resolve_regions
+import importlib
 import sys
+import threading
 
 CONTEXT_SETTINGS = dict(auto_envvar_prefix='DIDATA')
+# Same as libcloud.common.dimensiondata.DEFAULT_REGION, kept here so that
+# libcloud is only imported once a command actually needs a driver
+DEFAULT_REGION = 'dd-na'
+
+# Subcommands and their short help. Kept static so --help does not have to
+# scan the commands folder or import every command module; the
+# commands/cmd_<name>.py files must match this list.
+COMMANDS = [
+    ('agent', 'Run a background agent that keeps connections warm'),
+    ('apply', 'Create the network domains, VLANs, servers and backups in a plan file'),
+    ('backup', 'Manage server backups'),
+    ('cache', 'Clear or warm the server inventory and catalog caches'),
+    ('inventory', 'Record and query the history of the servers'),
+    ('location', 'List datacenter locations'),
+    ('network', 'Manage networks and network domains'),
+    ('server', 'Manage servers'),
+    ('shell', 'Run commands interactively, keeping connections warm'),
+]
+
+DRIVERS = {
+    'node': ('libcloud.compute.drivers.dimensiondata', 'DimensionDataNodeDriver'),
+    'backup': ('libcloud.backup.drivers.dimensiondata', 'DimensionDataBackupDriver'),
+}
 
 
 class DiDataCLIClient(object):
     def __init__(self):
         self.verbose = False
+        # builds the HTTP adapter for each region's connection pool; tests
+        # and benchmarks answer requests locally with tests/replay.py
+        self.adapter_factory = None
+        self.max_attempts = None
+        self.api_rate = None
+        self._drivers = {}
+        self._region_drivers = {}
+        self._catalogs = {}
+        self._connection_pools = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def init_client(self, user, password, region=DEFAULT_REGION,
+                    cache_ttl=DEFAULT_TTL, use_cache=True, refresh=False, catalog_ttl=DEFAULT_CATALOG_TTL):
+        account = (user, password, region)
+        if account != getattr(self, '_account', None):
+            # a long running client (the agent) keeps its drivers and
+            # inventory for as long as the account stays the same
+            self._account = account
+            self.user = user
+            self.password = password
+            # listing commands can fan out over several regions, everything
+            # else works on the first
+            self.regions = resolve_regions(region)
+            self.region = self.regions[0]
+            self._drivers = {}
+            self._region_drivers = {}
+            self.inventory = InventoryCache.for_account(self.region, user)
+        self.inventory.ttl = cache_ttl
+        self.inventory.enabled = use_cache
+        self.catalog_ttl = catalog_ttl
+        # catalogs are read from disk again for every command, so a long
+        # running client sees another process clearing the cache
+        self._catalogs = {}
+        if refresh:
+            self.inventory.invalidate()
+            self.inventory.refresh = True
+
+    def catalog(self, region=None):
+        """The CatalogCache of locations and backup policies for a region."""
+        region = region or self.region
+        with self._lock:
+            if region not in self._catalogs:
+                self._catalogs[region] = CatalogCache.for_account(region, self.user, ttl=self.catalog_ttl,
+                                                                  enabled=self.inventory.enabled)
+            return self._catalogs[region]
+
+    def connection_pool(self, region=None):
+        from didata_cli.connection import ConnectionPool
+        from didata_cli.retry import RetryPolicy, DEFAULT_MAX_ATTEMPTS
+        region = region or self.region
+        with self._lock:
+            if region not in self._connection_pools:
+                # every driver and thread for the region shares one policy,
+                # so they back off together
+                retry_policy = RetryPolicy(self.max_attempts or DEFAULT_MAX_ATTEMPTS, rate=self.api_rate)
+                self._connection_pools[region] = ConnectionPool(adapter_factory=self.adapter_factory,
+                                                                retry_policy=retry_policy)
+            return self._connection_pools[region]
+
+    def build_driver(self, kind, region=None):
+        module_name, class_name = DRIVERS[kind]
+        region = region or self.region
+        with phase('driver init'):
+            driver_class = getattr(importlib.import_module(module_name), class_name)
+            driver = driver_class(self.user, self.password, region)
+            driver = self.connection_pool(region).attach(driver)
+        if active() is not None:
+            active().instrument(driver, kind)
+        return driver
+
+    def worker_pool(self, concurrency=10, **kwargs):
+        """A WorkerPool whose threads can all keep a pooled connection open.
+
+        The pool throttles against the region's --apiRate bucket, the same
+        one every request to the region is sent through.
+        """
+        from didata_cli.bulk import WorkerPool
+        connection_pool = self.connection_pool()
+        kwargs.setdefault('throttle', connection_pool.retry_policy.throttle)
+        pool = WorkerPool(concurrency=concurrency, **kwargs)
+        connection_pool.ensure_size(pool.concurrency + 1)
+        return pool
+
+    def set_retry_options(self, max_attempts, api_rate):
+        self.max_attempts = max_attempts
+        self.api_rate = api_rate
+        # a long running client keeps its pools between commands
+        for pool in self._connection_pools.values():
+            pool.retry_policy.max_attempts = max_attempts
+            pool.retry_policy.bucket.ceiling = pool.retry_policy.bucket.rate = api_rate
+
+    def connection_stats(self):
+        """Return (connections opened, connections reused, requests retried)."""
+        opened = reused = retried = 0
+        for pool in self._connection_pools.values():
+            pool_opened, pool_reused = pool.stats()
+            opened += pool_opened
+            reused += pool_reused
+            retried += pool.retry_policy.retries if pool.retry_policy is not None else 0
+        return opened, reused, retried
+
+    def driver(self, kind):
+        if len(self.regions) > 1:
+            raise click.UsageError("Only the list commands work across several regions, pick one with --region")
+        if kind not in self._drivers:
+            self._drivers[kind] = self.build_driver(kind)
+        return self._drivers[kind]
+
+    @property
+    def node(self):
+        return self.driver('node')
+
+    @property
+    def backup(self):
+        return self.driver('backup')
+
+    def region_driver(self, region, kind='node'):
+        """The driver for one of several regions, used by that region's thread only."""
+        if (region, kind) not in self._region_drivers:
+            self._region_drivers[(region, kind)] = self.build_driver(kind, region)
+        return self._region_drivers[(region, kind)]
+
+    def worker_driver(self, kind='node'):
+        # libcloud connections are not thread safe, so every worker thread
+        # gets its own driver
+        drivers = getattr(self._local, 'drivers', None)
+        if drivers is None:
+            drivers = self._local.drivers = {}
+        if kind not in drivers:
+            drivers[kind] = self.build_driver(kind)
+        return drivers[kind]
 
-    def init_client(self, user, password, region=DEFAULT_REGION):
-        self.node = DimensionDataNodeDriver(user, password, region)
-        self.backup = DimensionDataBackupDriver(user, password, region)
 
 pass_client = click.make_pass_decorator(DiDataCLIClient, ensure=True)
-cmd_folder = os.path.abspath(os.path.join(os.path.dirname(__file__),
-                             'commands'))
 
 
 class DiDataCLI(click.MultiCommand):
 
     def list_commands(self, ctx):
-        rv = []
-        for filename in os.listdir(cmd_folder):
-            if filename.endswith('.py') and \
-               filename.startswith('cmd_'):
-                rv.append(filename[4:-3])
-        rv.sort()
-        return rv
+        return [name for name, _ in COMMANDS]
+
+    def format_commands(self, ctx, formatter):
+        # uses the static help so the command modules are not imported
+        with formatter.section('Commands'):
+            formatter.write_dl(COMMANDS)
 
     def get_command(self, ctx, name):
+        if name not in self.list_commands(ctx):
+            return
         try:
             if sys.version_info[0] == 2:
                 name = name.encode('ascii', 'replace')
@@ -47,10 +204,41 @@ class DiDataCLI(click.MultiCommand):
 @click.option('--verbose', is_flag=True)
 @click.option('--user', prompt=True)
 @click.option('--password', prompt=True, hide_input=True)
-@click.option('--region', default=DEFAULT_REGION)
+@click.option('--region', default=DEFAULT_REGION,
+              help="Region, a comma separated list of regions or 'all' for the list commands")
+@click.option('--cacheTtl', type=int, default=DEFAULT_TTL, help="Seconds before the server inventory cache expires")
+@click.option('--refresh', is_flag=True, default=False, help="Rebuild the server inventory cache")
+@click.option('--catalogTtl', type=int, default=DEFAULT_CATALOG_TTL,
+              help="Seconds before cached locations and backup policies expire")
+@click.option('--noCache', is_flag=True, default=False,
+              help="Do not use the server inventory and catalog caches")
+@click.option('--apiRate', type=click.FloatRange(0.1), help="Max API requests per second per region")
+@click.option('--maxAttempts', type=click.IntRange(1), default=5,
+              help="Times to send a request the API turns away as busy or throttled")
+@click.option('--profile', is_flag=True, default=False, help="Print where the time went when the command exits")
+@click.option('--profileOutput', type=click.Path(dir_okay=False, writable=True),
+              help="Also write the profile as JSON to this file")
+@click.pass_context
 @pass_client
-def cli(client, verbose, user, password, region):
+def cli(client, ctx, verbose, user, password, region, cachettl, refresh, catalogttl, nocache, apirate, maxattempts,
+        profile, profileoutput):
     """An interface into the Dimension Data Cloud"""
-    client.init_client(user, password, region)
+    client.init_client(user, password, region, cache_ttl=cachettl,
+                       use_cache=not nocache, refresh=refresh, catalog_ttl=catalogttl)
+    client.verbose = verbose
+    client.set_retry_options(maxattempts, apirate)
     if verbose:
         click.echo('Verbose mode enabled')
+        ctx.call_on_close(lambda: click.echo("HTTP connections: {0} opened, {1} reused, {2} requests retried".format(
+            *client.connection_stats()), err=True))
+    profiler = activate(Profiler(redacted_argv(sys.argv[1:]), started=STARTED) if profile or profileoutput else None)
+    if profiler is not None:
+        profiler.add_phase('startup', time.time() - STARTED)
+        ctx.call_on_close(lambda: finish_profile(profiler, profile, profileoutput))
+
+
+def finish_profile(profiler, show, path):
+    if path:
+        profiler.write_trace(path)
+    if show:
+        click.echo("\n".join(profiler.summary_lines()), err=True)
@@ -0,0 +1,57 @@
+import click
+import os
+import subprocess
+import sys
+import time
+from didata_cli.agent import control, socket_path, DEFAULT_IDLE_TIMEOUT
+
+
+@click.group()
+def cli():
+    """Run a background agent that keeps connections warm"""
+
+
+@cli.command(help='Start the agent in the background')
+@click.option('--idleTimeout', type=int, default=DEFAULT_IDLE_TIMEOUT, help="Seconds without commands before it exits")
+@click.option('--foreground', is_flag=True, default=False, help="Run in this process instead")
+def start(idletimeout, foreground):
+    path = socket_path()
+    if control('status', path) is not None:
+        click.secho("Agent is already running on {0}".format(path), fg='yellow')
+        return
+    if foreground:
+        from didata_cli.agent import Agent
+        Agent(path, idletimeout).serve()
+        return
+    with open(os.devnull, 'r+') as devnull:
+        subprocess.Popen([sys.executable, '-m', 'didata_cli.agent', '--socket', path,
+                          '--idleTimeout', str(idletimeout)],
+                         stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=os.setsid)
+    for _ in range(50):
+        status = control('status', path)
+        if status is not None:
+            click.secho("Agent {0} listening on {1}".format(status['pid'], path), fg='green')
+            return
+        time.sleep(0.1)
+    click.secho("Agent did not start", fg='red', bold=True)
+    sys.exit(1)
+
+
+@cli.command(help='Stop the agent')
+def stop():
+    if control('stop') is None:
+        click.secho("Agent is not running", fg='yellow')
+        return
+    click.secho("Agent stopped", fg='green')
+
+
+@cli.command(help='Show whether the agent is running')
+def status():
+    status = control('status')
+    if status is None:
+        click.echo("Agent is not running")
+        sys.exit(1)
+    click.echo("Agent {0} on {1}".format(status['pid'], socket_path()))
+    click.echo("Uptime: {0:.0f}s".format(status['uptime']))
+    click.echo("Commands run: {0}".format(status['commands']))
+    click.echo("Idle timeout: {0}s".format(status['idle_timeout']))
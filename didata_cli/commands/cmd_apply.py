@@ -0,0 +1,50 @@
+import click
+import sys
+from didata_cli.cli import pass_client
+from didata_cli.plan import Plan, PlanRunner, PlanError, load_plan, CREATED, UNCHANGED, FAILED, SKIPPED, \
+    WOULD_CREATE
+from didata_cli.waiter import DEFAULT_TIMEOUT
+
+RESULT_COLORS = {
+    CREATED: 'green',
+    UNCHANGED: None,
+    WOULD_CREATE: 'yellow',
+    SKIPPED: 'yellow',
+    FAILED: 'red',
+}
+
+
+def echo_step_result(result):
+    click.secho("{0}: {1} ({2}) {3:.1f}s".format(result.key, result.status, result.detail, result.elapsed),
+                fg=RESULT_COLORS[result.status])
+
+
+@click.command()
+@click.argument('planfile', type=click.File('r'))
+@click.option('--concurrency', type=int, default=5, help="Number of steps to run at once")
+@click.option('--dryRun', is_flag=True, default=False, help="Only show what would be created")
+@click.option('--waitTimeout', type=int, default=DEFAULT_TIMEOUT, help="Seconds to wait for each resource")
+@pass_client
+def cli(client, planfile, concurrency, dryrun, waittimeout):
+    """Create the network domains, VLANs, servers and backups in a plan file
+
+    Resources that already exist are left alone and independent steps run
+    in parallel.
+    """
+    try:
+        plan = Plan(load_plan(planfile))
+    except PlanError as e:
+        click.secho("{0}".format(e), fg='red', bold=True)
+        sys.exit(1)
+    results = PlanRunner(client, plan, timeout=waittimeout).run(concurrency=concurrency, dry_run=dryrun,
+                                                                on_result=echo_step_result)
+    counts = dict((status, 0) for status in RESULT_COLORS)
+    for result in results.values():
+        counts[result.status] += 1
+    if any(key.startswith('server:') and result.status == CREATED for key, result in results.items()):
+        client.inventory.invalidate()
+    click.echo("")
+    click.echo(", ".join("{0} {1}".format(counts[status], status)
+                         for status in [CREATED, WOULD_CREATE, UNCHANGED, FAILED, SKIPPED] if counts[status]))
+    if counts[FAILED] or counts[SKIPPED]:
+        sys.exit(1)
@@ -1,13 +1,48 @@
 import click
+from collections import OrderedDict
+import sys
 from didata_cli.cli import pass_client
 from libcloud.common.dimensiondata import DimensionDataAPIException
-from didata_cli.utils import handle_dd_api_exception, get_single_server_id_from_filters
+from didata_cli.bulk import ProgressFile
+from didata_cli.catalog import CLIENT_TYPES, STORAGE_POLICIES, SCHEDULE_POLICIES, fetch_backup_list
+from didata_cli.output import output_options
+from didata_cli.waiter import wait_options, wait_for_backups, Waiter, BackupPoller, BACKUP_ENABLED, DEFAULT_TIMEOUT
+from didata_cli.utils import handle_dd_api_exception, get_single_server_id_from_filters, server_filter_options, \
+    get_bulk_targets, list_matching_nodes, query_option, get_single_node_from_filters
 
 
 @click.group()
 @pass_client
 def cli(config):
-    pass
+    """Manage server backups"""
+
+
+def get_backup_catalog_key(client, serverid):
+    """(datacenter, service plan) of a server with backups enabled, None if they are not."""
+    record = client.inventory.cached(serverid)
+    if record is not None and record.get('backup_plan'):
+        return record['datacenter'], record['backup_plan']
+    target = client.backup.ex_get_target_by_id(serverid)
+    if target is None:
+        return None
+    return target.extra['datacenterId'], target.extra['servicePlan']
+
+
+def available_backup_names(client, kind, serverid):
+    key = get_backup_catalog_key(client, serverid)
+    if key is None:
+        # let the API say why there is nothing to list
+        return fetch_backup_list(client.backup, kind, serverid)
+    return client.catalog().backup_list(client.backup, kind, key[0], key[1], serverid)
+
+
+def check_backup_settings(catalog, driver, serverid, datacenter, service_plan, settings):
+    """Raise if any (kind, name) in settings is not available to the server's datacenter and plan."""
+    for kind, name in settings:
+        names = catalog.backup_list(driver, kind, datacenter, service_plan, serverid)
+        if name not in names:
+            raise RuntimeError("{0} is not available for {1} backups in {2}, pick one of: {3}".format(
+                name, service_plan, datacenter, ', '.join(names)))
 
 
 @cli.command()
@@ -15,25 +50,149 @@ def cli(config):
 @click.option('--servicePlan', required=True, help='The type of service plan to enroll in',
               type=click.Choice(['Enterprise', 'Essentials', 'Advanced']))
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
+@wait_options
 @pass_client
-def enable(client, serverid, serviceplan, serverfilteripv6):
+def enable(client, serverid, serviceplan, serverfilteripv6, query, wait, waittimeout):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_server_id_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
     try:
-        extra = {'service_plan': serviceplan}
+        extra = {'servicePlan': serviceplan}
         client.backup.create_target(serverid, serverid, extra=extra)
         click.secho("Backups enabled for {0}.  Service plan: {1}".format(serverid, serviceplan), fg='green', bold=True)
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
+    if wait:
+        wait_for_backups(client.backup, [serverid], waittimeout)
+
+
+@cli.command(help='Enable backups, and optionally add a client, on every server matching the filters')
+@click.option('--servicePlan', required=True, help='The type of service plan to enroll in',
+              type=click.Choice(['Enterprise', 'Essentials', 'Advanced']))
+@click.option('--clientType', help='The client type to add once backups are enabled')
+@click.option('--storagePolicy', help='The storage policy for the client')
+@click.option('--schedulePolicy', help='The schedule policy for the client')
+@click.option('--triggerOn', type=click.UNPROCESSED, help='When to send client alerts')
+@click.option('--notifyEmail', type=click.UNPROCESSED, help='The email address for client alerts')
+@server_filter_options
+@click.option('--serverIdFile', type=click.File('r'), help="File with one server ID per line")
+@click.option('--concurrency', type=int, default=10, help="Number of servers to work on at once")
+@click.option('--stateFile', type=click.Path(dir_okay=False),
+              help="Records finished servers so an interrupted run can be resumed")
+@click.option('--waitTimeout', type=int, default=DEFAULT_TIMEOUT, help="Seconds to wait for backups to be enabled")
+@pass_client
+def bulk_enable(client, serviceplan, clienttype, storagepolicy, schedulepolicy, triggeron, notifyemail,
+                node_filters, query, serveridfile, concurrency, statefile, waittimeout):
+    if clienttype and not (storagepolicy and schedulepolicy and triggeron and notifyemail):
+        click.secho("--storagePolicy, --schedulePolicy, --triggerOn and --notifyEmail are required with --clientType",
+                    fg='red', bold=True)
+        sys.exit(1)
+    targets = get_bulk_targets(client, node_filters, serveridfile, query)
+    progress = ProgressFile(statefile)
+    settings = [(CLIENT_TYPES, clienttype), (STORAGE_POLICIES, storagepolicy), (SCHEDULE_POLICIES, schedulepolicy)]
+    catalog = client.catalog()
+    # (datacenter, service plan) -> a server enrolled in it, to check the settings against
+    enrolled = {}
+    for record in client.inventory.cached_records():
+        if record.get('backup_plan'):
+            enrolled.setdefault((record['datacenter'], record['backup_plan']), record['id'])
+    datacenters = {}
+    groups = set()
+    for target in targets:
+        if hasattr(target, 'extra'):
+            serverid, datacenter = target.id, target.extra.get('datacenterId')
+            service_plan = target.extra.get('backupServicePlan')
+        else:
+            record = client.inventory.cached(target) or {}
+            serverid, datacenter, service_plan = target, record.get('datacenter'), record.get('backup_plan')
+        datacenters[serverid] = datacenter
+        if service_plan:
+            enrolled[(datacenter, service_plan)] = serverid
+        groups.add((datacenter, service_plan or serviceplan))
+    checked = set()
+    if clienttype:
+        # find out about a mistyped policy before enrolling any server; groups
+        # without a known enrolled server are checked by their first worker
+        for group in sorted(groups, key='{0}'.format):
+            if group[0] is None or group not in enrolled:
+                continue
+            try:
+                check_backup_settings(catalog, client.worker_driver('backup'), enrolled[group], group[0], group[1],
+                                      settings)
+            except RuntimeError as e:
+                click.secho("{0}".format(e), fg='red', bold=True)
+                sys.exit(1)
+            except DimensionDataAPIException as e:
+                handle_dd_api_exception(e)
+            checked.add(group)
+
+    def run(target, pool):
+        serverid = getattr(target, 'id', target)
+        if serverid in progress.done:
+            return 'already done by a previous run'
+        driver = client.worker_driver('backup')
+        steps = []
+        datacenter, service_plan = datacenters.get(serverid), serviceplan
+        pool.throttle()
+        backup_target = driver.ex_get_target_by_id(serverid)
+        if backup_target is None:
+            pool.throttle()
+            driver.create_target(serverid, serverid, extra={'servicePlan': serviceplan})
+            steps.append('backups enabled')
+        else:
+            datacenter = backup_target.extra['datacenterId']
+            service_plan = backup_target.extra['servicePlan']
+            steps.append('already enrolled')
+        if clienttype:
+            # clients can only be added once the backup service is ready
+            waiter = Waiter(BackupPoller(driver, pool.throttle), timeout=waittimeout)
+            waiter.add(serverid, BACKUP_ENABLED)
+            result = waiter.wait()[0]
+            if not result.ok:
+                raise RuntimeError("backups not enabled: {0}".format(result.detail))
+            pool.throttle()
+            details = driver.ex_get_backup_details_for_target(serverid)
+            if any(backup_client.type.type == clienttype for backup_client in details.clients):
+                steps.append('{0} client already present'.format(clienttype))
+            else:
+                if datacenter is None:
+                    pool.throttle()
+                    datacenter = driver.ex_get_target_by_id(serverid).extra['datacenterId']
+                if (datacenter, service_plan) not in checked:
+                    # fetched once per datacenter and plan, not once per server
+                    check_backup_settings(catalog, driver, serverid, datacenter, service_plan, settings)
+                pool.throttle()
+                driver.ex_add_client_to_target(serverid, clienttype, storagepolicy,
+                                               schedulepolicy, triggeron, notifyemail)
+                steps.append('{0} client added'.format(clienttype))
+        progress.mark_done(serverid)
+        return ', '.join(steps)
+
+    failures = 0
+    pool = client.worker_pool(concurrency=concurrency)
+    for result in pool.imap(run, targets):
+        serverid = getattr(result.item, 'id', result.item)
+        if result.error is None:
+            click.secho("{0}: {1}".format(serverid, result.value), fg='green')
+        else:
+            failures += 1
+            click.secho("{0} failed: {1}".format(serverid, result.error), fg='red')
+    click.secho("{0} succeeded, {1} failed".format(len(targets) - failures, failures),
+                fg='red' if failures else 'green', bold=True)
+    if failures:
+        if statefile:
+            click.secho("Run the same command again to retry the failed servers")
+        sys.exit(1)
 
 
 @cli.command()
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to disable backups on')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def disable(client, serverid, serverfilteripv6):
+def disable(client, serverid, serverfilteripv6, query):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_node_from_filters(client, query=query, ex_ipv6=serverfilteripv6).id
     try:
         response = client.backup.delete_target(serverid)
         if response is True:
@@ -44,31 +203,155 @@ def disable(client, serverid, serverfilteripv6):
         handle_dd_api_exception(e)
 
 
+def backup_details_lines(serverid, details):
+    lines = [
+        "Backup Details for {0}".format(serverid),
+        "Service Plan: {0}".format(details.service_plan),
+    ]
+    if len(details.clients) > 0:
+        lines.append("Clients:")
+        for backup_client in details.clients:
+            lines.append("")
+            lines.append(click.style("{0}".format(backup_client.type), bold=True))
+            lines.append("Description: {0}".format(backup_client.description))
+            lines.append("Schedule: {0}".format(backup_client.schedule_policy))
+            lines.append("Retention: {0}".format(backup_client.storage_policy))
+            lines.append("DownloadURL: {0}".format(backup_client.download_url))
+            if backup_client.running_job is not None:
+                lines.append(click.style("Running Job", bold=True))
+                lines.append("ID: {0}".format(backup_client.running_job.id))
+                lines.append("Status: {0}".format(backup_client.running_job.status))
+                lines.append("Percentage Complete: {0}".format(backup_client.running_job.percentage))
+    return lines
+
+
+def backup_client_record(serverid, details, backup_client):
+    """One row per backup client; a server without clients gets one row with empty client columns."""
+    running_job = getattr(backup_client, 'running_job', None)
+    return OrderedDict([
+        ('serverId', serverid),
+        ('servicePlan', details.service_plan if details is not None else None),
+        ('clientType', backup_client.type.type if backup_client is not None else None),
+        ('description', getattr(backup_client, 'description', None)),
+        ('schedulePolicy', getattr(backup_client, 'schedule_policy', None)),
+        ('storagePolicy', getattr(backup_client, 'storage_policy', None)),
+        ('downloadUrl', getattr(backup_client, 'download_url', None)),
+        ('runningJobId', running_job.id if running_job is not None else None),
+        ('runningJobStatus', running_job.status if running_job is not None else None),
+        ('runningJobPercentage', running_job.percentage if running_job is not None else None),
+    ])
+
+
+def backup_summary_lines(serverid, details):
+    if details is None:
+        return ["{0}: backups not enabled".format(serverid)]
+    if len(details.clients) == 0:
+        return ["{0}: {1}, no clients".format(serverid, details.service_plan)]
+    lines = []
+    for backup_client in details.clients:
+        line = "{0}: {1}, {2} ({3} / {4})".format(
+            serverid, details.service_plan, backup_client.type.type,
+            backup_client.schedule_policy, backup_client.storage_policy)
+        if backup_client.running_job is not None:
+            line += ", job {0} {1}%".format(backup_client.running_job.status, backup_client.running_job.percentage)
+        lines.append(line)
+    return lines
+
+
+class BackupReport(object):
+    """Aggregates backup details across servers."""
+
+    def __init__(self):
+        self.servers = 0
+        self.failed = 0
+        self.not_enabled = 0
+        self.no_clients = 0
+        self.running_jobs = 0
+        self.service_plans = {}
+        self.storage_policies = {}
+
+    def add(self, details):
+        self.servers += 1
+        if details is None:
+            self.not_enabled += 1
+            return
+        self.service_plans[details.service_plan] = self.service_plans.get(details.service_plan, 0) + 1
+        if len(details.clients) == 0:
+            self.no_clients += 1
+        policies = set()
+        for backup_client in details.clients:
+            policies.add(backup_client.storage_policy)
+            if backup_client.running_job is not None:
+                self.running_jobs += 1
+        for policy in policies:
+            self.storage_policies[policy] = self.storage_policies.get(policy, 0) + 1
+
+    def lines(self):
+        lines = [
+            click.style("Backup summary", bold=True),
+            "Servers: {0}".format(self.servers),
+            "Backups not enabled: {0}".format(self.not_enabled),
+            "No clients: {0}".format(self.no_clients),
+            "Running jobs: {0}".format(self.running_jobs),
+        ]
+        if self.failed:
+            lines.append("Failed lookups: {0}".format(self.failed))
+        for plan in sorted(self.service_plans):
+            lines.append("Service plan {0}: {1}".format(plan, self.service_plans[plan]))
+        for policy in sorted(self.storage_policies):
+            lines.append("Storage policy {0}: {1}".format(policy, self.storage_policies[policy]))
+        return lines
+
+
+@cli.command(help='Report backup status across all servers matching the filters')
+@server_filter_options
+@click.option('--concurrency', type=int, default=20, help="Number of servers to look up at once")
+@output_options
+@pass_client
+def report(client, node_filters, query, concurrency, renderer):
+    try:
+        nodes = list_matching_nodes(client, node_filters, query)
+    except DimensionDataAPIException as e:
+        handle_dd_api_exception(e)
+
+    def fetch(node, pool):
+        pool.throttle()
+        return client.worker_driver('backup').ex_get_backup_details_for_target(node.id)
+
+    summary = BackupReport()
+    pool = client.worker_pool(concurrency=concurrency)
+    for result in pool.imap(fetch, nodes):
+        serverid = result.item.id
+        if result.error is not None:
+            summary.failed += 1
+            click.secho("{0}: {1}".format(serverid, result.error), fg='red', err=True)
+            continue
+        details = result.value
+        summary.add(details)
+        if renderer.is_text:
+            renderer.render([details], None, lambda d: backup_summary_lines(serverid, d))
+        else:
+            clients = details.clients if details is not None and details.clients else [None]
+            renderer.render(clients, lambda c: backup_client_record(serverid, details, c), None)
+    # keep machine readable output clean
+    click.echo("\n".join([""] + summary.lines()), err=not renderer.is_text)
+
+
 @cli.command()
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to disable backups on')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
+@output_options
 @pass_client
-def info(client, serverid, serverfilteripv6):
+def info(client, serverid, serverfilteripv6, query, renderer):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_server_id_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
     try:
         details = client.backup.ex_get_backup_details_for_target(serverid)
-        click.secho("Backup Details for {0}".format(serverid))
-        click.secho("Service Plan: {0}".format(details.service_plan[0]))
-        if len(details.clients) > 0:
-            click.secho("Clients:")
-            for backup_client in details.clients:
-                click.secho("")
-                click.secho("{0}".format(backup_client.type), bold=True)
-                click.secho("Description: {0}".format(backup_client.description))
-                click.secho("Schedule: {0}".format(backup_client.schedule_policy))
-                click.secho("Retention: {0}".format(backup_client.storage_policy))
-                click.secho("DownloadURL: {0}".format(backup_client.download_url))
-                if backup_client.running_job is not None:
-                    click.secho("Running Job", bold=True)
-                    click.secho("ID: {0}".format(backup_client.running_job.id))
-                    click.secho("Status: {0}".format(backup_client.running_job.status))
-                    click.secho("Percentage Complete: {0}".format(backup_client.running_job.percentage))
+        if renderer.is_text:
+            renderer.render([details], None, lambda d: backup_details_lines(serverid, d))
+        else:
+            renderer.render(details.clients or [None], lambda c: backup_client_record(serverid, details, c), None)
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
 
@@ -81,10 +364,12 @@ def info(client, serverid, serverfilteripv6):
 @click.option('--triggerOn', type=click.UNPROCESSED, help='The server ID to list backup schedules for')
 @click.option('--notifyEmail', type=click.UNPROCESSED, help='The server ID to list backup schedules for')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def add_client(client, serverid, clienttype, storagepolicy, schedulepolicy, triggeron, notifyemail, serverfilteripv6):
+def add_client(client, serverid, clienttype, storagepolicy, schedulepolicy, triggeron, notifyemail, serverfilteripv6,
+               query):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_server_id_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
     try:
         client.backup.ex_add_client_to_target(serverid, clienttype, storagepolicy,
                                               schedulepolicy, triggeron, notifyemail)
@@ -97,22 +382,23 @@ def add_client(client, serverid, clienttype, storagepolicy, schedulepolicy, trig
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to list backup schedules for')
 @click.option('--clientType', required=True, help='The server ID to list backup schedules for')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def remove_client(client, serverid, clienttype, serverfilteripv6):
+def remove_client(client, serverid, clienttype, serverfilteripv6, query):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_node_from_filters(client, query=query, ex_ipv6=serverfilteripv6).id
     try:
         details = client.backup.ex_get_backup_details_for_target(serverid)
         if len(details.clients) <= 0:
             click.secho("No clients found for {0}".format(serverid), fg='red', bold=True)
-            exit(1)
+            sys.exit(1)
         else:
             for backup_client in details.clients:
                 if backup_client.type.type == clienttype:
                     client.backup.ex_remove_client_from_target(serverid, backup_client)
                     click.secho("Successfully removed client {0} from {1}".format(clienttype, serverid),
                                 fg='green', bold=True)
-                    exit(0)
+                    sys.exit(0)
             click.secho("Could not find a client {0} on {1}".format(clienttype, serverid), fg='red', bold=True)
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
@@ -121,15 +407,16 @@ def remove_client(client, serverid, clienttype, serverfilteripv6):
 @cli.command(help='Fetch Download URL for Server')
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to list backup schedules for')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def download_url(client, serverid, serverfilteripv6):
+def download_url(client, serverid, serverfilteripv6, query):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_server_id_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
     try:
         details = client.backup.ex_get_backup_details_for_target(serverid)
         if len(details.clients) < 1:
             click.secho("No clients configured so there is no backup url", fg='red', bold=True)
-            exit(1)
+            sys.exit(1)
         click.secho("{0}".format(details.clients[0].download_url))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
@@ -138,18 +425,19 @@ def download_url(client, serverid, serverfilteripv6):
 @cli.command(help='List client types available for server')
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to list backup client types for')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def list_available_client_types(client, serverid, serverfilteripv6):
+def list_available_client_types(client, serverid, serverfilteripv6, query):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_server_id_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
     try:
-        client_types = client.backup.ex_list_available_client_types(serverid)
+        client_types = available_backup_names(client, CLIENT_TYPES, serverid)
         if len(client_types) < 1:
             click.secho("No available clients types for {0}".format(serverid), fg='red', bold=True)
-            exit(1)
+            sys.exit(1)
         click.secho("Available Client Types:", bold=True)
         for client_type in client_types:
-            click.secho("{0}".format(client_type.type))
+            click.secho("{0}".format(client_type))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
 
@@ -157,18 +445,19 @@ def list_available_client_types(client, serverid, serverfilteripv6):
 @cli.command(help='List schedule policies for server')
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to list backup schedules for')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def list_available_schedule_policies(client, serverid, serverfilteripv6):
+def list_available_schedule_policies(client, serverid, serverfilteripv6, query):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_server_id_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
     try:
-        schedules = client.backup.ex_list_available_schedule_policies(serverid)
+        schedules = available_backup_names(client, SCHEDULE_POLICIES, serverid)
         if len(schedules) < 1:
             click.secho("No available schedules for {0}".format(serverid), fg='red', bold=True)
-            exit(1)
+            sys.exit(1)
         click.secho("Available Schedule Policies:", bold=True)
         for schedule in schedules:
-            click.secho("{0}".format(schedule.name))
+            click.secho("{0}".format(schedule))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
 
@@ -176,17 +465,18 @@ def list_available_schedule_policies(client, serverid, serverfilteripv6):
 @cli.command(help='List storage policies for server')
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to list backup storage polciies for')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def list_available_storage_policies(client, serverid, serverfilteripv6):
+def list_available_storage_policies(client, serverid, serverfilteripv6, query):
     if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
+        serverid = get_single_server_id_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
     try:
-        storage_policies = client.backup.ex_list_available_storage_policies(serverid)
+        storage_policies = available_backup_names(client, STORAGE_POLICIES, serverid)
         if len(storage_policies) < 1:
             click.secho("No available storage_policies for {0}".format(serverid), fg='red', bold=True)
-            exit(1)
+            sys.exit(1)
         click.secho("Available Storage Policies:", bold=True)
         for storage_policy in storage_policies:
-            click.secho("{0}".format(storage_policy.name))
+            click.secho("{0}".format(storage_policy))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
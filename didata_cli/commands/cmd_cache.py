@@ -0,0 +1,55 @@
+import click
+import sys
+from collections import OrderedDict
+from didata_cli.cli import pass_client
+from libcloud.common.dimensiondata import DimensionDataAPIException
+from didata_cli.catalog import BACKUP_LISTS
+from didata_cli.completion import remove_index, write_index
+from didata_cli.inventory import InventoryCache
+from didata_cli.utils import handle_dd_api_exception
+
+
+@click.group()
+@pass_client
+def cli(client):
+    """Clear or warm the server inventory and catalog caches"""
+
+
+@cli.command(help='Remove the cached servers, locations and backup policies')
+@pass_client
+def clear(client):
+    client.inventory.invalidate()
+    for region in client.regions:
+        if region != client.region:
+            InventoryCache.for_account(region, client.user).invalidate()
+        client.catalog(region).clear()
+        remove_index(region, client.user)
+    click.secho("Cleared the caches for {0}".format(', '.join(client.regions)), fg='green', bold=True)
+
+
+@cli.command(help='Cache the servers, locations and backup policies so later commands and shell completion '
+                  'do not have to ask the API')
+@pass_client
+def warm(client):
+    if not client.inventory.enabled:
+        click.secho("Nothing to warm with --noCache", fg='red', bold=True)
+        sys.exit(1)
+    try:
+        records = client.inventory.records(client.node)
+        click.secho("Servers: {0}".format(len(records)))
+        catalog = client.catalog()
+        click.secho("Locations: {0}".format(len(catalog.locations(client.node))))
+        # the policies only differ by datacenter and plan, so any one
+        # enrolled server stands in for the rest
+        groups = OrderedDict()
+        for record in records:
+            if record.get('backup_plan'):
+                groups.setdefault((record['datacenter'], record['backup_plan']), record['id'])
+        for (datacenter, service_plan), serverid in sorted(groups.items()):
+            counts = [len(catalog.backup_list(client.backup, kind, datacenter, service_plan, serverid))
+                      for kind in BACKUP_LISTS]
+            click.secho("Backup {0} in {1}: {2} client types, {3} storage policies, {4} schedule policies".format(
+                service_plan, datacenter, *counts))
+    except DimensionDataAPIException as e:
+        handle_dd_api_exception(e)
+    write_index(client.region, client.user)
@@ -0,0 +1,99 @@
+import click
+import time
+from collections import OrderedDict
+from didata_cli.cli import pass_client
+from libcloud.common.dimensiondata import DimensionDataAPIException
+from didata_cli.history import HistoryStore, INTERVALS, ADDED, CHANGED, parse_time, format_time
+from didata_cli.inventory import fetch_nodes, node_to_record
+from didata_cli.output import output_options
+from didata_cli.utils import handle_dd_api_exception
+
+
+@click.group()
+@pass_client
+def cli(client):
+    """Record and query the history of the servers"""
+
+
+def database_option(f):
+    return click.option('--database', type=click.Path(dir_okay=False),
+                        help="History database, history-<region>-<user>.sqlite in the cache directory by default")(f)
+
+
+def open_store(client, database):
+    if database:
+        return HistoryStore(database)
+    return HistoryStore.for_account(client.region, client.user)
+
+
+def _time_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_time(value)
+    except ValueError as e:
+        raise click.BadParameter("{0}".format(e))
+
+
+@cli.command(help='Append a snapshot of the servers to the history database, storing only what changed')
+@database_option
+@pass_client
+def record(client, database):
+    try:
+        records = [node_to_record(node) for node in fetch_nodes(client.node)]
+    except DimensionDataAPIException as e:
+        handle_dd_api_exception(e)
+    store = open_store(client, database)
+    try:
+        snapshot_id, counts = store.record(records)
+    finally:
+        store.close()
+    click.secho("Snapshot {0}: {1} servers, {2} added, {3} changed, {4} removed".format(
+        snapshot_id, len(records), *counts.values()), fg='green')
+
+
+def change_lines(change):
+    if change['change'] == ADDED:
+        detail = "{0} in {1}, {2}".format(change['name'], change['datacenter'], change['state'])
+    elif change['change'] == CHANGED:
+        detail = ", ".join("{0}: {1} -> {2}".format(field, old, new)
+                           for field, (old, new) in change.get('fields', {}).items())
+    else:
+        detail = change['name']
+    return ["{0} {1} {2}".format(change['time'], change['change'], detail)]
+
+
+def count_record(bucket):
+    start, counts = bucket
+    record = OrderedDict([('time', format_time(start))])
+    record.update(counts)
+    return record
+
+
+def count_lines(bucket):
+    start, counts = bucket
+    return ["{0}  {1}".format(format_time(start), "  ".join(
+        "{0}: {1}".format(datacenter, servers) for datacenter, servers in counts.items()))]
+
+
+@cli.command(help='Servers per datacenter over time, or when one server changed')
+@click.option('--since', default='30d', callback=_time_option,
+              help="UTC date or time, or an age like 30d or 12h (default 30d)")
+@click.option('--until', callback=_time_option, help="UTC date or time, or an age (default now)")
+@click.option('--interval', type=click.Choice(list(INTERVALS)), default='day', help="Period to count servers per")
+@click.option('--datacenterId', type=click.UNPROCESSED, help="Only count the servers in this datacenter")
+@click.option('--serverId', type=click.UNPROCESSED, help="Show the changes to this server instead of counts")
+@database_option
+@output_options
+@pass_client
+def history(client, since, until, interval, datacenterid, serverid, database, renderer):
+    until = time.time() if until is None else until
+    store = open_store(client, database)
+    try:
+        if serverid:
+            renderer.render(store.server_changes(serverid, since, until), lambda change: change, change_lines)
+        else:
+            renderer.render(store.datacenter_counts(since, until, INTERVALS[interval], datacenterid),
+                            count_record, count_lines)
+    finally:
+        store.close()
@@ -1,25 +1,44 @@
 import click
+from collections import OrderedDict
 from didata_cli.cli import pass_client
 from libcloud.common.dimensiondata import DimensionDataAPIException
+from didata_cli.output import output_options
+from didata_cli.regions import render_regions
 from didata_cli.utils import handle_dd_api_exception
 
 
 @click.group()
 @pass_client
 def cli(client):
-    pass
+    """List datacenter locations"""
+
+
+def location_lines(location):
+    return [
+        click.style("{0}".format(location.name), bold=True),
+        "ID: {0}".format(location.id),
+        "Description: {0}".format(location.country),
+        "",
+    ]
+
+
+def location_record(location):
+    return OrderedDict([
+        ('id', location.id),
+        ('name', location.name),
+        ('country', location.country),
+    ])
 
 
 @cli.command()
 @click.option('--datacenterId', type=click.UNPROCESSED, help="Filter by datacenter Id")
+@output_options
 @pass_client
-def list(client, datacenterid):
+def list(client, datacenterid, renderer):
+    def fetch(driver):
+        locations = client.catalog(driver.region).locations(driver)
+        return [[location for location in locations if datacenterid in (None, location.id)]]
     try:
-        locations = client.node.list_locations(ex_id=datacenterid)
-        for location in locations:
-            click.secho("{0}".format(location.name), bold=True)
-            click.secho("ID: {0}".format(location.id))
-            click.secho("Description: {0}".format(location.country))
-            click.secho("")
+        render_regions(client, renderer, fetch, location_record, location_lines)
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
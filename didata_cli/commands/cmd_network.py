@@ -1,29 +1,120 @@
 import click
+import sys
+from collections import OrderedDict
 from didata_cli.cli import pass_client
-from libcloud.common.dimensiondata import DimensionDataAPIException
+from libcloud.common.dimensiondata import DimensionDataAPIException, DimensionDataNetwork, \
+    DimensionDataNetworkDomain
+from libcloud.compute.base import NodeLocation
+from didata_cli.completion import write_index
+from didata_cli.history import format_time
+from didata_cli.output import output_options
+from didata_cli.regions import render_regions
+from didata_cli.topology import TopologySnapshot, SnapshotMissing, KINDS, fetch_records
 from didata_cli.utils import handle_dd_api_exception
 
 
 @click.group()
 @pass_client
 def cli(client):
-    pass
+    """Manage networks and network domains"""
+
+
+def network_domain_lines(network_domain):
+    return [
+        click.style("{0}".format(network_domain.name), bold=True),
+        "ID: {0}".format(network_domain.id),
+        "Description: {0}".format(network_domain.description),
+        "Plan: {0}".format(network_domain.plan),
+        "Location: {0}".format(network_domain.location.id),
+        "Status: {0}".format(network_domain.status),
+        "",
+    ]
+
+
+def network_domain_record(network_domain):
+    return OrderedDict([
+        ('id', network_domain.id),
+        ('name', network_domain.name),
+        ('description', network_domain.description),
+        ('plan', network_domain.plan),
+        ('location', network_domain.location.id),
+        ('status', network_domain.status),
+    ])
+
+
+def network_lines(network):
+    return [
+        click.style("{0}".format(network.name), bold=True),
+        "ID: {0}".format(network.id),
+        "Description: {0}".format(network.description),
+        "PrivateNet: {0}".format(network.private_net),
+        "Location: {0}".format(network.location.id),
+        "",
+    ]
+
+
+def network_record(network):
+    return OrderedDict([
+        ('id', network.id),
+        ('name', network.name),
+        ('description', network.description),
+        ('privateNet', network.private_net),
+        ('location', network.location.id),
+    ])
+
+
+def snapshot_location(location_id):
+    return NodeLocation(location_id, location_id, None, None)
+
+
+def snapshot_network_domain(record):
+    return DimensionDataNetworkDomain(record['id'], record['name'], record['description'],
+                                      snapshot_location(record['location']), record['status'], record['plan'])
+
+
+def snapshot_network(record):
+    return DimensionDataNetwork(record['id'], record['name'], record['description'],
+                                snapshot_location(record['location']), record['privateNet'], record['multicast'], None)
+
+
+def load_snapshot(client, region, datacenter=None):
+    topology = TopologySnapshot.for_account(region, client.user).require(region)
+    if datacenter is not None and datacenter not in topology.datacenters:
+        # listing it would look like a datacenter without any networks
+        raise SnapshotMissing("{0} is not in the network snapshot for {1}, run network snapshot --datacenterId {0}"
+                              .format(datacenter, region))
+    return topology
+
+
+def snapshot_note(region, topology, datacenter=None):
+    return "From the network snapshot of {0} taken {1}".format(region, format_time(topology.taken(datacenter)))
 
 
 @cli.command()
 @click.option('--datacenterId', type=click.UNPROCESSED, help="Filter by datacenter Id")
+@click.option('--fromSnapshot', is_flag=True, default=False, help="Answer from the saved network snapshot")
+@output_options
 @pass_client
-def list_network_domains(client, datacenterid):
+def list_network_domains(client, datacenterid, fromsnapshot, renderer):
+    snapshots = {}
+    if fromsnapshot:
+        try:
+            for region in client.regions:
+                snapshots[region] = load_snapshot(client, region, datacenterid)
+        except SnapshotMissing as e:
+            click.secho("{0}".format(e), fg='red', bold=True)
+            sys.exit(1)
+        if renderer.is_text:
+            for region in client.regions:
+                click.secho(snapshot_note(region, snapshots[region], datacenterid), bold=True)
+
+    def fetch(driver):
+        if fromsnapshot:
+            return [[snapshot_network_domain(record)
+                     for record in snapshots[driver.region].network_domains(datacenterid)]]
+        return [driver.ex_list_network_domains(location=datacenterid)]
     try:
-        network_domains = client.node.ex_list_network_domains(location=datacenterid)
-        for network_domain in network_domains:
-            click.secho("{0}".format(network_domain.name), bold=True)
-            click.secho("ID: {0}".format(network_domain.id))
-            click.secho("Description: {0}".format(network_domain.description))
-            click.secho("Plan: {0}".format(network_domain.plan))
-            click.secho("Location: {0}".format(network_domain.location.id))
-            click.secho("Status: {0}".format(network_domain.status))
-            click.secho("")
+        render_regions(client, renderer, fetch, network_domain_record, network_domain_lines)
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
 
@@ -43,19 +134,92 @@ def create_network(client, datacenterid, name):
 
 @cli.command()
 @click.option('--datacenterId', type=click.UNPROCESSED, help="Filter by datacenter Id")
+@click.option('--fromSnapshot', is_flag=True, default=False, help="Answer from the saved network snapshot")
+@output_options
 @pass_client
-def list_networks(client, datacenterid):
+def list_networks(client, datacenterid, fromsnapshot, renderer):
     try:
-        networks = client.node.ex_list_networks(location=datacenterid)
-        for network in networks:
-            click.secho("{0}".format(network.name), bold=True)
-            click.secho("ID: {0}".format(network.id))
-            click.secho("Description: {0}".format(network.description))
-            click.secho("PrivateNet: {0}".format(network.private_net))
-            click.secho("Location: {0}".format(network.location.id))
-            click.secho("")
+        if fromsnapshot:
+            snapshot = load_snapshot(client, client.region, datacenterid)
+            if renderer.is_text:
+                click.secho(snapshot_note(client.region, snapshot, datacenterid), bold=True)
+            networks = [snapshot_network(record) for record in snapshot.networks(datacenterid)]
+        else:
+            networks = client.node.ex_list_networks(location=datacenterid)
+        renderer.render(networks, network_record, network_lines)
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
+    except SnapshotMissing as e:
+        click.secho("{0}".format(e), fg='red', bold=True)
+        sys.exit(1)
+
+
+@cli.command(help='Save the network domains, networks, VLANs and servers of datacenters for --fromSnapshot')
+@click.option('--datacenterId', 'datacenterids', multiple=True, type=click.UNPROCESSED,
+              help="Datacenter to snapshot, can be repeated; all of them by default")
+@click.option('--concurrency', type=int, default=8, help="Number of API requests to make at once")
+@pass_client
+def snapshot(client, datacenterids, concurrency):
+    try:
+        datacenters = list(datacenterids) or [location.id for location in client.catalog().locations(client.node)]
+    except DimensionDataAPIException as e:
+        handle_dd_api_exception(e)
+    records = dict((kind, []) for kind in KINDS)
+    failures = 0
+    # every kind in every datacenter at once
+    tasks = [(kind, datacenter) for datacenter in datacenters for kind in KINDS]
+    pool = client.worker_pool(concurrency=concurrency)
+    for result in pool.imap(lambda task, pool: fetch_records(client.worker_driver(), *task), tasks):
+        kind, datacenter = result.item
+        if result.error is None:
+            records[kind].extend(result.value)
+        else:
+            failures += 1
+            click.secho("Listing {0} in {1} failed: {2}".format(kind, datacenter, result.error), fg='red')
+    if failures:
+        # a partial snapshot would answer with missing resources
+        click.secho("Snapshot not saved", fg='red', bold=True)
+        sys.exit(1)
+    for kind in KINDS:
+        records[kind].sort(key=lambda record: record['id'])
+    topology = TopologySnapshot.for_account(client.region, client.user).save(datacenters, records)
+    # completion offers the network domain and VLAN names from the snapshot
+    write_index(client.region, client.user)
+    for datacenter in datacenters:
+        click.secho("{0}: {1} network domains, {2} networks, {3} VLANs, {4} servers".format(
+            datacenter, *topology.counts(datacenter)))
+
+
+@cli.command(help='Show the network domains, VLANs and servers in the network snapshot')
+@click.option('--datacenterId', type=click.UNPROCESSED, help="Filter by datacenter Id")
+@click.option('--ip', help="Only show the server with this IP address and where it is connected")
+@pass_client
+def topology(client, datacenterid, ip):
+    try:
+        snapshot = load_snapshot(client, client.region, datacenterid)
+    except SnapshotMissing as e:
+        click.secho("{0}".format(e), fg='red', bold=True)
+        sys.exit(1)
+    if ip:
+        server = snapshot.server_by_ip.get(ip)
+        if server is None:
+            click.secho("No server with IP {0} in the network snapshot".format(ip), fg='red', bold=True)
+            sys.exit(1)
+        vlan = snapshot.vlan_by_id.get(server['vlan']) or {'name': None}
+        network_domain = snapshot.network_domain_by_id.get(server['network_domain']) or {'name': None}
+        click.secho("{0}".format(server['name']), bold=True)
+        click.secho("ID: {0}".format(server['id']))
+        click.secho("VLAN: {0} ({1})".format(vlan['name'], server['vlan']))
+        click.secho("Network Domain: {0} ({1})".format(network_domain['name'], server['network_domain']))
+        click.secho("Location: {0}".format(server['datacenter']))
+        return
+    for network_domain, vlans in snapshot.tree(datacenterid):
+        click.secho("{0} ({1}) {2}".format(network_domain['name'], network_domain['id'], network_domain['location']),
+                    bold=True)
+        for vlan, servers in vlans:
+            click.secho("  {0} ({1}) {2}".format(vlan['name'], vlan['id'], vlan['privateIpv4Range']))
+            for server in servers:
+                click.secho("    {0} ({1}) {2}".format(server['name'], server['id'], ', '.join(server['ipv4'])))
 
 
 @cli.command()
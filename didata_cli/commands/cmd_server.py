@@ -1,57 +1,95 @@
 import click
+from collections import OrderedDict
+import json
+import sys
 from didata_cli.cli import pass_client
+from didata_cli.inventory import node_to_record
+from didata_cli.nodes import SUMMARY_FIELDS, RECORD_FIELDS
 from libcloud.common.dimensiondata import DimensionDataAPIException
-from didata_cli.utils import handle_dd_api_exception, get_single_server_id_from_filters
+from didata_cli.output import output_options, plain
+from didata_cli.query import FIELDS
+from didata_cli.regions import render_regions
+from didata_cli.stats import FleetStats, METRICS, DEFAULT_PERCENTILES
+from didata_cli.waiter import wait_options, wait_for_nodes, get_node_or_none, RUNNING, STOPPED, DELETED
+from didata_cli.watch import Watcher
+from didata_cli.utils import handle_dd_api_exception, get_single_node_from_filters, server_filter_options, \
+    iter_node_pages, flattenDict, get_bulk_targets, query_option, MAX_PAGE_SIZE
 
 
 @click.group()
 @pass_client
 def cli(client):
-    pass
+    """Manage servers"""
+
+
+def node_lines(node, dumpall=False):
+    lines = [
+        click.style("{0}".format(node.name), bold=True),
+        "ID: {0}".format(node.id),
+        "Datacenter: {0}".format(node.extra['datacenterId']),
+        "OS: {0}".format(node.extra['OS_displayName']),
+        "Private IPv4: {0}".format(" - ".join(node.private_ips)),
+    ]
+    if 'ipv6' in node.extra:
+        lines.append("Private IPv6: {0}".format(node.extra['ipv6']))
+    if dumpall:
+        lines.append("Public IPs: {0}".format(" - ".join(node.public_ips)))
+        lines.append("State: {0}".format(node.state))
+        for key in sorted(node.extra):
+            if key == 'cpu':
+                lines.append("CPU Count: {0}".format(node.extra[key].cpu_count))
+                lines.append("Cores per Socket: {0}".format(node.extra[key].cores_per_socket))
+                lines.append("CPU Performance: {0}".format(node.extra[key].performance))
+                continue
+            if key not in ['datacenterId', 'status', 'OS_displayName']:
+                lines.append("{0}: {1}".format(key, node.extra[key]))
+    lines.append("")
+    return lines
+
+
+# the columns node_record has without dumpall
+SUMMARY_COLUMNS = ['id', 'name', 'datacenterId', 'OS_displayName', 'privateIpv4', 'ipv6']
+
+
+def node_record(node, dumpall=False):
+    record = OrderedDict([
+        ('id', node.id),
+        ('name', node.name),
+        ('datacenterId', node.extra['datacenterId']),
+        ('OS_displayName', node.extra['OS_displayName']),
+        ('privateIpv4', node.private_ips),
+        ('ipv6', node.extra.get('ipv6')),
+    ])
+    if dumpall:
+        record['publicIps'] = node.public_ips
+        record['state'] = node.state
+        extra = flattenDict(plain(node.extra))
+        for key in sorted(extra):
+            record.setdefault(key, extra[key])
+    return record
 
 
 @cli.command()
-@click.option('--datacenterId', type=click.UNPROCESSED, help="Filter by datacenter Id")
-@click.option('--networkDomainId', help="Filter by network domain Id")
-@click.option('--networkId', help="Filter by network id")
-@click.option('--vlanId', help="Filter by vlan id")
-@click.option('--sourceImageId', help="Filter by source image id")
-@click.option('--deployed', help="Filter by deployed state")
-@click.option('--name', help="Filter by server name")
-@click.option('--state', help="Filter by state")
-@click.option('--started', help="Filter by started")
-@click.option('--ipv6', help="Filter by ipv6")
-@click.option('--privateIpv4', help="Filter by private ipv4")
+@server_filter_options
 @click.option('--dumpall', is_flag=True, default=False, help="Dump all attributes about the server")
+@click.option('--pageSize', type=click.IntRange(1, MAX_PAGE_SIZE), default=MAX_PAGE_SIZE,
+              help="Number of servers to fetch per API request")
+@click.option('--limit', type=click.IntRange(1), help="Stop after this many servers")
+@output_options
 @pass_client
-def list(client, datacenterid, networkdomainid, networkid,
-         vlanid, sourceimageid, deployed, name,
-         state, started,
-         ipv6, privateipv4, dumpall):
-    node_list = client.node.list_nodes(ex_location=datacenterid, ex_name=name, ex_network=networkid,
-                                       ex_network_domain=networkdomainid, ex_vlan=vlanid,
-                                       ex_image=sourceimageid, ex_deployed=deployed, ex_started=started,
-                                       ex_state=state, ex_ipv6=ipv6, ex_ipv4=privateipv4)
-    for node in node_list:
-        click.secho("{0}".format(node.name), bold=True)
-        click.secho("ID: {0}".format(node.id))
-        click.secho("Datacenter: {0}".format(node.extra['datacenterId']))
-        click.secho("OS: {0}".format(node.extra['OS_displayName']))
-        click.secho("Private IPv4: {0}".format(" - ".join(node.private_ips)))
-        if 'ipv6' in node.extra:
-            click.secho("Private IPv6: {0}".format(node.extra['ipv6']))
-        if dumpall:
-            click.secho("Public IPs: {0}".format(" - ".join(node.public_ips)))
-            click.secho("State: {0}".format(node.state))
-            for key in sorted(node.extra):
-                if key == 'cpu':
-                    click.echo("CPU Count: {0}".format(node.extra[key].cpu_count))
-                    click.echo("Cores per Socket: {0}".format(node.extra[key].cores_per_socket))
-                    click.echo("CPU Performance: {0}".format(node.extra[key].performance))
-                    continue
-                if key not in ['datacenterId', 'status', 'OS_displayName']:
-                    click.echo("{0}: {1}".format(key, node.extra[key]))
-        click.secho("")
+def list(client, node_filters, query, dumpall, pagesize, limit, renderer):
+    # any column can be picked, so build the full record when other columns are chosen
+    full_record = dumpall or not set(renderer.columns or []) <= set(SUMMARY_COLUMNS)
+    # only parse what will be printed, unless everything will be
+    fields = None if full_record else SUMMARY_FIELDS
+    try:
+        # with several regions --limit applies to each of them
+        render_regions(client, renderer,
+                       lambda driver: iter_node_pages(driver, page_size=pagesize, limit=limit, query=query,
+                                                      fields=fields, **node_filters),
+                       lambda node: node_record(node, full_record), lambda node: node_lines(node, dumpall))
+    except DimensionDataAPIException as e:
+        handle_dd_api_exception(e)
 
 
 @cli.command()
@@ -62,46 +100,60 @@ def list(client, datacenterid, networkdomainid, networkid,
 @click.option('--administratorPassword', required=True, type=click.UNPROCESSED, help="The administrator password")
 @click.option('--networkDomainId', required=True, type=click.UNPROCESSED, help="The network domain Id to deploy on")
 @click.option('--vlanId', required=True, help="The vlan Id to deploy on")
+@wait_options
 @pass_client
-def create(client, name, description, imageid, autostart, administratorpassword, networkdomainid, vlanid):
+def create(client, name, description, imageid, autostart, administratorpassword, networkdomainid, vlanid,
+           wait, waittimeout):
     try:
         response = client.node.create_node(name, imageid, administratorpassword,
                                            description, ex_network_domain=networkdomainid,
                                            ex_vlan=vlanid, ex_is_started=autostart)
+        client.inventory.invalidate()
         click.secho("Node starting up: {0}.  IPv6: {1}".format(response.id, response.extra['ipv6']),
                     fg='green', bold=True)
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
+    if wait:
+        wait_for_nodes(client.node, [(response, RUNNING if autostart else STOPPED)], waittimeout)
 
 
 @cli.command()
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to destroy')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
+@wait_options
 @pass_client
-def destroy(client, serverid, serverfilteripv6):
-    node = None
-    if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
-    node = client.node.ex_get_node_by_id(serverid)
+def destroy(client, serverid, serverfilteripv6, query, wait, waittimeout):
+    if serverid:
+        node = client.node.ex_get_node_by_id(serverid)
+    else:
+        node = get_single_node_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
+        serverid = node.id
     try:
         response = client.node.destroy_node(node)
+        client.inventory.invalidate()
         if response is True:
             click.secho("Server {0} is being destroyed".format(serverid), fg='green', bold=True)
         else:
             click.secho("Something went wrong with attempting to destroy {0}".format(serverid))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
+    if wait and response is True:
+        wait_for_nodes(client.node, [(node, DELETED)], waittimeout)
 
 
 @cli.command()
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to reboot')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
+@wait_options
 @pass_client
-def reboot(client, serverid, serverfilteripv6):
-    node = None
-    if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
-    node = client.node.ex_get_node_by_id(serverid)
+def reboot(client, serverid, serverfilteripv6, query, wait, waittimeout):
+    if serverid:
+        node = client.node.ex_get_node_by_id(serverid)
+    else:
+        node = get_single_node_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
+        serverid = node.id
     try:
         response = client.node.reboot_node(node)
         if response is True:
@@ -110,17 +162,21 @@ def reboot(client, serverid, serverfilteripv6):
             click.secho("Something went wrong with attempting to reboot {0}".format(serverid))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
+    if wait and response is True:
+        wait_for_nodes(client.node, [(node, RUNNING)], waittimeout)
 
 
 @cli.command()
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to reboot')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def reboot_hard(client, serverid, serverfilteripv6):
-    node = None
-    if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
-    node = client.node.ex_get_node_by_id(serverid)
+def reboot_hard(client, serverid, serverfilteripv6, query):
+    if serverid:
+        node = client.node.ex_get_node_by_id(serverid)
+    else:
+        node = get_single_node_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
+        serverid = node.id
     try:
         response = client.node.ex_reset(node)
         if response is True:
@@ -134,12 +190,15 @@ def reboot_hard(client, serverid, serverfilteripv6):
 @cli.command()
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to start')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
+@wait_options
 @pass_client
-def start(client, serverid, serverfilteripv6):
-    node = None
-    if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
-    node = client.node.ex_get_node_by_id(serverid)
+def start(client, serverid, serverfilteripv6, query, wait, waittimeout):
+    if serverid:
+        node = client.node.ex_get_node_by_id(serverid)
+    else:
+        node = get_single_node_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
+        serverid = node.id
     try:
         response = client.node.ex_start_node(node)
         if response is True:
@@ -148,17 +207,22 @@ def start(client, serverid, serverfilteripv6):
             click.secho("Something went wrong when attempting to start {0}".format(serverid))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
+    if wait and response is True:
+        wait_for_nodes(client.node, [(node, RUNNING)], waittimeout)
 
 
 @cli.command()
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to shutdown')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
+@wait_options
 @pass_client
-def shutdown(client, serverid, serverfilteripv6):
-    node = None
-    if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
-    node = client.node.ex_get_node_by_id(serverid)
+def shutdown(client, serverid, serverfilteripv6, query, wait, waittimeout):
+    if serverid:
+        node = client.node.ex_get_node_by_id(serverid)
+    else:
+        node = get_single_node_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
+        serverid = node.id
     try:
         response = client.node.ex_shutdown_graceful(node)
         if response is True:
@@ -167,17 +231,21 @@ def shutdown(client, serverid, serverfilteripv6):
             click.secho("Something went wrong when attempting to shutdown {0}".format(serverid))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
+    if wait and response is True:
+        wait_for_nodes(client.node, [(node, STOPPED)], waittimeout)
 
 
 @cli.command()
 @click.option('--serverId', type=click.UNPROCESSED, help='The server ID to shutdown')
 @click.option('--serverFilterIpv6', help='The filter for ipv6')
+@query_option
 @pass_client
-def shutdown_hard(client, serverid, serverfilteripv6):
-    node = None
-    if not serverid:
-        serverid = get_single_server_id_from_filters(client, ex_ipv6=serverfilteripv6)
-    node = client.node.ex_get_node_by_id(serverid)
+def shutdown_hard(client, serverid, serverfilteripv6, query):
+    if serverid:
+        node = client.node.ex_get_node_by_id(serverid)
+    else:
+        node = get_single_node_from_filters(client, query=query, ex_ipv6=serverfilteripv6)
+        serverid = node.id
     try:
         response = client.node.ex_power_off(node)
         if response is True:
@@ -186,3 +254,158 @@ def shutdown_hard(client, serverid, serverfilteripv6):
             click.secho("Something went wrong when attempting to shut down {0}".format(serverid))
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
+
+
+# action -> (driver method, description used in the summary, --wait target)
+POWER_ACTIONS = {
+    'start': ('ex_start_node', 'starting', RUNNING),
+    'shutdown': ('ex_shutdown_graceful', 'shutting down gracefully', STOPPED),
+    'shutdown_hard': ('ex_power_off', 'shutting down hard', STOPPED),
+    'reboot': ('reboot_node', 'being rebooted', RUNNING),
+    'reboot_hard': ('ex_reset', 'being rebooted', RUNNING),
+    'destroy': ('destroy_node', 'being destroyed', DELETED),
+}
+
+
+@cli.command(help='Run a power action against every server matching the filters')
+@click.option('--action', required=True, type=click.Choice(sorted(POWER_ACTIONS)), help="The power action to run")
+@server_filter_options
+@click.option('--serverIdFile', type=click.File('r'), help="File with one server ID per line")
+@click.option('--concurrency', type=int, default=10, help="Number of servers to act on at once")
+@click.option('--perDatacenter', type=int, help="Max servers in flight per datacenter")
+@wait_options
+@pass_client
+def bulk(client, action, node_filters, query, serveridfile, concurrency, perdatacenter, wait, waittimeout):
+    method, description, target_state = POWER_ACTIONS[action]
+    targets = get_bulk_targets(client, node_filters, serveridfile, query)
+
+    def run(target, pool):
+        driver = client.worker_driver('node')
+        node = target
+        if not hasattr(node, 'id'):
+            node = driver.ex_get_node_by_id(target)
+        with pool.key_slot(node.extra.get('datacenterId')):
+            response = getattr(driver, method)(node)
+        if response is not True:
+            raise RuntimeError("Something went wrong with attempting to {0}".format(action))
+        return node
+
+    failures = 0
+    accepted = []
+    pool = client.worker_pool(concurrency=concurrency, per_key_limit=perdatacenter)
+    if action == 'destroy':
+        client.inventory.invalidate()
+    for result in pool.imap(run, targets):
+        serverid = getattr(result.item, 'id', result.item)
+        if result.error is None:
+            accepted.append((result.value, target_state))
+            click.secho("Server {0} is {1}".format(serverid, description), fg='green')
+        else:
+            failures += 1
+            click.secho("Server {0} failed: {1}".format(serverid, result.error), fg='red')
+    click.secho("{0} succeeded, {1} failed".format(len(targets) - failures, failures),
+                fg='red' if failures else 'green', bold=True)
+    if wait and accepted:
+        wait_for_nodes(client.node, accepted, waittimeout)
+    if failures:
+        sys.exit(1)
+
+
+@cli.command(help='Print a JSON line for every server added, removed or changed between polls')
+@server_filter_options
+@click.option('--interval', type=click.IntRange(1), default=60, help="Seconds between polls of all the servers")
+@click.option('--maxInterval', type=click.IntRange(1),
+              help="Longest gap between polls while nothing changes, 4 x --interval by default")
+@click.option('--fastInterval', type=click.IntRange(1), default=5,
+              help="Seconds between polls of the servers with operations in progress")
+@click.option('--initial', is_flag=True, default=False, help="Start with an added event for every server")
+@click.option('--polls', type=click.IntRange(1), help="Stop after this many polls")
+@pass_client
+def watch(client, node_filters, query, interval, maxinterval, fastinterval, initial, polls):
+    def list_nodes():
+        for nodes in iter_node_pages(client.node, query=query, **node_filters):
+            for node in nodes:
+                yield node
+
+    watcher = Watcher(list_nodes, lambda node_id: get_node_or_none(client.node, node_id), interval=interval,
+                      fast_interval=fastinterval, max_interval=maxinterval)
+    try:
+        watcher.watch(lambda record: click.echo(json.dumps(record, separators=(',', ':'))), polls=polls,
+                      initial=initial)
+    except DimensionDataAPIException as e:
+        handle_dd_api_exception(e)
+    except KeyboardInterrupt:
+        pass
+
+
+def _group_by_option(ctx, param, value):
+    names = []
+    for name in value.split(','):
+        name = name.strip()
+        if name not in FIELDS:
+            raise click.BadParameter("Group by one or more of {0}".format(', '.join(sorted(FIELDS))))
+        # datacenter and datacenterId are the same field
+        if FIELDS[name] not in [FIELDS[other] for other in names]:
+            names.append(name)
+    return names
+
+
+def _percentiles_option(ctx, param, value):
+    try:
+        percentiles = [int(percent) for percent in value.split(',') if percent.strip()]
+    except ValueError:
+        percentiles = None
+    if not percentiles or not all(0 <= percent <= 100 for percent in percentiles):
+        raise click.BadParameter("Use comma separated whole numbers from 0 to 100, e.g. 50,95")
+    return percentiles
+
+
+STATS_LABELS = {'cpu': 'CPU Count', 'coresPerSocket': 'Cores per Socket', 'memoryGb': 'Memory GB', 'diskGb': 'Disk GB'}
+
+
+def stats_lines(row, group_by, percentiles):
+    lines = [
+        click.style(" / ".join("{0}".format(row[name]) for name in group_by), bold=True),
+        "Servers: {0}".format(row['servers']),
+    ]
+    for name, _ in METRICS:
+        lines.append("{0}: total {1}, {2}".format(STATS_LABELS[name], row['{0}Total'.format(name)], ", ".join(
+            "p{0} {1}".format(percent, row['{0}P{1}'.format(name, percent)]) for percent in percentiles)))
+    lines.append("")
+    return lines
+
+
+@cli.command(help='Count servers and total their CPUs, memory and disk, per datacenter or other fields')
+@server_filter_options
+@click.option('--groupBy', default='datacenter', callback=_group_by_option,
+              help="Comma separated query fields to group by, e.g. datacenter,os (default datacenter)")
+@click.option('--percentiles', default=','.join('{0}'.format(p) for p in DEFAULT_PERCENTILES),
+              callback=_percentiles_option, help="Comma separated percentiles to report (default 50,95)")
+@click.option('--fromInventory', is_flag=True, default=False,
+              help="Use the server inventory cache instead of listing the servers, only --query applies")
+@output_options
+@pass_client
+def stats(client, node_filters, query, groupby, percentiles, frominventory, renderer):
+    fleet = FleetStats([FIELDS[name] for name in groupby])
+    try:
+        if frominventory:
+            if any(value is not None for value in node_filters.values()):
+                click.secho("Only --query can select servers with --fromInventory", fg='red', bold=True)
+                sys.exit(1)
+            if query:
+                fleet.add(client.inventory.query(client.node, query))
+            else:
+                fleet.add(client.inventory.records(client.node))
+        else:
+            for nodes in iter_node_pages(client.node, query=query, fields=RECORD_FIELDS, **node_filters):
+                fleet.add(node_to_record(node) for node in nodes)
+    except DimensionDataAPIException as e:
+        handle_dd_api_exception(e)
+
+    def to_record(row):
+        record = OrderedDict((name, row.pop(field)) for name, field in zip(groupby, fleet.group_by))
+        record.update(row)
+        return record
+
+    renderer.render((to_record(row) for row in fleet.rows(percentiles)), lambda record: record,
+                    lambda record: stats_lines(record, groupby, percentiles))
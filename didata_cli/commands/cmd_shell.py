@@ -0,0 +1,76 @@
+import click
+import shlex
+from didata_cli.cli import pass_client, COMMANDS
+
+try:
+    # line editing and history for the prompt
+    import readline  # noqa: F401
+except ImportError:
+    pass
+
+try:
+    read_line = raw_input
+except NameError:
+    read_line = input
+
+SHELL_COMMANDS = [
+    ('help', 'List the commands'),
+    ('refresh', 'Rebuild the server inventory on next use'),
+    ('exit', 'Leave the shell'),
+]
+
+
+@click.command()
+@click.pass_context
+@pass_client
+def cli(client, ctx):
+    """Run commands interactively, keeping connections warm"""
+    root_ctx = ctx.parent
+    click.echo("Type help for the list of commands and exit to leave")
+    while True:
+        try:
+            line = read_line('didata> ')
+        except EOFError:
+            click.echo()
+            break
+        except KeyboardInterrupt:
+            click.echo()
+            continue
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            click.secho("{0}".format(e), fg='red', bold=True)
+            continue
+        if not args:
+            continue
+        if args[0] in ('exit', 'quit'):
+            break
+        if args[0] == 'help':
+            click.echo("\n".join("  {0:<10} {1}".format(name, help_text)
+                                 for name, help_text in COMMANDS + SHELL_COMMANDS if name != 'shell'))
+        elif args[0] == 'refresh':
+            client.inventory.invalidate()
+            client.inventory.refresh = True
+        else:
+            run_command(root_ctx, args)
+
+
+def run_command(root_ctx, args):
+    """Run one didata subcommand with the shell's client and connections."""
+    name = args[0]
+    command = root_ctx.command.get_command(root_ctx, name) if name != 'shell' else None
+    if command is None:
+        click.secho("No such command '{0}'".format(name), fg='red', bold=True)
+        return
+    try:
+        with command.make_context(name, args[1:], parent=root_ctx) as ctx:
+            command.invoke(ctx)
+    except click.ClickException as e:
+        e.show()
+    except click.Abort:
+        click.echo("Aborted!", err=True)
+    except (click.exceptions.Exit, SystemExit):
+        # --help, and commands that exit on errors
+        pass
+    except KeyboardInterrupt:
+        click.echo()
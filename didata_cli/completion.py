@@ -0,0 +1,291 @@
+import os
+import shlex
+import sys
+import time
+from didata_cli.inventory import get_cache_dir, account_key
+
+# `didata` answers value completions for OPTIONS from an index file before
+# click or libcloud are imported, so pressing Tab stays instant. The index
+# is rebuilt from the inventory, catalog and topology caches by a
+# background process once it is older than COMPLETION_TTL; everything else
+# is completed by click as usual.
+
+# how long before the index is rebuilt in the background
+COMPLETION_TTL = 60 * 60
+# a rebuild that has not finished by then is assumed to have died
+REFRESH_TIMEOUT = 10 * 60
+# same as didata_cli.cli.DEFAULT_REGION and didata_cli.regions.ALL_REGIONS,
+# which would import click
+DEFAULT_REGION = 'dd-na'
+ALL_REGIONS = 'all'
+
+SERVERS = 'servers'
+DATACENTERS = 'datacenters'
+NETWORK_DOMAINS = 'networkDomains'
+VLANS = 'vlans'
+CLIENT_TYPES = 'clientTypes'
+KINDS = [SERVERS, DATACENTERS, NETWORK_DOMAINS, VLANS, CLIENT_TYPES]
+# option -> list in the index
+OPTIONS = {
+    '--serverId': SERVERS,
+    '--datacenterId': DATACENTERS,
+    '--networkDomainId': NETWORK_DOMAINS,
+    '--vlanId': VLANS,
+    '--clientType': CLIENT_TYPES,
+}
+
+
+def index_path(region, user, kind):
+    return os.path.join(get_cache_dir(), 'completion-{0}.{1}'.format(account_key(region, user), kind))
+
+
+def _pairs(named):
+    # [value, description] sorted by value, from {value: name or None}
+    return [[value, named[value]] for value in sorted(named)]
+
+
+def _write_lines_atomic(path, lines):
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.writelines(lines)
+    os.rename(tmp_path, path)
+
+
+def build_index(region, user):
+    """The completion values found in the local caches of one region and user."""
+    from didata_cli.catalog import CatalogCache, CLIENT_TYPES as CATALOG_CLIENT_TYPES
+    from didata_cli.inventory import InventoryCache
+    from didata_cli.topology import TopologySnapshot
+    servers, datacenters, network_domains, vlans, client_types = {}, {}, {}, {}, {}
+    # ids hardly ever change, so an expired inventory is still worth offering
+    records = InventoryCache.for_account(region, user, ttl=float('inf')).load() or []
+    for record in records:
+        servers[record['id']] = record['name']
+        if record.get('datacenter'):
+            datacenters.setdefault(record['datacenter'], None)
+        if record.get('network_domain'):
+            network_domains.setdefault(record['network_domain'], None)
+        if record.get('vlan'):
+            vlans.setdefault(record['vlan'], None)
+    entries = CatalogCache.for_account(region, user).load()
+    for location_id, name, _ in entries.get('locations', {}).get('value', []):
+        datacenters[location_id] = name
+    for key, entry in entries.items():
+        if key.endswith('/' + CATALOG_CLIENT_TYPES):
+            for client_type in entry['value']:
+                client_types[client_type] = None
+    topology = TopologySnapshot.for_account(region, user).load()
+    if topology is not None:
+        for network_domain in topology.network_domains():
+            network_domains[network_domain['id']] = network_domain['name']
+        for vlan in topology.vlan_by_id.values():
+            vlans[vlan['id']] = vlan['name']
+    return {
+        SERVERS: _pairs(servers),
+        DATACENTERS: _pairs(datacenters),
+        NETWORK_DOMAINS: _pairs(network_domains),
+        VLANS: _pairs(vlans),
+        CLIENT_TYPES: _pairs(client_types),
+    }
+
+
+def write_index(region, user):
+    """Write a file per kind with a "value<tab>description" line per value, sorted by value."""
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, 0o700)
+    for kind, pairs in build_index(region, user).items():
+        _write_lines_atomic(index_path(region, user, kind), [
+            '{0}\t{1}\n'.format(value, ' '.join((description or '').split())) for value, description in pairs])
+
+
+def remove_index(region, user):
+    for kind in KINDS:
+        try:
+            os.remove(index_path(region, user, kind))
+        except OSError:
+            pass
+
+
+def refresh(region, user, password=None):
+    """Rebuild the index, first listing the servers and locations when they are not cached."""
+    if password:
+        from didata_cli.cli import DiDataCLIClient
+        client = DiDataCLIClient()
+        client.init_client(user, password, region)
+        try:
+            client.inventory.records(client.node)
+            client.catalog().locations(client.node)
+        except Exception:
+            # nobody is waiting on this process to report errors to, the
+            # index is built from whatever is cached
+            pass
+    write_index(region, user)
+
+
+def _refresh_in_background(region, user, environ):
+    lock_path = os.path.join(get_cache_dir(), 'completion-{0}.refreshing'.format(account_key(region, user)))
+    if not os.path.isdir(os.path.dirname(lock_path)):
+        os.makedirs(os.path.dirname(lock_path), 0o700)
+    try:
+        if time.time() - os.path.getmtime(lock_path) < REFRESH_TIMEOUT:
+            return
+        os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+    except OSError:
+        # another Tab press got there first
+        return
+    import subprocess
+    env = dict((key, value) for key, value in environ.items() if not key.startswith('_'))
+    devnull = open(os.devnull, 'r+')
+    try:
+        subprocess.Popen([sys.executable, '-m', 'didata_cli.completion', region, user, lock_path], env=env,
+                         stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+                         preexec_fn=getattr(os, 'setsid', None))
+    finally:
+        devnull.close()
+
+
+def _option_value(args, option):
+    for i, arg in enumerate(args):
+        if arg == option and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(option + '='):
+            return arg[len(option) + 1:]
+    return None
+
+
+def _index_files(region, user, kind):
+    """The index files of one kind for the region and user, or for all of either when None."""
+    if user and region:
+        return [index_path(region, user, kind)]
+    prefix = 'completion-{0}-'.format(region) if region else 'completion-'
+    # account_key is the region, a dash and a hash of the user
+    suffix = '{0}.{1}'.format(account_key('', user) if user else '', kind)
+    cache_dir = get_cache_dir()
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return []
+    return [os.path.join(cache_dir, name) for name in names if name.startswith(prefix) and name.endswith(suffix)]
+
+
+def matching_lines(text, incomplete):
+    """The lines of an index file whose value or description starts with ``incomplete``.
+
+    Searches the whole text for the prefix instead of splitting every line,
+    which keeps large fleets quick to complete.
+    """
+    if not incomplete:
+        return text.splitlines()
+    text = '\n' + text
+    found = {}
+    for marker in ('\n' + incomplete, '\t' + incomplete):
+        start = text.find(marker)
+        while start != -1:
+            line_start = text.rfind('\n', 0, start + 1) + 1
+            line_end = text.find('\n', start + 1)
+            found[line_start] = text[line_start:line_end]
+            start = text.find(marker, line_end)
+    return [found[line_start] for line_start in sorted(found)]
+
+
+def _completion_args(shell, environ):
+    # the same as click's BashComplete, ZshComplete and FishComplete
+    lex = shlex.shlex(environ['COMP_WORDS'], posix=True)
+    lex.whitespace_split = True
+    lex.commenters = ''
+    words = []
+    try:
+        for token in lex:
+            words.append(token)
+    except ValueError:
+        words.append(lex.token)
+    if shell == 'fish':
+        incomplete = environ['COMP_CWORD']
+        args = words[1:]
+        if incomplete and args and args[-1] == incomplete:
+            args.pop()
+        return args, incomplete
+    cword = int(environ['COMP_CWORD'])
+    return words[1:cword], words[cword] if cword < len(words) else ''
+
+
+def _format(shell, line):
+    # click's format_completion for a "value<tab>description" index line
+    value, _, description = line.partition('\t')
+    if shell == 'zsh':
+        return 'plain\n' + value + '\n' + (description or '_')
+    if shell == 'fish' and description:
+        return 'plain,' + line
+    return 'plain,' + value
+
+
+def _complete_var(prog_name):
+    # what click reads the completion instruction from
+    return '_{0}_COMPLETE'.format(prog_name.replace('-', '_').replace('.', '_').upper())
+
+
+def completing(prog_name, environ):
+    return bool(environ.get(_complete_var(prog_name)))
+
+
+def complete(prog_name, environ, out=None):
+    """Print the values for an OPTIONS completion request; False when click has to answer it."""
+    instruction = environ.get(_complete_var(prog_name), '')
+    shell, _, action = instruction.partition('_')
+    if action != 'complete' or shell not in ('bash', 'zsh', 'fish'):
+        return False
+    try:
+        args, incomplete = _completion_args(shell, environ)
+    except (KeyError, ValueError):
+        return False
+    # bash splits --serverId=abc into three words
+    if args and args[-1] == '=':
+        args = args[:-1]
+    option = args[-1] if args else None
+    if incomplete.startswith('--') and '=' in incomplete:
+        option, _, incomplete = incomplete.partition('=')
+    if option not in OPTIONS:
+        return False
+
+    user = _option_value(args, '--user') or environ.get('DIDATA_USER')
+    region = _option_value(args, '--region') or environ.get('DIDATA_REGION') or DEFAULT_REGION
+    region = None if region == ALL_REGIONS else region.split(',')[0].strip()
+    kind = OPTIONS[option]
+    if user and region:
+        try:
+            stale = time.time() - os.path.getmtime(index_path(region, user, kind)) > COMPLETION_TTL
+        except OSError:
+            stale = True
+        if stale:
+            background_environ = dict(environ)
+            password = _option_value(args, '--password')
+            if password:
+                background_environ['DIDATA_PASSWORD'] = password
+            _refresh_in_background(region, user, background_environ)
+
+    lines = []
+    for path in _index_files(region, user, kind):
+        try:
+            with open(path) as f:
+                text = f.read()
+        except (IOError, OSError):
+            continue
+        lines.extend(_format(shell, line) for line in matching_lines(text, incomplete))
+    out = out or sys.stdout
+    out.write('\n'.join(lines))
+    out.flush()
+    return True
+
+
+if __name__ == '__main__':
+    # started by _refresh_in_background: region, user, lock file
+    try:
+        refresh(sys.argv[1], sys.argv[2], os.environ.get('DIDATA_PASSWORD'))
+    finally:
+        os.remove(sys.argv[3])
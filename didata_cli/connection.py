@@ -0,0 +1,97 @@
+import threading
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+
+
+def default_adapter(size):
+    return HTTPAdapter(pool_connections=4, pool_maxsize=size)
+
+
+class ConnectionPool(object):
+    """One keep-alive HTTP session shared by every driver for a region.
+
+    libcloud gives each driver its own requests session, so the node and
+    backup drivers (and every worker thread's drivers) would otherwise each
+    open their own TLS connections to the same endpoint.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, adapter_factory=None, retry_policy=None):
+        self.session = Session()
+        self.adapter_factory = adapter_factory or default_adapter
+        # retries requests the API turns away, see didata_cli.retry
+        self.retry_policy = retry_policy
+        self.size = 0
+        self._retired = (0, 0)
+        self._lock = threading.Lock()
+        self.ensure_size(size)
+        self.connection_class = None
+
+    def ensure_size(self, size):
+        """Grow the pool so ``size`` threads can each keep a connection open."""
+        with self._lock:
+            if size <= self.size:
+                return
+            if self.size:
+                opened, requests = self._adapter_counts(self.session.get_adapter('https://'))
+                self._retired = (self._retired[0] + opened, self._retired[1] + requests)
+            adapter = self.adapter_factory(size)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.size = size
+
+    def attach(self, driver):
+        """Make ``driver`` send its requests through the shared session."""
+        connection = driver.connection
+        if getattr(connection.conn_class, 'session', False) is False:
+            # not a requests based libcloud connection
+            return driver
+        if self.connection_class is None or not issubclass(self.connection_class, connection.conn_class):
+            self.connection_class = self._connection_class(connection.conn_class)
+        connection.conn_class = self.connection_class
+        # libcloud connects while the driver is created, with a session of
+        # its own; drop that connection so the next request opens one with
+        # the shared session
+        connection.connection = None
+        return driver
+
+    def _connection_class(self, base):
+        pool = self
+
+        class SharedSessionConnection(base):
+            def __init__(self, *args, **kwargs):
+                super(SharedSessionConnection, self).__init__(*args, **kwargs)
+                pool.session.verify = self.session.verify
+                pool.session.proxies = self.session.proxies
+                pool.session.timeout = self.session.timeout
+                self.session = pool.session
+
+            def request(self, method, url, *args, **kwargs):
+                send = super(SharedSessionConnection, self).request
+                if pool.retry_policy is None or kwargs.get('stream'):
+                    return send(method, url, *args, **kwargs)
+                return pool.retry_policy.send(method, lambda: send(method, url, *args, **kwargs),
+                                              lambda: getattr(self, 'response', None))
+
+        return SharedSessionConnection
+
+    @staticmethod
+    def _adapter_counts(adapter):
+        opened = requests = 0
+        if not hasattr(adapter, 'poolmanager'):
+            # replayed responses never open a connection
+            return opened, requests
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            host_pool = pools[key]
+            opened += host_pool.num_connections
+            requests += host_pool.num_requests
+        return opened, requests
+
+    def stats(self):
+        """Return (connections opened, connections reused)."""
+        opened, requests = self._adapter_counts(self.session.get_adapter('https://'))
+        opened += self._retired[0]
+        requests += self._retired[1]
+        return opened, max(0, requests - opened)
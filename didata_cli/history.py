@@ -0,0 +1,196 @@
+import calendar
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime
+from didata_cli.inventory import get_cache_dir, account_key
+
+# inventory record fields kept for every server
+FIELDS = ['name', 'state', 'datacenter', 'cpu_count', 'memory_gb', 'ipv4', 'ipv6']
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+INTERVALS = OrderedDict([('hour', 3600), ('day', 86400)])
+
+# seconds to wait for another process recording into the same database
+BUSY_TIMEOUT = 30
+
+_RELATIVE = re.compile(r'^(\d+)([mhd])$')
+_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+# snapshots: one row per `inventory record`, ids increase with time
+# changes: only the servers that were added, changed or removed, keyed by
+#     server then snapshot so one server's history is a range scan
+# current: the latest state of every server, to diff the next snapshot with
+# datacenter_counts: servers per datacenter, written when the count changes
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken REAL NOT NULL,
+    servers INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_taken ON snapshots (taken);
+CREATE TABLE IF NOT EXISTS changes (
+    server_id TEXT NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    change TEXT NOT NULL,
+    name TEXT, state TEXT, datacenter TEXT, cpu_count INTEGER, memory_gb INTEGER, ipv4 TEXT, ipv6 TEXT,
+    PRIMARY KEY (server_id, snapshot_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS changes_snapshot ON changes (snapshot_id);
+CREATE TABLE IF NOT EXISTS current (
+    server_id TEXT PRIMARY KEY,
+    name TEXT, state TEXT, datacenter TEXT, cpu_count INTEGER, memory_gb INTEGER, ipv4 TEXT, ipv6 TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS datacenter_counts (
+    datacenter TEXT NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    servers INTEGER NOT NULL,
+    PRIMARY KEY (datacenter, snapshot_id)
+) WITHOUT ROWID;
+"""
+
+
+def parse_time(value, now=None):
+    """Seconds since the epoch for a UTC date or time, or a relative age like 30d, 12h or 90m."""
+    now = time.time() if now is None else now
+    match = _RELATIVE.match(value)
+    if match:
+        return now - int(match.group(1)) * _UNITS[match.group(2)]
+    for time_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(datetime.strptime(value, time_format).timetuple())
+        except ValueError:
+            pass
+    raise ValueError("'{0}' is not a date, time or age like 30d".format(value))
+
+
+def format_time(seconds):
+    return datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def history_row(record):
+    row = [record.get(field) for field in FIELDS]
+    row[FIELDS.index('ipv4')] = ' '.join(record['ipv4'])
+    return tuple(row)
+
+
+class HistoryStore(object):
+    """Append-only history of the servers in one region, in a SQLite database.
+
+    Every ``record`` stores a row for the snapshot plus one row per server
+    that was added, changed or removed since the previous snapshot, so a
+    year of frequent snapshots of a quiet fleet stays small.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0o700)
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def for_account(cls, region, user):
+        return cls(os.path.join(get_cache_dir(), 'history-{0}.sqlite'.format(account_key(region, user))))
+
+    def close(self):
+        self.db.close()
+
+    def record(self, records, taken=None):
+        """Append a snapshot of inventory ``records``, returning (snapshot id, {change: count})."""
+        taken = time.time() if taken is None else taken
+        rows = dict((record['id'], history_row(record)) for record in records)
+        counts = OrderedDict((change, 0) for change in (ADDED, CHANGED, REMOVED))
+        with self.db:
+            # take the write lock before reading current, so two processes
+            # recording at once cannot both diff against the same snapshot
+            self.db.execute('BEGIN IMMEDIATE')
+            previous = dict((row[0], tuple(row[1:])) for row in self.db.execute(
+                'SELECT server_id, {0} FROM current'.format(', '.join(FIELDS))))
+            snapshot_id = self.db.execute('INSERT INTO snapshots (taken, servers) VALUES (?, ?)',
+                                          (taken, len(rows))).lastrowid
+            changes = []
+            for server_id, row in rows.items():
+                old = previous.get(server_id)
+                if old != row:
+                    changes.append((server_id, snapshot_id, ADDED if old is None else CHANGED) + row)
+            for server_id, old in previous.items():
+                if server_id not in rows:
+                    changes.append((server_id, snapshot_id, REMOVED) + old)
+            for change in changes:
+                counts[change[2]] += 1
+            self.db.executemany('INSERT INTO changes VALUES ({0})'.format(', '.join('?' * (len(FIELDS) + 3))),
+                                changes)
+            self.db.executemany('DELETE FROM current WHERE server_id = ?',
+                                [(change[0],) for change in changes if change[2] == REMOVED])
+            self.db.executemany('INSERT OR REPLACE INTO current VALUES ({0})'.format(
+                ', '.join('?' * (len(FIELDS) + 1))),
+                [(change[0],) + change[3:] for change in changes if change[2] != REMOVED])
+            self._record_counts(snapshot_id, previous.values(), rows.values())
+        return snapshot_id, counts
+
+    def _record_counts(self, snapshot_id, old_rows, new_rows):
+        datacenter = FIELDS.index('datacenter')
+        old_counts, new_counts = {}, {}
+        for row in old_rows:
+            old_counts[row[datacenter]] = old_counts.get(row[datacenter], 0) + 1
+        for row in new_rows:
+            new_counts[row[datacenter]] = new_counts.get(row[datacenter], 0) + 1
+        self.db.executemany('INSERT INTO datacenter_counts VALUES (?, ?, ?)', [
+            (name, snapshot_id, new_counts.get(name, 0)) for name in set(old_counts) | set(new_counts)
+            if old_counts.get(name) != new_counts.get(name)])
+
+    def _snapshot_range(self, since, until):
+        return self.db.execute('SELECT min(id), max(id) FROM snapshots WHERE taken >= ? AND taken <= ?',
+                               (since, until)).fetchone()
+
+    def server_changes(self, server_id, since, until):
+        """Yield the changes to one server between two times, oldest first.
+
+        Each has the server's fields after the change and, for changed
+        servers, ``fields``: {field: [old value, new value]}.
+        """
+        first, last = self._snapshot_range(since, until)
+        if first is None:
+            return
+        columns = ', '.join('c.' + field for field in FIELDS)
+        previous = self.db.execute(
+            'SELECT {0} FROM changes c WHERE c.server_id = ? AND c.snapshot_id < ? '
+            'ORDER BY c.snapshot_id DESC LIMIT 1'.format(columns), (server_id, first)).fetchone()
+        rows = self.db.execute(
+            'SELECT s.taken, c.change, {0} FROM changes c JOIN snapshots s ON s.id = c.snapshot_id '
+            'WHERE c.server_id = ? AND c.snapshot_id BETWEEN ? AND ? ORDER BY c.snapshot_id'.format(columns),
+            (server_id, first, last))
+        for row in rows:
+            values = row[2:]
+            change = OrderedDict([('time', format_time(row[0])), ('id', server_id), ('change', row[1])])
+            change.update(zip(FIELDS, values))
+            if row[1] == CHANGED and previous is not None:
+                change['fields'] = OrderedDict((field, [old, new]) for field, old, new
+                                               in zip(FIELDS, previous, values) if old != new)
+            previous = values
+            yield change
+
+    def datacenter_counts(self, since, until, interval, datacenter=None):
+        """Yield (bucket start, {datacenter: servers}) for every ``interval`` seconds with a snapshot.
+
+        Counts are those of the last snapshot in each bucket.
+        """
+        datacenters = [datacenter] if datacenter else [row[0] for row in self.db.execute(
+            'SELECT DISTINCT datacenter FROM datacenter_counts ORDER BY datacenter')]
+        start = since - since % interval
+        while start <= until:
+            last = self.db.execute('SELECT max(id) FROM snapshots WHERE taken >= ? AND taken < ? AND taken <= ?',
+                                   (max(start, since), start + interval, until)).fetchone()[0]
+            if last is not None:
+                counts = OrderedDict()
+                for name in datacenters:
+                    row = self.db.execute(
+                        'SELECT servers FROM datacenter_counts WHERE datacenter = ? AND snapshot_id <= ? '
+                        'ORDER BY snapshot_id DESC LIMIT 1', (name, last)).fetchone()
+                    counts[name] = row[0] if row is not None else 0
+                yield start, counts
+            start += interval
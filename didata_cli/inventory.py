@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_TTL = 300
+
+# list_nodes keyword -> inventory record field
+FILTER_FIELDS = {
+    'ex_name': 'name',
+    'ex_ipv4': 'ipv4',
+    'ex_ipv6': 'ipv6',
+    'ex_location': 'datacenter',
+    'ex_network_domain': 'network_domain',
+}
+INDEXED_FIELDS = ['id', 'name', 'ipv4', 'ipv6', 'datacenter', 'network_domain', 'vlan', 'image', 'state', 'os',
+                  'cpu_count', 'cores_per_socket', 'memory_gb', 'disk_gb', 'backup_plan']
+
+
+def get_cache_dir():
+    cache_dir = os.environ.get('DIDATA_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.didata', 'cache')
+    return cache_dir
+
+
+def account_key(region, user):
+    return '{0}-{1}'.format(region, hashlib.sha1(user.encode('utf-8')).hexdigest()[:12])
+
+
+def write_json_atomic(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), 0o700)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.rename(tmp_path, path)
+
+
+def node_to_record(node):
+    memory_mb = node.extra.get('memoryMb')
+    disks = node.extra.get('disks')
+    return {
+        'id': node.id,
+        'name': node.name,
+        'ipv4': list(node.private_ips),
+        'ipv6': node.extra.get('ipv6'),
+        'datacenter': node.extra.get('datacenterId'),
+        'network_domain': node.extra.get('networkDomainId'),
+        'vlan': node.extra.get('vlanId'),
+        'image': node.extra.get('sourceImageId'),
+        'state': None if node.state is None else '{0}'.format(node.state),
+        'os': node.extra.get('OS_displayName'),
+        'cpu_count': getattr(node.extra.get('cpu'), 'cpu_count', None),
+        'cores_per_socket': getattr(node.extra.get('cpu'), 'cores_per_socket', None),
+        'memory_gb': None if memory_mb is None else int(memory_mb) // 1024,
+        'disk_gb': None if disks is None else sum(disk.size_gb for disk in disks),
+        'backup_plan': node.extra.get('backupServicePlan'),
+    }
+
+
+def fetch_nodes(driver):
+    """All the servers, with the details the inventory needs."""
+    from didata_cli.nodes import RECORD_FIELDS
+    from didata_cli.utils import iter_node_pages
+    for nodes in iter_node_pages(driver, fields=RECORD_FIELDS):
+        for node in nodes:
+            yield node
+
+
+class InventoryCache(object):
+    """On-disk index of the servers in one region for one user.
+
+    Used to turn server filters into server IDs without listing the whole
+    fleet from the API on every invocation.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, enabled=True, refresh=False):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled
+        self.refresh = refresh
+        self._records = None
+        self._index = None
+        self._created = 0
+        # whether the records came from the API in this process
+        self._fetched = False
+
+    @classmethod
+    def for_account(cls, region, user, **kwargs):
+        path = os.path.join(get_cache_dir(), 'inventory-{0}.json'.format(account_key(region, user)))
+        return cls(path, **kwargs)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if time.time() - data.get('created', 0) > self.ttl:
+            return None
+        self._created = data['created']
+        return data['nodes']
+
+    def save(self, records):
+        self._created = time.time()
+        write_json_atomic(self.path, {'created': self._created, 'nodes': records})
+
+    def invalidate(self):
+        self._records = None
+        self._index = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def records(self, driver):
+        if self._records is not None and time.time() - self._created > self.ttl:
+            # long running processes such as the shell outlive the ttl
+            self._records = None
+            self._index = None
+        if self._records is None:
+            if self.enabled and not self.refresh:
+                self._records = self.load()
+            if self._records is None:
+                self._records = [node_to_record(node) for node in fetch_nodes(driver)]
+                self._created = time.time()
+                self._fetched = True
+                if self.enabled:
+                    self.save(self._records)
+                self.refresh = False
+        return self._records
+
+    @property
+    def fetched(self):
+        """Whether the records were listed from the API by this process."""
+        return self._fetched
+
+    def cached_records(self):
+        """The records if the inventory is at hand, without listing the servers for them."""
+        if self._records is None and self.enabled and not self.refresh:
+            self._records = self.load()
+        return self._records or []
+
+    def cached(self, server_id):
+        """The record for a server if the inventory is at hand, without listing the servers for it."""
+        for record in self.cached_records():
+            if record['id'] == server_id:
+                return record
+        return None
+
+    def index(self, driver):
+        if self._index is None:
+            # imported here so shell completion can use this module cheaply
+            from didata_cli.query import NodeIndex
+            self._index = NodeIndex(self.records(driver), INDEXED_FIELDS)
+        return self._index
+
+    def find(self, driver, **filters):
+        """Return the cached records matching all the given list_nodes filters.
+
+        Returns None if the cache is disabled or a filter cannot be answered
+        from the cache, so the caller knows to ask the API instead.
+        """
+        filters = dict((key, value) for key, value in filters.items() if value is not None)
+        if not self.enabled or not filters or not set(filters) <= set(FILTER_FIELDS):
+            return None
+        index = self.index(driver)
+        matches = None
+        for key, value in filters.items():
+            found = dict((record['id'], record) for record in index.lookup(FILTER_FIELDS[key], value))
+            matches = found if matches is None else dict((k, v) for k, v in matches.items() if k in found)
+        return sorted(matches.values(), key=lambda record: record['id'])
+
+    def query(self, driver, predicates):
+        """Return the records matching all the query predicates, sorted by id.
+
+        Works without the on-disk cache too, indexing the servers in memory.
+        A cached inventory that matches nothing is refreshed once, in case
+        the servers were created after it was written.
+        """
+        matches = self.index(driver).select(predicates)
+        if not matches and not self._fetched:
+            self.invalidate()
+            matches = self.index(driver).select(predicates)
+        return matches
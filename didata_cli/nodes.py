@@ -0,0 +1,128 @@
+from libcloud.common.dimensiondata import TYPES_URN
+from libcloud.compute.drivers.dimensiondata import DimensionDataNodeDriver
+from libcloud.utils.xml import fixxpath
+
+# node.extra keys server list prints by default
+SUMMARY_FIELDS = ['datacenterId', 'OS_displayName', 'ipv6']
+# and the ones node_to_record needs, for the inventory and --query
+RECORD_FIELDS = SUMMARY_FIELDS + ['networkDomainId', 'vlanId', 'sourceImageId', 'cpu', 'memoryMb',
+                                  'disks', 'backupServicePlan']
+
+_SERVER = fixxpath('server', TYPES_URN)
+_NAME = fixxpath('name', TYPES_URN)
+_STATE = fixxpath('state', TYPES_URN)
+_STARTED = fixxpath('started', TYPES_URN)
+_ACTION = fixxpath('progress/action', TYPES_URN)
+_NETWORK_INFO = fixxpath('networkInfo', TYPES_URN)
+_PRIMARY_NIC = fixxpath('networkInfo/primaryNic', TYPES_URN)
+_NIC = fixxpath('nic', TYPES_URN)
+_PUBLIC_IP = fixxpath('publicIpAddress', TYPES_URN)
+_OS = fixxpath('guest/operatingSystem', TYPES_URN)
+_OLD_OS = fixxpath('operatingSystem', TYPES_URN)
+_SOURCE_IMAGE = fixxpath('sourceImageId', TYPES_URN)
+_MEMORY = fixxpath('memoryGb', TYPES_URN)
+_CPU = fixxpath('cpu', TYPES_URN)
+_DISK = fixxpath('disk', TYPES_URN)
+_BACKUP = fixxpath('backup', TYPES_URN)
+
+
+class NodeCpu(object):
+    __slots__ = ('cpu_count', 'cores_per_socket', 'performance')
+
+    def __init__(self, element):
+        self.cpu_count = int(element.get('count'))
+        self.cores_per_socket = int(element.get('coresPerSocket'))
+        self.performance = element.get('speed')
+
+    def __repr__(self):
+        return '<NodeCpu: cpu_count={0}>'.format(self.cpu_count)
+
+
+class NodeDisk(object):
+    __slots__ = ('id', 'scsi_id', 'size_gb', 'speed', 'state')
+
+    def __init__(self, element):
+        self.id = element.get('id')
+        self.scsi_id = int(element.get('scsiId'))
+        self.size_gb = int(element.get('sizeGb'))
+        self.speed = element.get('speed')
+        self.state = element.get('state')
+
+    def __repr__(self):
+        return '<NodeDisk: id={0}, size_gb={1}>'.format(self.id, self.size_gb)
+
+
+class NodeRecord(object):
+    """The parts of a server a listing needs, in place of libcloud's Node.
+
+    Has the same ``id``, ``name``, ``state``, ``private_ips``,
+    ``public_ips`` and ``extra`` attributes, but ``extra`` only holds the
+    fields that were asked for.
+    """
+    __slots__ = ('id', 'name', 'state', 'private_ips', 'public_ips', 'extra')
+
+    def __init__(self, id, name, state, private_ips, public_ips, extra):
+        self.id = id
+        self.name = name
+        self.state = state
+        self.private_ips = private_ips
+        self.public_ips = public_ips
+        self.extra = extra
+
+    def __repr__(self):
+        return '<NodeRecord: id={0}, name={1}>'.format(self.id, self.name)
+
+
+def _get(element, attribute):
+    return element.get(attribute) if element is not None else None
+
+
+def _os_display_name(element, nic):
+    operating_system = element.find(_OS)
+    if operating_system is None:
+        operating_system = element.find(_OLD_OS)
+    return _get(operating_system, 'displayName')
+
+
+def _memory_mb(element, nic):
+    memory_gb = element.findtext(_MEMORY)
+    return int(memory_gb) * 1024 if memory_gb is not None else None
+
+
+def _cpu(element, nic):
+    cpu = element.find(_CPU)
+    return NodeCpu(cpu) if cpu is not None else None
+
+
+# node.extra key -> function(server element, primary nic element)
+EXTRA_PARSERS = {
+    'datacenterId': lambda element, nic: element.get('datacenterId'),
+    'OS_displayName': _os_display_name,
+    'ipv6': lambda element, nic: _get(nic, 'ipv6'),
+    'networkDomainId': lambda element, nic: _get(element.find(_NETWORK_INFO), 'networkDomainId'),
+    'vlanId': lambda element, nic: _get(nic, 'vlanId'),
+    'sourceImageId': lambda element, nic: element.findtext(_SOURCE_IMAGE),
+    'memoryMb': _memory_mb,
+    'cpu': _cpu,
+    'disks': lambda element, nic: [NodeDisk(disk) for disk in element.findall(_DISK)],
+    'backupServicePlan': lambda element, nic: _get(element.find(_BACKUP), 'servicePlan'),
+}
+
+
+def parse_node(element, fields):
+    """A NodeRecord for a server element with just the ``fields`` of extra."""
+    nic = element.find(_PRIMARY_NIC)
+    if nic is None:
+        nic = element.find(_NIC)
+    private_ip = _get(nic, 'privateIpv4')
+    public_ip = element.findtext(_PUBLIC_IP)
+    state = DimensionDataNodeDriver._get_node_state(element.findtext(_STATE), element.findtext(_STARTED),
+                                                    element.findtext(_ACTION))
+    extra = dict((field, EXTRA_PARSERS[field](element, nic)) for field in fields)
+    return NodeRecord(element.get('id'), element.findtext(_NAME), state,
+                      [private_ip] if private_ip is not None else [],
+                      [public_ip] if public_ip is not None else [], extra)
+
+
+def parse_nodes(page, fields):
+    return [parse_node(element, fields) for element in page.findall(_SERVER)]
@@ -0,0 +1,132 @@
+import click
+import csv
+import functools
+import json
+from collections import OrderedDict
+from io import StringIO
+from didata_cli.profile import phase
+
+FORMATS = ['text', 'jsonl', 'csv', 'tsv']
+
+
+def output_options(f):
+    """Add --output and --columns to a command.
+
+    The command receives a ready to use ``renderer`` instead.
+    """
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        renderer = kwargs['renderer'] = Renderer(kwargs.pop('output'), kwargs.pop('columns'))
+        try:
+            return f(*args, **kwargs)
+        finally:
+            renderer.close()
+    wrapper = click.option('--columns', help="Comma separated columns to include in jsonl/csv/tsv output")(wrapper)
+    wrapper = click.option('--output', type=click.Choice(FORMATS), default='text', help="Output format")(wrapper)
+    return wrapper
+
+
+def plain(value):
+    """Turn libcloud objects into dicts and lists so they can be flattened."""
+    if isinstance(value, dict):
+        return dict((key, plain(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        return dict((key, plain(item)) for key, item in vars(value).items()
+                    if not key.startswith('_') and key != 'driver')
+    return value
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ' '.join('{0}'.format(item) for item in value)
+    return value
+
+
+class Renderer(object):
+    """Writes records as human text, JSON Lines, CSV or TSV.
+
+    ``render`` can be called once per page of results; every call is
+    serialised into one buffer and written with a single echo, and the
+    csv/tsv header is only written by the first call. Without
+    ``columns`` the records may not all have the same keys, so csv/tsv
+    rows are held until ``close`` and the header has every key seen.
+    """
+
+    def __init__(self, output='text', columns=None):
+        self.output = output
+        if columns:
+            columns = [column.strip() for column in columns.split(',') if column.strip()]
+        self.columns = columns or None
+        self._header_written = False
+        # csv/tsv without columns: key -> header position, and the rows so far
+        self._positions = OrderedDict()
+        self._rows = []
+
+    @property
+    def is_text(self):
+        return self.output == 'text'
+
+    def render(self, items, to_record, to_lines):
+        with phase('output'):
+            self._render(items, to_record, to_lines)
+
+    def _render(self, items, to_record, to_lines):
+        if self.is_text:
+            lines = []
+            for item in items:
+                lines.extend(to_lines(item))
+            if lines:
+                click.echo("\n".join(lines))
+            return
+        if self.columns is None and self.output != 'jsonl':
+            self._hold(items, to_record)
+            return
+        buf = StringIO()
+        if self.output == 'jsonl':
+            for item in items:
+                record = to_record(item)
+                if self.columns:
+                    record = OrderedDict((column, record.get(column)) for column in self.columns)
+                buf.write(json.dumps(record, default=str, separators=(',', ':')))
+                buf.write('\n')
+        else:
+            writer = self._writer(buf)
+            if not self._header_written:
+                writer.writerow(self.columns)
+                self._header_written = True
+            for item in items:
+                record = to_record(item)
+                writer.writerow([_cell(record.get(column)) for column in self.columns])
+        click.echo(buf.getvalue(), nl=False)
+
+    def _hold(self, items, to_record):
+        positions = self._positions
+        for item in items:
+            row = [''] * len(positions)
+            for key, value in to_record(item).items():
+                if key not in positions:
+                    positions[key] = len(positions)
+                    row.append('')
+                row[positions[key]] = _cell(value)
+            self._rows.append(row)
+
+    def _writer(self, buf):
+        return csv.writer(buf, dialect='excel-tab' if self.output == 'tsv' else 'excel', lineterminator='\n')
+
+    def close(self):
+        """Write the csv/tsv rows held back for the header."""
+        if not self._rows:
+            return
+        with phase('output'):
+            buf = StringIO()
+            writer = self._writer(buf)
+            writer.writerow(list(self._positions))
+            width = len(self._positions)
+            for row in self._rows:
+                writer.writerow(row + [''] * (width - len(row)))
+            self._rows = []
+            click.echo(buf.getvalue(), nl=False)
@@ -0,0 +1,323 @@
+import json
+import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from didata_cli.waiter import Waiter, NodePoller, BackupPoller, DEFAULT_TIMEOUT, RUNNING, STOPPED, BACKUP_ENABLED
+
+# step outcomes
+CREATED = 'created'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+# what a --dryRun would do
+WOULD_CREATE = 'would create'
+
+NETWORK_READY = 'NORMAL'
+
+Step = namedtuple('Step', ['key', 'requires', 'run'])
+StepResult = namedtuple('StepResult', ['key', 'status', 'detail', 'elapsed'])
+
+
+class PlanError(ValueError):
+    pass
+
+
+class StepFailed(Exception):
+    pass
+
+
+def load_plan(f):
+    """Read a YAML plan, or a JSON one when PyYAML is not installed."""
+    text = f.read()
+    try:
+        import yaml
+    except ImportError:
+        try:
+            return json.loads(text)
+        except ValueError:
+            raise PlanError("Cannot parse the plan as JSON; install PyYAML to use YAML plans")
+    try:
+        return yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise PlanError("Cannot parse the plan: {0}".format(e))
+
+
+def _require(item, keys, what):
+    missing = [key for key in keys if not item.get(key)]
+    if missing:
+        raise PlanError("{0} {1} is missing {2}".format(what, item.get('name', '?'), ', '.join(missing)))
+
+
+def _by_name(items, what):
+    names = OrderedDict()
+    for item in items:
+        if not isinstance(item, dict):
+            raise PlanError("Every one of the {0}s must be a mapping".format(what))
+        _require(item, ['name'], what)
+        if item['name'] in names:
+            raise PlanError("{0} {1} is declared twice".format(what, item['name']))
+        names[item['name']] = item
+    return names
+
+
+class Plan(object):
+    """The network domains, VLANs, servers and backups an environment should have.
+
+    Resources refer to each other by their name in the plan.
+    """
+
+    def __init__(self, data):
+        if not isinstance(data, dict):
+            raise PlanError("The plan must be a mapping of networkDomains, vlans and servers")
+        unknown = set(data) - set(['networkDomains', 'vlans', 'servers'])
+        if unknown:
+            raise PlanError("Unknown plan sections: {0}".format(', '.join(sorted(unknown))))
+        self.network_domains = _by_name(data.get('networkDomains') or [], 'networkDomain')
+        self.vlans = _by_name(data.get('vlans') or [], 'vlan')
+        self.servers = _by_name(data.get('servers') or [], 'server')
+        for domain in self.network_domains.values():
+            _require(domain, ['datacenterId'], 'networkDomain')
+        for vlan in self.vlans.values():
+            _require(vlan, ['networkDomain', 'privateIpv4BaseAddress'], 'vlan')
+            if vlan['networkDomain'] not in self.network_domains:
+                raise PlanError("vlan {0} needs unknown networkDomain {1}".format(vlan['name'], vlan['networkDomain']))
+        for server in self.servers.values():
+            _require(server, ['vlan', 'imageId', 'administratorPassword'], 'server')
+            if server['vlan'] not in self.vlans:
+                raise PlanError("server {0} needs unknown vlan {1}".format(server['name'], server['vlan']))
+            backup = server.get('backup')
+            if backup is not None:
+                _require(backup, ['servicePlan'], 'backup of server')
+                for backup_client in backup.get('clients') or []:
+                    _require(backup_client,
+                             ['clientType', 'storagePolicy', 'schedulePolicy', 'triggerOn', 'notifyEmail'],
+                             'backup client of server {0}'.format(server['name']))
+
+    def steps(self):
+        """The plan's Steps in dependency order, keyed by '<kind>:<name>'."""
+        steps = OrderedDict()
+        for name in self.network_domains:
+            key = 'networkDomain:' + name
+            steps[key] = Step(key, [], lambda runner, dry_run, name=name: runner.network_domain(name, dry_run))
+        for name, vlan in self.vlans.items():
+            key = 'vlan:' + name
+            steps[key] = Step(key, ['networkDomain:' + vlan['networkDomain']],
+                              lambda runner, dry_run, name=name: runner.vlan(name, dry_run))
+        for name, server in self.servers.items():
+            key = 'server:' + name
+            steps[key] = Step(key, ['vlan:' + server['vlan']],
+                              lambda runner, dry_run, name=name: runner.server(name, dry_run))
+            backup = server.get('backup')
+            if backup is None:
+                continue
+            backup_key = 'backup:' + name
+            steps[backup_key] = Step(backup_key, [key],
+                                     lambda runner, dry_run, name=name: runner.backup(name, dry_run))
+            for backup_client in backup.get('clients') or []:
+                client_key = 'backupClient:{0}/{1}'.format(name, backup_client['clientType'])
+                steps[client_key] = Step(
+                    client_key, [backup_key],
+                    lambda runner, dry_run, name=name, c=backup_client: runner.backup_client(name, c, dry_run))
+        return steps
+
+
+def run_steps(steps, func, concurrency=5, on_result=None):
+    """Run ``func(step)`` for every step once all the steps it requires succeeded.
+
+    Independent steps run in parallel on up to ``concurrency`` threads.
+    ``func`` returns (status, detail); if it raises, the step failed and
+    everything depending on it is skipped.
+    """
+    results = OrderedDict()
+    waiting = OrderedDict(steps)
+
+    def call(step):
+        started = time.time()
+        try:
+            status, detail = func(step)
+        except Exception as e:
+            status, detail = FAILED, '{0}'.format(e)
+        return StepResult(step.key, status, detail, time.time() - started)
+
+    def finish(result):
+        results[result.key] = result
+        if on_result is not None:
+            on_result(result)
+
+    with ThreadPoolExecutor(max_workers=max(1, int(concurrency))) as executor:
+        running = {}
+        while waiting or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for key, step in list(waiting.items()):
+                    blocked = [required for required in step.requires
+                               if required in results and results[required].status in (FAILED, SKIPPED)]
+                    if blocked:
+                        del waiting[key]
+                        finish(StepResult(key, SKIPPED, 'needs {0}'.format(blocked[0]), 0.0))
+                        scheduled = True
+                    elif all(required in results for required in step.requires):
+                        del waiting[key]
+                        running[executor.submit(call, step)] = key
+            if not running:
+                if waiting:
+                    # a dependency that is not part of the plan
+                    for key in list(waiting):
+                        finish(StepResult(key, FAILED, 'depends on an unknown step', 0.0))
+                    waiting.clear()
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                finish(future.result())
+    return results
+
+
+class PlanRunner(object):
+    """Brings the account in line with a Plan, creating what is missing.
+
+    Every resource is looked up first and left alone when it already
+    exists. Each step runs on a worker thread with that thread's drivers
+    and waits for its own resource to be ready before its dependants start.
+    """
+
+    def __init__(self, client, plan, timeout=DEFAULT_TIMEOUT, sleep=time.sleep):
+        self.client = client
+        self.plan = plan
+        self.timeout = timeout
+        self.sleep = sleep
+        # plan step key -> the id of the existing or created resource, None
+        # when a dry run would create it
+        self.ids = {}
+
+    def run(self, concurrency=5, dry_run=False, on_result=None):
+        self.client.connection_pool().ensure_size(concurrency + 1)
+        return run_steps(self.plan.steps(), lambda step: step.run(self, dry_run),
+                         concurrency=concurrency, on_result=on_result)
+
+    def _wait(self, poll, item_id, target):
+        waiter = Waiter(poll, timeout=self.timeout, sleep=self.sleep)
+        waiter.add(item_id, target)
+        result = waiter.wait()[0]
+        if not result.ok:
+            raise StepFailed(result.detail)
+
+    def _status_poller(self, get):
+        def poll(pending):
+            finished = {}
+            for item_id in pending:
+                status = get(item_id).status
+                if status == NETWORK_READY:
+                    finished[item_id] = (True, 'ready')
+                elif 'FAILED' in '{0}'.format(status):
+                    finished[item_id] = (False, status)
+            return finished
+        return poll
+
+    def _created(self, key, resource_id):
+        self.ids[key] = resource_id
+        return CREATED, resource_id
+
+    def _unchanged(self, key, resource_id):
+        self.ids[key] = resource_id
+        return UNCHANGED, resource_id
+
+    def network_domain(self, name, dry_run):
+        key = 'networkDomain:' + name
+        domain = self.plan.network_domains[name]
+        driver = self.client.worker_driver('node')
+        existing = [found for found in driver.ex_list_network_domains(location=domain['datacenterId'], name=name)
+                    if found.name == name]
+        if existing:
+            return self._unchanged(key, existing[0].id)
+        if dry_run:
+            self.ids[key] = None
+            return WOULD_CREATE, domain['datacenterId']
+        created = driver.ex_create_network_domain(domain['datacenterId'], name,
+                                                  domain.get('servicePlan', 'ESSENTIALS'), domain.get('description'))
+        self._wait(self._status_poller(driver.ex_get_network_domain), created.id, NETWORK_READY)
+        return self._created(key, created.id)
+
+    def vlan(self, name, dry_run):
+        key = 'vlan:' + name
+        vlan = self.plan.vlans[name]
+        domain_id = self.ids['networkDomain:' + vlan['networkDomain']]
+        if domain_id is None:
+            self.ids[key] = None
+            return WOULD_CREATE, vlan['privateIpv4BaseAddress']
+        driver = self.client.worker_driver('node')
+        existing = [found for found in driver.ex_list_vlans(network_domain=domain_id, name=name) if found.name == name]
+        if existing:
+            return self._unchanged(key, existing[0].id)
+        if dry_run:
+            self.ids[key] = None
+            return WOULD_CREATE, vlan['privateIpv4BaseAddress']
+        created = driver.ex_create_vlan(driver.ex_get_network_domain(domain_id), name,
+                                        vlan['privateIpv4BaseAddress'], vlan.get('description'),
+                                        vlan.get('privateIpv4PrefixSize', 24))
+        self._wait(self._status_poller(driver.ex_get_vlan), created.id, NETWORK_READY)
+        return self._created(key, created.id)
+
+    def server(self, name, dry_run):
+        key = 'server:' + name
+        server = self.plan.servers[name]
+        vlan = self.plan.vlans[server['vlan']]
+        domain_id = self.ids['networkDomain:' + vlan['networkDomain']]
+        vlan_id = self.ids['vlan:' + server['vlan']]
+        if vlan_id is None:
+            self.ids[key] = None
+            return WOULD_CREATE, server['imageId']
+        driver = self.client.worker_driver('node')
+        existing = driver.list_nodes(ex_name=name, ex_network_domain=domain_id)
+        if existing:
+            return self._unchanged(key, existing[0].id)
+        if dry_run:
+            self.ids[key] = None
+            return WOULD_CREATE, server['imageId']
+        started = server.get('start', True)
+        node = driver.create_node(name, server['imageId'], server['administratorPassword'],
+                                  ex_network_domain=domain_id, ex_primary_nic_vlan=vlan_id,
+                                  ex_description=server.get('description'), ex_is_started=started)
+        poller = NodePoller(driver)
+        waiter = Waiter(poller, timeout=self.timeout, sleep=self.sleep)
+        poller.add(waiter, node, RUNNING if started else STOPPED)
+        result = waiter.wait()[0]
+        if not result.ok:
+            raise StepFailed(result.detail)
+        return self._created(key, node.id)
+
+    def backup(self, name, dry_run):
+        key = 'backup:' + name
+        backup = self.plan.servers[name]['backup']
+        server_id = self.ids['server:' + name]
+        if server_id is None:
+            self.ids[key] = None
+            return WOULD_CREATE, backup['servicePlan']
+        driver = self.client.worker_driver('backup')
+        if driver.ex_get_target_by_id(server_id) is not None:
+            return self._unchanged(key, server_id)
+        if dry_run:
+            self.ids[key] = None
+            return WOULD_CREATE, backup['servicePlan']
+        driver.create_target(server_id, server_id, extra={'servicePlan': backup['servicePlan']})
+        self._wait(BackupPoller(driver), server_id, BACKUP_ENABLED)
+        return self._created(key, server_id)
+
+    def backup_client(self, name, backup_client, dry_run):
+        server_id = self.ids['backup:' + name]
+        if server_id is None:
+            return WOULD_CREATE, backup_client['storagePolicy']
+        driver = self.client.worker_driver('backup')
+        details = driver.ex_get_backup_details_for_target(server_id)
+        # the client's type is a DimensionDataBackupClientType
+        if any(getattr(found.type, 'type', found.type) == backup_client['clientType']
+               for found in details.clients or []):
+            return UNCHANGED, server_id
+        if dry_run:
+            return WOULD_CREATE, backup_client['storagePolicy']
+        driver.ex_add_client_to_target(server_id, backup_client['clientType'], backup_client['storagePolicy'],
+                                       backup_client['schedulePolicy'], backup_client['triggerOn'],
+                                       backup_client['notifyEmail'])
+        return CREATED, server_id
@@ -0,0 +1,187 @@
+import contextlib
+import functools
+import inspect
+import json
+import re
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+_UUID = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+# the Profiler of the running command, if --profile was given
+_active = None
+
+
+def activate(profiler):
+    global _active
+    _active = profiler
+    return profiler
+
+
+def active():
+    return _active
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a block as one phase of the command, when profiling."""
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    started = time.time()
+    try:
+        yield
+    finally:
+        profiler.add_phase(name, time.time() - started)
+
+
+class Profiler(object):
+    """Collects phase timings, driver method calls and API requests.
+
+    Safe to share between the worker threads of a bulk command.
+    """
+
+    def __init__(self, command=None, started=None):
+        self.command = command
+        self.started = started or time.time()
+        self.phases = {}
+        self.calls = {}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            count, total = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (count + 1, total + seconds)
+
+    def add_call(self, name, seconds):
+        with self._lock:
+            count, total = self.calls.get(name, (0, 0.0))
+            self.calls[name] = (count + 1, total + seconds)
+
+    def add_request(self, method, action, status, received, seconds, parse_seconds):
+        with self._lock:
+            self.requests.append({
+                'method': method,
+                'action': _UUID.sub('{id}', action),
+                'status': status,
+                'bytes': received,
+                'seconds': seconds,
+                'parse_seconds': parse_seconds,
+            })
+
+    def instrument(self, driver, kind):
+        """Time every public method call on ``driver`` and record every API response it gets."""
+        for name in dir(driver.__class__):
+            if name.startswith('_') or not inspect.isroutine(getattr(driver.__class__, name, None)):
+                continue
+            setattr(driver, name, self._timed(getattr(driver, name), '{0}.{1}'.format(kind, name)))
+        connection = driver.connection
+        connection.responseCls = self._response_class(connection.responseCls)
+        return driver
+
+    def _timed(self, method, name):
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            started = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add_call(name, time.time() - started)
+        return timed
+
+    def _response_class(self, base):
+        profiler = self
+
+        class ProfiledResponse(base):
+            def __init__(self, response, connection):
+                self._parse_seconds = 0.0
+                try:
+                    super(ProfiledResponse, self).__init__(response, connection)
+                finally:
+                    profiler.add_request(response.request.method, urlsplit(response.request.url).path,
+                                         response.status_code, len(response.content),
+                                         response.elapsed.total_seconds(), self._parse_seconds)
+
+            def parse_body(self):
+                started = time.time()
+                try:
+                    return super(ProfiledResponse, self).parse_body()
+                finally:
+                    self._parse_seconds += time.time() - started
+
+            def parse_error(self):
+                started = time.time()
+                try:
+                    return super(ProfiledResponse, self).parse_error()
+                finally:
+                    self._parse_seconds += time.time() - started
+
+        return ProfiledResponse
+
+    def request_summary(self):
+        """(method, action, status) -> [requests, seconds, bytes, parse seconds]"""
+        summary = {}
+        for request in self.requests:
+            key = (request['method'], request['action'], request['status'])
+            totals = summary.setdefault(key, [0, 0.0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += request['seconds']
+            totals[2] += request['bytes']
+            totals[3] += request['parse_seconds']
+        return summary
+
+    def summary_lines(self):
+        total = time.time() - self.started
+        lines = ['', 'Profile: {0:.1f} ms total'.format(total * 1000), '',
+                 '{0:<40} {1:>7} {2:>10}'.format('Phase', 'Count', 'ms')]
+        for name, (count, seconds) in sorted(self.phases.items(), key=lambda item: -item[1][1]):
+            lines.append('{0:<40} {1:>7} {2:>10.1f}'.format(name, count, seconds * 1000))
+        lines.extend(['', '{0:<40} {1:>7} {2:>10} {3:>10}'.format('Driver call', 'Calls', 'ms', 'avg ms')])
+        for name, (count, seconds) in sorted(self.calls.items(), key=lambda item: -item[1][1]):
+            lines.append('{0:<40} {1:>7} {2:>10.1f} {3:>10.1f}'.format(
+                name, count, seconds * 1000, seconds * 1000 / count))
+        lines.extend(['', '{0:<48} {1:>6} {2:>7} {3:>10} {4:>10} {5:>10}'.format(
+            'API request', 'Status', 'Count', 'ms', 'KiB', 'parse ms')])
+        for (method, action, status), (count, seconds, received, parse) in sorted(
+                self.request_summary().items(), key=lambda item: -item[1][1]):
+            lines.append('{0:<48} {1:>6} {2:>7} {3:>10.1f} {4:>10.1f} {5:>10.1f}'.format(
+                '{0} {1}'.format(method, action)[:48], status, count, seconds * 1000, received / 1024.0, parse * 1000))
+        return lines
+
+    def trace(self):
+        return {
+            'command': self.command,
+            'started': self.started,
+            'seconds': time.time() - self.started,
+            'phases': dict((name, {'count': count, 'seconds': seconds})
+                           for name, (count, seconds) in self.phases.items()),
+            'calls': dict((name, {'count': count, 'seconds': seconds})
+                          for name, (count, seconds) in self.calls.items()),
+            'requests': self.requests,
+        }
+
+    def write_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f, separators=(',', ':'))
+            f.write('\n')
+
+
+def redacted_argv(argv):
+    """The command line with the value of --password hidden."""
+    args = []
+    hide_next = False
+    for arg in argv:
+        if hide_next:
+            arg = '***'
+        elif arg.startswith('--password='):
+            arg = '--password=***'
+        hide_next = arg == '--password'
+        args.append(arg)
+    return ' '.join(args)
@@ -0,0 +1,214 @@
+import bisect
+import re
+import socket
+
+# query field -> inventory record field
+FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'ipv4': 'ipv4',
+    'privateIpv4': 'ipv4',
+    'ipv6': 'ipv6',
+    'datacenter': 'datacenter',
+    'datacenterId': 'datacenter',
+    'networkDomain': 'network_domain',
+    'networkDomainId': 'network_domain',
+    'vlan': 'vlan',
+    'vlanId': 'vlan',
+    'image': 'image',
+    'sourceImageId': 'image',
+    'state': 'state',
+    'os': 'os',
+    'cpu.count': 'cpu_count',
+    'cpu.coresPerSocket': 'cores_per_socket',
+    'memoryGb': 'memory_gb',
+    'diskGb': 'disk_gb',
+    'backupPlan': 'backup_plan',
+}
+NUMERIC_FIELDS = ['cpu_count', 'cores_per_socket', 'memory_gb', 'disk_gb']
+IP_FIELDS = ['ipv4', 'ipv6']
+
+_TERM = re.compile(r'^([A-Za-z][A-Za-z0-9_.]*)(!=|\^=|~=|>=|<=|=|>|<)(.*)$')
+_NUMERIC_OPS = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+QUERY_HELP = ("Select servers with space separated terms that must all match, e.g. "
+              "'name^=web datacenter=NA9,NA12 ipv4=10.0.0.0/24 cpu.count>=4'. "
+              "Operators: = (comma separated alternatives, CIDR for IPs), != , ^= prefix, ~= regex, "
+              "> >= < <= numbers")
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _ip_network(value):
+    address, _, prefix = value.partition('/')
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    bits = 128 if family == socket.AF_INET6 else 32
+    try:
+        number = _ip_number(address, family)
+        prefix = int(prefix)
+    except (socket.error, ValueError):
+        raise QueryError("'{0}' is not a CIDR network".format(value))
+    if not 0 <= prefix <= bits:
+        raise QueryError("'{0}' is not a CIDR network".format(value))
+    shift = bits - prefix
+    return family, number >> shift, shift
+
+
+def _ip_number(address, family):
+    return int(''.join('{0:02x}'.format(byte) for byte in bytearray(socket.inet_pton(family, address))), 16)
+
+
+class Predicate(object):
+    """One ``field<op>value`` term of a query."""
+
+    def __init__(self, field, op, value):
+        if field not in FIELDS:
+            raise QueryError("Unknown query field '{0}', use one of {1}".format(field, ', '.join(sorted(FIELDS))))
+        self.field = FIELDS[field]
+        self.op = op
+        self.value = value
+        self.negate = op == '!='
+        self.alternatives = value.split(',')
+        self.networks = None
+        if op in ('=', '!=') and self.field in IP_FIELDS and '/' in value:
+            self.networks = [_ip_network(alternative) for alternative in self.alternatives]
+        elif op == '~=':
+            try:
+                self.regex = re.compile(value)
+            except re.error as e:
+                raise QueryError("Bad regular expression '{0}': {1}".format(value, e))
+        elif op in ('=', '!=') and self.field in NUMERIC_FIELDS:
+            try:
+                self.numbers = [float(alternative) for alternative in self.alternatives]
+            except ValueError:
+                raise QueryError("'{0}' is not a number or comma separated numbers".format(value))
+        elif op in _NUMERIC_OPS:
+            if self.field not in NUMERIC_FIELDS:
+                raise QueryError("'{0}' only works on {1}".format(op, ', '.join(NUMERIC_FIELDS)))
+            try:
+                self.number = float(value)
+            except ValueError:
+                raise QueryError("'{0}' is not a number".format(value))
+
+    @property
+    def exact(self):
+        """Whether the matching values can be looked up instead of scanned."""
+        return self.op in ('=', '!=') and self.networks is None and self.field not in NUMERIC_FIELDS
+
+    def matches_value(self, value):
+        """Whether a single value matches, ignoring ``!=`` negation."""
+        if value is None:
+            return False
+        if self.op in _NUMERIC_OPS:
+            return _NUMERIC_OPS[self.op](float(value), self.number)
+        if self.networks is not None:
+            return any(self._in_network(value, network) for network in self.networks)
+        if self.op == '^=':
+            return any('{0}'.format(value).startswith(alternative) for alternative in self.alternatives)
+        if self.op == '~=':
+            return self.regex.search('{0}'.format(value)) is not None
+        if self.field in NUMERIC_FIELDS:
+            return float(value) in self.numbers
+        return '{0}'.format(value) in self.alternatives
+
+    @staticmethod
+    def _in_network(value, network):
+        family, number, shift = network
+        try:
+            return _ip_number(value, family) >> shift == number
+        except (socket.error, ValueError):
+            return False
+
+    def matches(self, record):
+        values = record.get(self.field)
+        if not isinstance(values, list):
+            values = [values]
+        matched = any(self.matches_value(value) for value in values)
+        return not matched if self.negate else matched
+
+    def __repr__(self):
+        return 'Predicate({0!r}, {1!r}, {2!r})'.format(self.field, self.op, self.value)
+
+
+def parse_query(text):
+    """Parse a query into a list of Predicates, all of which must match."""
+    predicates = []
+    for term in text.split():
+        match = _TERM.match(term)
+        if match is None:
+            raise QueryError("Cannot parse '{0}', expected field<op>value".format(term))
+        predicates.append(Predicate(*match.groups()))
+    if not predicates:
+        raise QueryError("The query is empty")
+    return predicates
+
+
+def matches_all(predicates, record):
+    return all(predicate.matches(record) for predicate in predicates)
+
+
+class NodeIndex(object):
+    """Inverted indexes over inventory records, one per record field.
+
+    Each predicate is evaluated once per distinct value of its field rather
+    than once per server: exact terms are dictionary lookups, prefixes use
+    the sorted values and the other operators scan the distinct values.
+    """
+
+    def __init__(self, records, fields):
+        self.records = dict((record['id'], record) for record in records)
+        self.postings = dict((field, {}) for field in fields)
+        self._sorted = {}
+        for record in records:
+            for field in fields:
+                values = record.get(field)
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    if value is not None:
+                        self.postings[field].setdefault(value, []).append(record)
+
+    def lookup(self, field, value):
+        return self.postings[field].get(value, [])
+
+    def _values(self, predicate):
+        postings = self.postings[predicate.field]
+        if predicate.exact:
+            return [value for value in predicate.alternatives if value in postings]
+        if predicate.op == '^=':
+            if predicate.field not in self._sorted:
+                self._sorted[predicate.field] = sorted('{0}'.format(value) for value in postings)
+            keys = self._sorted[predicate.field]
+            values = []
+            for prefix in predicate.alternatives:
+                start = bisect.bisect_left(keys, prefix)
+                for key in keys[start:]:
+                    if not key.startswith(prefix):
+                        break
+                    values.append(key)
+            return [value for value in values if value in postings]
+        return [value for value in postings if predicate.matches_value(value)]
+
+    def ids(self, predicate):
+        ids = set()
+        for value in self._values(predicate):
+            ids.update(record['id'] for record in self.postings[predicate.field][value])
+        if predicate.negate:
+            ids = set(self.records) - ids
+        return ids
+
+    def select(self, predicates):
+        """Records matching all the predicates, sorted by id."""
+        ids = None
+        for predicate in predicates:
+            ids = self.ids(predicate) if ids is None else ids & self.ids(predicate)
+            if not ids:
+                return []
+        return [self.records[record_id] for record_id in sorted(ids)]
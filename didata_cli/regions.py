@@ -0,0 +1,134 @@
+import click
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+ALL_REGIONS = 'all'
+# how long a region's worker waits on a full queue before checking whether
+# the reader has gone away
+_PUT_TIMEOUT = 0.5
+
+
+def resolve_regions(value):
+    """The regions named by --region: one region, a comma separated list or 'all'."""
+    if value == ALL_REGIONS:
+        from libcloud.common.dimensiondata import API_ENDPOINTS
+        return sorted(region for region in API_ENDPOINTS if region.startswith('dd-'))
+    regions = []
+    for region in value.split(','):
+        region = region.strip()
+        if region and region not in regions:
+            regions.append(region)
+    return regions
+
+
+class RegionFanOut(object):
+    """Runs a listing in several regions at once, one thread per region.
+
+    Pages are handed back as each region produces them, so a slow region
+    only delays its own results. A region that fails is recorded in
+    ``errors`` while the others carry on.
+    """
+
+    def __init__(self, client, regions, kind='node'):
+        self.client = client
+        self.regions = regions
+        self.kind = kind
+        self.counts = dict((region, 0) for region in regions)
+        self.seconds = {}
+        self.errors = {}
+        self._stopped = threading.Event()
+
+    def _put(self, queue, message):
+        while not self._stopped.is_set():
+            try:
+                queue.put(message, timeout=_PUT_TIMEOUT)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _run(self, region, fetch, queue):
+        started = time.time()
+        error = None
+        try:
+            driver = self.client.region_driver(region, self.kind)
+            for items in fetch(driver):
+                if not self._put(queue, (region, items, None)):
+                    return
+        except Exception as e:
+            error = e
+        self._put(queue, (region, None, (time.time() - started, error)))
+
+    def pages(self, fetch):
+        """Yield ``(region, items)`` for every page ``fetch(driver)`` yields in any region."""
+        queue = Queue(maxsize=2 * len(self.regions))
+        for region in self.regions:
+            thread = threading.Thread(target=self._run, args=(region, fetch, queue))
+            thread.daemon = True
+            thread.start()
+        running = len(self.regions)
+        try:
+            while running:
+                region, items, finished = queue.get()
+                if items is None:
+                    running -= 1
+                    self.seconds[region], error = finished
+                    if error is not None:
+                        self.errors[region] = error
+                    continue
+                self.counts[region] += len(items)
+                yield region, items
+        finally:
+            self._stopped.set()
+
+    def summary_lines(self):
+        lines = []
+        for region in self.regions:
+            if region in self.errors:
+                lines.append("{0}: failed after {1:.1f}s: {2}".format(
+                    region, self.seconds[region], self.errors[region]))
+            elif region in self.seconds:
+                lines.append("{0}: {1} results in {2:.1f}s".format(region, self.counts[region], self.seconds[region]))
+        return lines
+
+
+def tag_record(region, to_record):
+    def tagged(item):
+        record = OrderedDict([('region', region)])
+        record.update(to_record(item))
+        return record
+    return tagged
+
+
+def tag_lines(region, to_lines):
+    def tagged(item):
+        lines = to_lines(item)
+        return lines[:1] + ["Region: {0}".format(region)] + lines[1:]
+    return tagged
+
+
+def render_regions(client, renderer, fetch, to_record, to_lines):
+    """Render the pages ``fetch(driver)`` yields in every region given to --region.
+
+    With several regions they are queried concurrently and every result is
+    tagged with its region. The per region timings and errors go to stderr
+    and the command fails if any region did.
+    """
+    if len(client.regions) == 1:
+        for items in fetch(client.node):
+            renderer.render(items, to_record, to_lines)
+        return
+    fan_out = RegionFanOut(client, client.regions)
+    for region, items in fan_out.pages(fetch):
+        renderer.render(items, tag_record(region, to_record), tag_lines(region, to_lines))
+    # keep machine readable output clean
+    click.echo("\n".join([""] + fan_out.summary_lines()), err=not renderer.is_text)
+    if fan_out.errors:
+        sys.exit(1)
@@ -0,0 +1,214 @@
+import re
+import threading
+import time
+from collections import deque
+
+from didata_cli.profile import phase
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+# CloudControl response codes that mean the request was turned away before
+# anything happened, so it is safe to send again
+RETRYABLE_CODES = ['RESOURCE_BUSY', 'RESOURCE_LOCKED', 'SERVER_BUSY', 'SYSTEM_BUSY', 'TOO_MANY_REQUESTS']
+# HTTP statuses that are also turned away requests
+RETRYABLE_STATUSES = [429, 503]
+# gateway errors, where a change may have gone through, so only reads are retried
+RETRYABLE_READ_STATUSES = [502, 504]
+# the API pushing back on how hard it is being called, as opposed to one
+# resource being busy; these slow every worker down
+PUSHBACK = ['SERVER_BUSY', 'SYSTEM_BUSY', 'TOO_MANY_REQUESTS', 429, 503]
+
+_RESPONSE_CODE = re.compile(r'<(?:\w+:)?responseCode>\s*([A-Z_]+)\s*<')
+
+
+def retry_code(method, response):
+    """The code a retryable response was turned away with, or None to accept the response."""
+    status = response.status_code
+    if status in RETRYABLE_STATUSES:
+        return status
+    if status in RETRYABLE_READ_STATUSES and method.upper() == 'GET':
+        return status
+    if status == 400:
+        match = _RESPONSE_CODE.search(response.text[:4096])
+        if match is not None and match.group(1) in RETRYABLE_CODES:
+            return match.group(1)
+    return None
+
+
+def _retry_after(response):
+    try:
+        return max(0.0, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    """Client side limit on requests per second, shared by every thread.
+
+    Unlimited unless given a ``rate``. ``slow_down`` halves the rate (or,
+    while unlimited, the rate requests were recently sent at) and
+    ``speed_up`` wins it back a little at a time.
+    """
+
+    def __init__(self, rate=None, burst=None, clock=time.time, sleep=None):
+        self.ceiling = rate
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep or time.sleep
+        self._tokens = 0.0
+        self._updated = None
+        self._sent = deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        return self.burst or max(1.0, self.rate)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._sent.append(now)
+                if self.rate is None:
+                    return
+                if self._updated is None:
+                    self._tokens = self._capacity()
+                else:
+                    self._tokens = min(self._capacity(), self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+                self._sent.pop()
+            self.sleep(delay)
+
+    def wait(self):
+        """Block until ``acquire`` would not have to, without taking a token."""
+        while True:
+            with self._lock:
+                if self.rate is None or self._updated is None:
+                    return
+                tokens = min(self._capacity(), self._tokens + (self.clock() - self._updated) * self.rate)
+                if tokens >= 1:
+                    return
+                delay = (1 - tokens) / self.rate
+            self.sleep(delay)
+
+    def recent_rate(self):
+        if len(self._sent) < 2:
+            return None
+        elapsed = self._sent[-1] - self._sent[0]
+        return (len(self._sent) - 1) / elapsed if elapsed > 0 else None
+
+    def slow_down(self, minimum=1.0):
+        with self._lock:
+            rate = self.rate if self.rate is not None else self.recent_rate()
+            if rate is None:
+                return
+            self.rate = max(minimum, rate / 2.0)
+            self._tokens = min(self._tokens, 1.0)
+
+    def speed_up(self, factor=1.1):
+        with self._lock:
+            if self.rate is None or self.rate == self.ceiling:
+                return
+            self.rate *= factor
+            if self.ceiling is not None:
+                self.rate = min(self.rate, self.ceiling)
+
+
+class CircuitBreaker(object):
+    """Stops every thread from calling the API for a while after repeated push back.
+
+    Opens after ``threshold`` pushed back responses in a row and stays open
+    for ``cooldown`` seconds, doubling up to ``max_cooldown`` each time it
+    opens again before a request gets through.
+    """
+
+    def __init__(self, threshold=3, cooldown=5.0, max_cooldown=60.0, clock=time.time, sleep=None):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.sleep = sleep or time.sleep
+        self.failures = 0
+        self.opened = 0
+        self.open_until = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self.open_until - self.clock()
+            if delay <= 0:
+                return
+            with phase('api circuit open'):
+                self.sleep(delay)
+
+    def record_pushback(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened += 1
+                cooldown = min(self.max_cooldown, self.cooldown * 2 ** (self.opened - 1))
+                self.open_until = max(self.open_until, self.clock() + cooldown)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = 0
+
+
+class RetryPolicy(object):
+    """Sends API requests again when CloudControl turns them away.
+
+    One policy is shared by every driver and thread talking to a region,
+    so the token bucket and circuit breaker slow them all down together
+    when the API pushes back.
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, rate=None, backoff=None, sleep=None):
+        from didata_cli.waiter import Backoff
+        self.max_attempts = max(1, max_attempts)
+        self.sleep = sleep or time.sleep
+        self.bucket = TokenBucket(rate, sleep=self.sleep)
+        self.breaker = CircuitBreaker(sleep=self.sleep)
+        self.backoff = backoff or (lambda: Backoff(initial=1.0, maximum=30.0, factor=2.0))
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def throttle(self):
+        """Block a thread about to start on more API calls until the region can take one."""
+        self.breaker.wait()
+        self.bucket.wait()
+
+    def send(self, method, send, get_response):
+        """Call ``send()`` until ``get_response()`` is not retryable or the attempts run out."""
+        backoff = self.backoff()
+        attempt = 1
+        while True:
+            self.breaker.wait()
+            self.bucket.acquire()
+            result = send()
+            response = get_response()
+            code = retry_code(method, response) if response is not None else None
+            if code is None:
+                self.breaker.record_success()
+                self.bucket.speed_up()
+                return result
+            if code in PUSHBACK:
+                self.breaker.record_pushback()
+                self.bucket.slow_down()
+            if attempt >= self.max_attempts:
+                # let libcloud turn the response into its usual exception
+                return result
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            delay = backoff.next()
+            retry_after = _retry_after(response)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            with phase('api retry backoff'):
+                self.sleep(delay)
@@ -0,0 +1,70 @@
+from array import array
+from collections import OrderedDict
+
+# (column prefix, inventory record field)
+METRICS = [
+    ('cpu', 'cpu_count'),
+    ('coresPerSocket', 'cores_per_socket'),
+    ('memoryGb', 'memory_gb'),
+    ('diskGb', 'disk_gb'),
+]
+DEFAULT_PERCENTILES = [50, 95]
+
+
+def percentile(ordered, percent):
+    """Linearly interpolated percentile of sorted values, None when there are none."""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _number(value):
+    return int(value) if value is not None and value == int(value) else value
+
+
+def _group_value(value):
+    if isinstance(value, list):
+        return ' '.join(value)
+    return value
+
+
+class FleetStats(object):
+    """Server counts and size totals and percentiles per group of servers.
+
+    Records are added a page at a time; each group keeps one array of
+    doubles per metric, so memory stays at eight bytes a value however
+    many servers are added.
+    """
+
+    def __init__(self, group_by):
+        self.group_by = group_by
+        self.groups = {}
+
+    def add(self, records):
+        group_by = self.group_by
+        fields = [field for _, field in METRICS]
+        for record in records:
+            key = tuple(_group_value(record.get(field)) for field in group_by)
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = [0] + [array('d') for _ in METRICS]
+            group[0] += 1
+            for column, field in zip(group[1:], fields):
+                value = record.get(field)
+                if value is not None:
+                    column.append(value)
+
+    def rows(self, percentiles=DEFAULT_PERCENTILES):
+        """Yield a record per group, largest group first."""
+        for key, group in sorted(self.groups.items(), key=lambda item: (-item[1][0], '{0}'.format(item[0]))):
+            row = OrderedDict(zip(self.group_by, key))
+            row['servers'] = group[0]
+            for (name, _), column in zip(METRICS, group[1:]):
+                ordered = sorted(column)
+                row['{0}Total'.format(name)] = _number(sum(ordered)) if ordered else None
+                for percent in percentiles:
+                    row['{0}P{1}'.format(name, percent)] = _number(percentile(ordered, percent))
+            yield row
@@ -0,0 +1,188 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from libcloud.common.dimensiondata import TYPES_URN
+from libcloud.utils.xml import fixxpath
+from didata_cli.inventory import get_cache_dir, account_key, write_json_atomic, node_to_record
+from didata_cli.nodes import RECORD_FIELDS
+from didata_cli.utils import iter_node_pages
+
+NETWORK_DOMAINS = 'networkDomains'
+NETWORKS = 'networks'
+VLANS = 'vlans'
+SERVERS = 'servers'
+KINDS = [NETWORK_DOMAINS, NETWORKS, VLANS, SERVERS]
+
+NETWORK_NS = 'http://oec.api.opsource.net/schemas/network'
+
+
+class SnapshotMissing(Exception):
+    pass
+
+
+def _text(element, name, namespace):
+    child = element.find(fixxpath(name, namespace))
+    return child.text if child is not None else None
+
+
+def _range(element, name):
+    child = element.find(fixxpath(name, TYPES_URN))
+    if child is None:
+        return None
+    return '{0}/{1}'.format(child.get('address'), child.get('prefixSize'))
+
+
+def network_domain_to_record(element):
+    return OrderedDict([
+        ('id', element.get('id')),
+        ('name', _text(element, 'name', TYPES_URN)),
+        ('description', _text(element, 'description', TYPES_URN)),
+        ('plan', _text(element, 'type', TYPES_URN)),
+        ('location', element.get('datacenterId')),
+        ('status', _text(element, 'state', TYPES_URN)),
+    ])
+
+
+def network_to_record(element):
+    return OrderedDict([
+        ('id', _text(element, 'id', NETWORK_NS)),
+        ('name', _text(element, 'name', NETWORK_NS)),
+        ('description', _text(element, 'description', NETWORK_NS)),
+        ('privateNet', _text(element, 'privateNet', NETWORK_NS)),
+        ('location', _text(element, 'location', NETWORK_NS)),
+        ('multicast', _text(element, 'multicast', NETWORK_NS) == 'true'),
+    ])
+
+
+def vlan_to_record(element):
+    network_domain = element.find(fixxpath('networkDomain', TYPES_URN))
+    return OrderedDict([
+        ('id', element.get('id')),
+        ('name', _text(element, 'name', TYPES_URN)),
+        ('description', _text(element, 'description', TYPES_URN)),
+        ('networkDomainId', network_domain.get('id') if network_domain is not None else None),
+        ('location', element.get('datacenterId')),
+        ('privateIpv4Range', _range(element, 'privateIpv4Range')),
+        ('ipv6Range', _range(element, 'ipv6Range')),
+        ('status', _text(element, 'state', TYPES_URN)),
+    ])
+
+
+def fetch_records(driver, kind, datacenter):
+    """The records of one kind in one datacenter.
+
+    Parses the API responses directly: libcloud lists every location for
+    each call and looks up the network domain of every VLAN one by one.
+    """
+    if kind == SERVERS:
+        return [node_to_record(node) for nodes in iter_node_pages(driver, fields=RECORD_FIELDS, ex_location=datacenter)
+                for node in nodes]
+    if kind == NETWORKS:
+        # MCP 1.0 networks, only found in the older datacenters
+        page = driver.connection.request_with_orgId_api_1('networkWithLocation/{0}'.format(datacenter)).object
+        return [network_to_record(element) for element in page.findall(fixxpath('network', NETWORK_NS))]
+    action, tag, to_record = {
+        NETWORK_DOMAINS: ('network/networkDomain', 'networkDomain', network_domain_to_record),
+        VLANS: ('network/vlan', 'vlan', vlan_to_record),
+    }[kind]
+    records = []
+    for page in driver.connection.paginated_request_with_orgId_api_2(action, params={'datacenterId': datacenter}):
+        records.extend(to_record(element) for element in page.findall(fixxpath(tag, TYPES_URN)))
+    return records
+
+
+class Topology(object):
+    """Network domains, networks, VLANs and servers with indexes between them.
+
+    ``data`` maps each of KINDS to a list of records, as saved by
+    TopologySnapshot.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.datacenters = data.get('datacenters', [])
+        # when each datacenter was last snapshotted
+        self.created = data.get('created') or {}
+        if not isinstance(self.created, dict):
+            # snapshots used to keep one time for all of their datacenters
+            self.created = dict((datacenter, self.created) for datacenter in self.datacenters)
+        self.network_domain_by_id = dict((record['id'], record) for record in data[NETWORK_DOMAINS])
+        self.vlan_by_id = dict((record['id'], record) for record in data[VLANS])
+        self.vlans_by_domain = {}
+        self.servers_by_vlan = {}
+        self.server_by_ip = {}
+        for vlan in data[VLANS]:
+            self.vlans_by_domain.setdefault(vlan['networkDomainId'], []).append(vlan)
+        for server in data[SERVERS]:
+            self.servers_by_vlan.setdefault(server['vlan'], []).append(server)
+            for ip in server['ipv4'] + ([server['ipv6']] if server['ipv6'] else []):
+                self.server_by_ip[ip] = server
+
+    def taken(self, datacenter=None):
+        """When the snapshot of ``datacenter``, or the oldest of all of them, was taken."""
+        if datacenter is not None:
+            return self.created.get(datacenter)
+        return min(self.created.values()) if self.created else None
+
+    def _in(self, kind, datacenter):
+        return [record for record in self.data[kind] if datacenter in (None, record['location'])]
+
+    def network_domains(self, datacenter=None):
+        return self._in(NETWORK_DOMAINS, datacenter)
+
+    def networks(self, datacenter=None):
+        return self._in(NETWORKS, datacenter)
+
+    def counts(self, datacenter):
+        return [len(self._in(NETWORK_DOMAINS, datacenter)), len(self._in(NETWORKS, datacenter)),
+                len(self._in(VLANS, datacenter)),
+                len([server for server in self.data[SERVERS] if server['datacenter'] == datacenter])]
+
+    def tree(self, datacenter=None):
+        """Yield (network domain, [(vlan, [servers])]) in name order."""
+        for network_domain in sorted(self.network_domains(datacenter), key=lambda record: record['name']):
+            vlans = sorted(self.vlans_by_domain.get(network_domain['id'], []), key=lambda record: record['name'])
+            yield network_domain, [(vlan, sorted(self.servers_by_vlan.get(vlan['id'], []),
+                                                 key=lambda record: record['name'])) for vlan in vlans]
+
+
+class TopologySnapshot(object):
+    """The network topology of one region for one user, saved on disk."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def for_account(cls, region, user):
+        return cls(os.path.join(get_cache_dir(), 'topology-{0}.json'.format(account_key(region, user))))
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return Topology(json.load(f))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def require(self, region):
+        topology = self.load()
+        if topology is None:
+            raise SnapshotMissing("No network snapshot for {0}, run network snapshot first".format(region))
+        return topology
+
+    def save(self, datacenters, records):
+        """Replace the snapshot of ``datacenters`` with ``records`` ({kind: [record]}), keeping the others."""
+        previous = self.load()
+        now = time.time()
+        data = {'created': dict((datacenter, now) for datacenter in datacenters), 'datacenters': sorted(datacenters)}
+        for kind in KINDS:
+            data[kind] = records[kind]
+        if previous is not None:
+            data['created'] = dict(previous.created, **data['created'])
+            data['datacenters'] = sorted(set(previous.datacenters) | set(datacenters))
+            for kind in KINDS:
+                field = 'datacenter' if kind == SERVERS else 'location'
+                data[kind] = [record for record in previous.data[kind]
+                              if record[field] not in datacenters] + data[kind]
+        write_json_atomic(self.path, data)
+        return Topology(data)
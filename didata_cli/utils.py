@@ -1,50 +1,299 @@
 import click
-from libcloud.common.dimensiondata import DimensionDataAPIException
+import functools
+import sys
+from libcloud.common.dimensiondata import DimensionDataAPIException, TYPES_URN
+from libcloud.utils.xml import fixxpath
+from didata_cli.bulk import read_id_file
+from didata_cli.inventory import FILTER_FIELDS, node_to_record
+from didata_cli.nodes import parse_nodes, RECORD_FIELDS
+from didata_cli.profile import phase
+from didata_cli.retry import RETRYABLE_CODES, RETRYABLE_STATUSES
+from didata_cli.query import QueryError, QUERY_HELP, Predicate, matches_all, parse_query
+
+# (option, click parameter name, list_nodes keyword, API query parameter, help)
+SERVER_FILTERS = [
+    ('--datacenterId', 'datacenterid', 'ex_location', 'datacenterId', "Filter by datacenter Id"),
+    ('--networkDomainId', 'networkdomainid', 'ex_network_domain', 'networkDomainId', "Filter by network domain Id"),
+    ('--networkId', 'networkid', 'ex_network', 'networkId', "Filter by network id"),
+    ('--vlanId', 'vlanid', 'ex_vlan', 'vlanId', "Filter by vlan id"),
+    ('--sourceImageId', 'sourceimageid', 'ex_image', 'sourceImageId', "Filter by source image id"),
+    ('--deployed', 'deployed', 'ex_deployed', 'deployed', "Filter by deployed state"),
+    ('--name', 'name', 'ex_name', 'name', "Filter by server name"),
+    ('--state', 'state', 'ex_state', 'state', "Filter by state"),
+    ('--started', 'started', 'ex_started', 'started', "Filter by started"),
+    ('--ipv6', 'ipv6', 'ex_ipv6', 'ipv6', "Filter by ipv6"),
+    ('--privateIpv4', 'privateipv4', 'ex_ipv4', 'privateIpv4', "Filter by private ipv4"),
+]
+# inventory record field -> list_nodes keyword, for query terms the API can filter on
+API_FILTER_FIELDS = {
+    'name': 'ex_name',
+    'ipv4': 'ex_ipv4',
+    'ipv6': 'ex_ipv6',
+    'datacenter': 'ex_location',
+    'network_domain': 'ex_network_domain',
+    'vlan': 'ex_vlan',
+    'image': 'ex_image',
+}
+MAX_PAGE_SIZE = 250
+
+
+def _parse_query_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_query(value)
+    except QueryError as e:
+        raise click.BadParameter('{0}'.format(e))
+
+
+def query_option(f):
+    """Add --query, which the command receives parsed into a list of Predicates."""
+    return click.option('--query', callback=_parse_query_option, help=QUERY_HELP)(f)
+
+
+def server_filter_options(f):
+    """Add the `server list` filter options and --query to a command.
+
+    The command receives the filters as a single ``node_filters`` dict of
+    ``list_nodes`` keyword arguments, and the parsed query as ``query``.
+    """
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        node_filters = {}
+        for _, param, kwarg, _, _ in SERVER_FILTERS:
+            node_filters[kwarg] = kwargs.pop(param, None)
+        kwargs['node_filters'] = node_filters
+        return f(*args, **kwargs)
+    for option, _, _, _, help_text in reversed(SERVER_FILTERS):
+        option_type = click.UNPROCESSED if option == '--datacenterId' else None
+        wrapper = click.option(option, type=option_type, help=help_text)(wrapper)
+    return query_option(wrapper)
+
+
+def _add_dropped_details(page, nodes):
+    # libcloud drops the primary NIC's vlan, which queries can select on,
+    # and the backup service plan, which the backup catalog is keyed by
+    elements = page.findall(fixxpath('server', TYPES_URN)) if hasattr(page, 'findall') else []
+    for element, node in zip(elements, nodes):
+        nic = element.find(fixxpath('networkInfo/primaryNic', TYPES_URN))
+        node.extra['vlanId'] = nic.get('vlanId') if nic is not None else None
+        backup = element.find(fixxpath('backup', TYPES_URN))
+        node.extra['backupServicePlan'] = backup.get('servicePlan') if backup is not None else None
+
+
+def iter_node_pages(driver, page_size=MAX_PAGE_SIZE, limit=None, query=None, fields=None, **filters):
+    """Yield the nodes matching the list_nodes filters one API page at a time.
+
+    Nodes not matching the ``query`` predicates, if given, are left out.
+    Stops requesting pages once ``limit`` nodes have been yielded. With
+    ``fields``, the node.extra keys the caller uses, compact NodeRecords
+    holding just those are yielded instead of libcloud Nodes.
+    """
+    if fields is not None and query is not None:
+        fields = sorted(set(fields) | set(RECORD_FIELDS))
+    api_params = dict((kwarg, api_param) for _, _, kwarg, api_param, _ in SERVER_FILTERS)
+    params = dict((api_params[key], value) for key, value in filters.items() if value is not None)
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    if limit is not None and query is None:
+        page_size = min(page_size, limit)
+    remaining = limit
+    pages = driver.connection.paginated_request_with_orgId_api_2(
+        'server/server', params=params, page_size=page_size)
+    while True:
+        with phase('list_nodes paging'):
+            page = next(pages, None)
+            if page is None:
+                return
+            if fields is not None:
+                nodes = parse_nodes(page, fields)
+            else:
+                # libcloud has no public way to parse one page of servers
+                nodes = driver._to_nodes(page)
+                _add_dropped_details(page, nodes)
+        if query is not None:
+            nodes = [node for node in nodes if matches_all(query, node_to_record(node))]
+        if remaining is not None:
+            nodes = nodes[:remaining]
+            remaining -= len(nodes)
+        if nodes:
+            yield nodes
+        if remaining == 0:
+            return
+
+
+def list_matching_nodes(client, node_filters, query=None):
+    """list_nodes for the filters, narrowed down by the query if there is one."""
+    if query is None:
+        return client.node.list_nodes(**node_filters)
+    return [node for nodes in iter_node_pages(client.node, query=query, **node_filters) for node in nodes]
+
+
+def get_bulk_targets(client, node_filters, id_file=None, query=None):
+    """Servers for a bulk command: IDs from ``id_file``, or nodes matching the filters and query."""
+    if id_file is not None:
+        targets = read_id_file(id_file)
+    elif query is not None or any(value is not None for value in node_filters.values()):
+        try:
+            targets = list_matching_nodes(client, node_filters, query)
+        except DimensionDataAPIException as e:
+            handle_dd_api_exception(e)
+    else:
+        click.secho("No serverIdFile or filters for servers found", fg='red', bold=True)
+        sys.exit(1)
+    if len(targets) == 0:
+        click.secho("No nodes found with filter", fg='red', bold=True)
+        sys.exit(1)
+    return targets
 
 
 def get_single_server_id_from_filters(client, **kwargs):
+    with phase('server id lookup'):
+        return _get_single_server_from_filters(client, **kwargs)[0]
+
+
+def get_single_node_from_filters(client, **kwargs):
+    """The server matching the filters, for commands that change it.
+
+    A server found in the cached inventory is fetched to check that it
+    still matches, in case the cache is out of date.
+    """
+    with phase('server id lookup'):
+        serverid, node = _get_single_server_from_filters(client, verify=True, **kwargs)
+    if node is None:
+        node = client.node.ex_get_node_by_id(serverid)
+    return node
+
+
+def query_api_filters(query):
+    """list_nodes filters the API can narrow the servers for a query down with."""
+    filters = {}
+    for predicate in query:
+        if predicate.op == '=' and predicate.exact and len(predicate.alternatives) == 1 \
+                and predicate.field in API_FILTER_FIELDS:
+            filters[API_FILTER_FIELDS[predicate.field]] = predicate.value
+    return filters
+
+
+def _find_server_ids(client, query, filters):
+    """The ids of the servers matching, and whether they came from the cached inventory."""
+    if not client.inventory.cached_records():
+        # nothing cached, let the API filter rather than listing the whole fleet
+        if query is None:
+            return [node.id for node in client.node.list_nodes(**filters)], False
+        nodes = iter_node_pages(client.node, query=query, **query_api_filters(query))
+        return [node.id for page in nodes for node in page], False
+    if query is not None:
+        node_ids = [record['id'] for record in client.inventory.query(client.node, query)]
+        return node_ids, not client.inventory.fetched
+    node_ids = [record['id'] for record in client.inventory.find(client.node, **filters) or []]
+    if len(node_ids) == 0:
+        # the cache is stale, ask the API
+        return [node.id for node in client.node.list_nodes(**filters)], False
+    return node_ids, True
+
+
+def _still_matches(node, query, filters):
+    record = node_to_record(node)
+    if query is not None:
+        return matches_all(query, record)
+    for key, value in filters.items():
+        values = record.get(FILTER_FIELDS[key])
+        if value is not None and value not in (values if isinstance(values, list) else [values]):
+            return False
+    return True
+
+
+def _get_single_server_from_filters(client, query=None, verify=False, **kwargs):
+    # (server id, its node if it had to be fetched)
     try:
+        if query is not None:
+            if kwargs.get('ex_ipv6'):
+                query = query + [Predicate('ipv6', '=', kwargs['ex_ipv6'])]
         # fix this line
-        if len(kwargs.keys()) == 0 or not kwargs['ex_ipv6']:
+        elif len(kwargs.keys()) == 0 or not kwargs['ex_ipv6']:
             click.secho("No serverId or filters for servers found")
-            exit(1)
-        node_list = client.node.list_nodes(**kwargs)
-        if len(node_list) > 1:
+            sys.exit(1)
+        node_ids, cached = _find_server_ids(client, query, kwargs)
+        node = None
+        if verify and cached and len(node_ids) == 1:
+            try:
+                node = client.node.ex_get_node_by_id(node_ids[0])
+            except DimensionDataAPIException as e:
+                if e.code != 'RESOURCE_NOT_FOUND':
+                    raise
+            if node is None or not _still_matches(node, query, kwargs):
+                # the server is gone or changed since the inventory was cached
+                client.inventory.invalidate()
+                node_ids, _ = _find_server_ids(client, query, kwargs)
+                node = None
+        if len(node_ids) > 1:
             click.secho("Too many nodes found in filter", fg='red', bold=True)
-            exit(1)
-        if len(node_list) == 0:
+            sys.exit(1)
+        if len(node_ids) == 0:
             click.secho("No nodes found with fitler", fg='red', bold=True)
-            exit(1)
-        return node_list[0].id
+            sys.exit(1)
+        return node_ids[0], node
     except DimensionDataAPIException as e:
         handle_dd_api_exception(e)
 
 
 def handle_dd_api_exception(e):
     click.secho("{0}".format(e), fg='red', bold=True)
-    exit(1)
+    if e.code in RETRYABLE_CODES or e.code in RETRYABLE_STATUSES:
+        click.secho("The API was still busy after retrying, try again later or with a lower --apiRate", fg='red')
+    sys.exit(1)
+
 
+def iter_flat_items(d, keys=None, separator='.'):
+    """Yield (key, value) for every leaf of a nested dict in a single pass.
+
+    Nested dict keys are joined with ``separator`` and list elements get
+    their index (``disks.0.sizeGb``); empty dicts and lists are leaves
+    themselves. If ``keys`` is given only those flattened keys, and
+    everything below them, are produced and other branches are not walked
+    at all.
+    """
+    prefixes = None
+    if keys is not None:
+        keys = set(keys)
+        prefixes = set()
+        for key in keys:
+            parts = key.split(separator)
+            for i in range(1, len(parts)):
+                prefixes.add(separator.join(parts[:i]))
+    # a stack of (key prefix, iterator over children, filtered) walked depth
+    # first, so the pairs come out in the original order without recursion
+    stack = [('', _iter_children(d), keys is not None)]
+    while stack:
+        prefix, children, filtered = stack[-1]
+        for key, value in children:
+            path = prefix + key
+            if filtered and path not in keys:
+                if path not in prefixes:
+                    continue
+                child_filtered = True
+            else:
+                child_filtered = False
+            if isinstance(value, (dict, list, tuple)) and value:
+                stack.append((path + separator, _iter_children(value), child_filtered))
+                break
+            if not child_filtered:
+                # a leaf where a whitelisted key expected more nesting is not one of the keys
+                yield path, value
+        else:
+            stack.pop()
 
-def flattenDict(d, result=None):
+
+def _iter_children(value):
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value):
+            return iter(value.items())
+        return (('{0}'.format(k), v) for k, v in value.items())
+    return zip(['{0}'.format(i) for i in range(len(value))], value)
+
+
+def flattenDict(d, result=None, keys=None):
     if result is None:
         result = {}
-    for key in d:
-        value = d[key]
-        if isinstance(value, dict):
-            value1 = {}
-            for keyIn in value:
-                value1[".".join([key, keyIn])] = value[keyIn]
-            flattenDict(value1, result)
-        elif isinstance(value, (tuple, list)):
-            for indexB, element in enumerate(value):
-                if isinstance(element, dict):
-                    value1 = {}
-                    index = 0
-                    for keyIn in element:
-                        value1[".".join([key, keyIn])] = value[indexB][keyIn]
-                        index += 1
-                    for keyA in value1:
-                        flattenDict(value1, result)
-        else:
-            result[key] = value
+    result.update(iter_flat_items(d, keys))
     return result
@@ -0,0 +1,203 @@
+import click
+import random
+import sys
+import time
+from collections import namedtuple
+from libcloud.common.dimensiondata import DimensionDataAPIException
+from libcloud.compute.types import NodeState
+from didata_cli.utils import handle_dd_api_exception
+
+DEFAULT_TIMEOUT = 1800
+
+# server targets
+RUNNING = 'RUNNING'
+STOPPED = 'STOPPED'
+DELETED = 'DELETED'
+# backup target
+BACKUP_ENABLED = 'BACKUP_ENABLED'
+
+# a datacenter with at least this many servers in flight is polled with one
+# list_nodes query instead of a GET per server
+BATCH_THRESHOLD = 10
+
+WaitResult = namedtuple('WaitResult', ['id', 'target', 'ok', 'detail'])
+
+
+def wait_options(f):
+    """Add --wait and --waitTimeout to a command."""
+    f = click.option('--waitTimeout', type=int, default=DEFAULT_TIMEOUT,
+                     help="Seconds to wait before giving up with --wait")(f)
+    f = click.option('--wait', is_flag=True, default=False,
+                     help="Wait for the operation to complete")(f)
+    return f
+
+
+def get_node_or_none(driver, node_id):
+    try:
+        return driver.ex_get_node_by_id(node_id)
+    except DimensionDataAPIException as e:
+        if e.code == 'RESOURCE_NOT_FOUND':
+            return None
+        raise
+
+
+class Backoff(object):
+    """Exponential backoff with jitter that starts over after progress."""
+
+    def __init__(self, initial=2.0, maximum=30.0, factor=1.5, jitter=0.25):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.delay = initial
+
+    def reset(self):
+        self.delay = self.initial
+
+    def next(self):
+        delay = self.delay
+        self.delay = min(self.maximum, self.delay * self.factor)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class Waiter(object):
+    """Polls pending operations until they reach their target or time out.
+
+    ``poll`` is called with a dict of pending id -> target and returns a
+    dict of id -> (ok, detail) for the operations that finished.
+    """
+
+    def __init__(self, poll, timeout=DEFAULT_TIMEOUT, backoff=None, sleep=time.sleep, clock=time.time):
+        self.poll = poll
+        self.timeout = timeout
+        self.backoff = backoff or Backoff()
+        self.sleep = sleep
+        self.clock = clock
+        self.pending = {}
+
+    def add(self, item_id, target):
+        self.pending[item_id] = target
+
+    def wait(self, on_result=None):
+        deadline = self.clock() + self.timeout
+        results = []
+        while self.pending:
+            finished = self.poll(dict(self.pending))
+            for item_id, (ok, detail) in finished.items():
+                result = WaitResult(item_id, self.pending.pop(item_id), ok, detail)
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+            if not self.pending:
+                break
+            if finished:
+                self.backoff.reset()
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                break
+            self.sleep(min(self.backoff.next(), remaining))
+        for item_id, target in sorted(self.pending.items()):
+            result = WaitResult(item_id, target, False, 'timed out')
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+        self.pending = {}
+        return results
+
+
+class NodePoller(object):
+    """Checks server targets, sharing one list_nodes query per datacenter."""
+
+    def __init__(self, driver, batch_threshold=BATCH_THRESHOLD):
+        self.driver = driver
+        self.batch_threshold = batch_threshold
+        self.datacenters = {}
+
+    def add(self, waiter, node, target):
+        self.datacenters[node.id] = node.extra.get('datacenterId')
+        waiter.add(node.id, target)
+
+    def __call__(self, pending):
+        by_datacenter = {}
+        for node_id in pending:
+            by_datacenter.setdefault(self.datacenters.get(node_id), []).append(node_id)
+        finished = {}
+        for datacenter, node_ids in by_datacenter.items():
+            if datacenter is not None and len(node_ids) >= self.batch_threshold:
+                nodes = dict((node.id, node) for node in self.driver.list_nodes(ex_location=datacenter))
+            else:
+                nodes = dict((node_id, self._get_node(node_id)) for node_id in node_ids)
+            for node_id in node_ids:
+                status = self.check(nodes.get(node_id), pending[node_id])
+                if status is not None:
+                    finished[node_id] = status
+        return finished
+
+    def _get_node(self, node_id):
+        return get_node_or_none(self.driver, node_id)
+
+    @staticmethod
+    def check(node, target):
+        if node is None:
+            return (True, 'deleted') if target == DELETED else (False, 'server not found')
+        status = node.extra.get('status')
+        if getattr(status, 'failure_reason', None):
+            return False, status.failure_reason
+        if getattr(status, 'action', None):
+            return None
+        if target == RUNNING and node.state == NodeState.RUNNING:
+            return True, 'running'
+        if target == STOPPED and node.state == NodeState.STOPPED:
+            return True, 'stopped'
+        return None
+
+
+class BackupPoller(object):
+    """Checks that backups have finished being enabled on servers."""
+
+    def __init__(self, driver, throttle=None):
+        self.driver = driver
+        self.throttle = throttle
+
+    def __call__(self, pending):
+        finished = {}
+        for server_id in pending:
+            if self.throttle is not None:
+                self.throttle()
+            details = self.driver.ex_get_backup_details_for_target(server_id)
+            if details is not None and details.status == 'NORMAL':
+                finished[server_id] = (True, 'backup enabled')
+        return finished
+
+
+def echo_wait_result(result):
+    if result.ok:
+        click.secho("{0} is {1}".format(result.id, result.detail), fg='green')
+    else:
+        click.secho("{0} did not reach {1}: {2}".format(result.id, result.target, result.detail), fg='red')
+
+
+def wait_for_nodes(driver, targets, timeout):
+    """Wait for (node, target) pairs, echo each result and exit 1 on any failure."""
+    poller = NodePoller(driver)
+    waiter = Waiter(poller, timeout=timeout)
+    for node, target in targets:
+        poller.add(waiter, node, target)
+    return _finish(waiter)
+
+
+def wait_for_backups(driver, server_ids, timeout):
+    waiter = Waiter(BackupPoller(driver), timeout=timeout)
+    for server_id in server_ids:
+        waiter.add(server_id, BACKUP_ENABLED)
+    return _finish(waiter)
+
+
+def _finish(waiter):
+    try:
+        results = waiter.wait(on_result=echo_wait_result)
+    except DimensionDataAPIException as e:
+        handle_dd_api_exception(e)
+    if not all(result.ok for result in results):
+        sys.exit(1)
+    return results
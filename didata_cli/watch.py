@@ -0,0 +1,155 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+# with more pending servers than this a fast poll lists the fleet instead
+# of getting each pending server
+BATCH_THRESHOLD = 10
+
+
+def status_snapshot(status):
+    """The parts of ``extra['status']`` worth watching, None when nothing is in progress."""
+    if status is None or not (getattr(status, 'action', None) or getattr(status, 'failure_reason', None)):
+        return None
+    return OrderedDict([
+        ('action', status.action),
+        ('requestTime', status.request_time),
+        ('userName', status.user_name),
+        ('numberOfSteps', status.number_of_steps),
+        ('stepName', status.step_name),
+        ('stepNumber', status.step_number),
+        ('stepPercentComplete', status.step_percent_complete),
+        ('failureReason', status.failure_reason),
+    ])
+
+
+def node_snapshot(node):
+    return OrderedDict([
+        ('name', node.name),
+        ('datacenterId', node.extra.get('datacenterId')),
+        ('state', '{0}'.format(node.state)),
+        ('privateIpv4', list(node.private_ips)),
+        ('publicIps', list(node.public_ips)),
+        ('ipv6', node.extra.get('ipv6')),
+        ('status', status_snapshot(node.extra.get('status'))),
+    ])
+
+
+def diff_snapshot(old, new):
+    """{field: [old value, new value]} for the fields that differ."""
+    changes = OrderedDict()
+    for field in new:
+        if old.get(field) != new[field]:
+            changes[field] = [old.get(field), new[field]]
+    return changes
+
+
+def event(kind, node_id, snapshot, changes=None):
+    record = OrderedDict([
+        ('event', kind),
+        ('time', datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')),
+        ('id', node_id),
+        ('name', snapshot['name']),
+    ])
+    if changes is None:
+        record['server'] = snapshot
+    else:
+        record['changes'] = changes
+    return record
+
+
+class Watcher(object):
+    """Polls servers and reports what changed since the previous poll.
+
+    ``list_nodes()`` returns the watched servers and ``get_node(id)`` one
+    server or None. While servers have operations in progress only those
+    are polled, every ``fast_interval`` seconds; the whole list is polled
+    every ``interval`` seconds, stretching to ``max_interval`` while
+    nothing changes.
+    """
+
+    def __init__(self, list_nodes, get_node, interval=60, fast_interval=5, max_interval=None,
+                 clock=time.time, sleep=time.sleep):
+        self.list_nodes = list_nodes
+        self.get_node = get_node
+        self.interval = interval
+        self.fast_interval = min(fast_interval, interval)
+        self.max_interval = max(interval, max_interval or interval * 4)
+        self.clock = clock
+        self.sleep = sleep
+        self.snapshot = None
+        self.full_interval = interval
+
+    def pending(self):
+        return [node_id for node_id, snapshot in self.snapshot.items()
+                if snapshot['status'] is not None and snapshot['status']['action']]
+
+    def poll_all(self, initial=False):
+        """Events for a poll of every server; the first poll only emits with ``initial``."""
+        snapshot = OrderedDict((node.id, node_snapshot(node)) for node in self.list_nodes())
+        previous, self.snapshot = self.snapshot, snapshot
+        if previous is None:
+            return [event(ADDED, node_id, new) for node_id, new in snapshot.items()] if initial else []
+        events = []
+        for node_id, new in snapshot.items():
+            old = previous.get(node_id)
+            if old is None:
+                events.append(event(ADDED, node_id, new))
+                continue
+            changes = diff_snapshot(old, new)
+            if changes:
+                events.append(event(CHANGED, node_id, new, changes))
+        for node_id, old in previous.items():
+            if node_id not in snapshot:
+                events.append(event(REMOVED, node_id, old))
+        return events
+
+    def poll_pending(self, node_ids):
+        """Events for a poll of just the servers with operations in progress."""
+        events = []
+        for node_id in node_ids:
+            node = self.get_node(node_id)
+            old = self.snapshot[node_id]
+            if node is None:
+                del self.snapshot[node_id]
+                events.append(event(REMOVED, node_id, old))
+                continue
+            new = node_snapshot(node)
+            self.snapshot[node_id] = new
+            changes = diff_snapshot(old, new)
+            if changes:
+                events.append(event(CHANGED, node_id, new, changes))
+        return events
+
+    def watch(self, emit, polls=None, initial=False):
+        """Call ``emit(event)`` for every change, for ``polls`` polls or forever."""
+        done = 0
+        next_full = self.clock()
+        while polls is None or done < polls:
+            now = self.clock()
+            pending = self.pending() if self.snapshot is not None else []
+            if self.snapshot is None or now >= next_full or len(pending) > BATCH_THRESHOLD:
+                first = self.snapshot is None
+                events = self.poll_all(initial)
+                # idle fleets are polled less and less often
+                if events or first:
+                    self.full_interval = self.interval
+                else:
+                    self.full_interval = min(self.max_interval, self.full_interval * 2)
+                next_full = now + self.full_interval
+            else:
+                events = self.poll_pending(pending)
+            for record in events:
+                emit(record)
+            done += 1
+            if polls is not None and done >= polls:
+                break
+            delay = next_full - self.clock()
+            if self.pending():
+                delay = min(delay, self.fast_interval)
+            if delay > 0:
+                self.sleep(delay)
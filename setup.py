@@ -17,13 +17,14 @@ import sys
 from setuptools import setup, find_packages
 
 wargs = {}
-requires = ['click',
-            'apache-libcloud>=1.0.0-pre1']
+requires = ['click>=8.0',
+            'apache-libcloud>=1.0.0-pre1',
+            'requests']
 
 # python 2.7 hackery
 if sys.version_info <= (3, 0):
     requires.extend(
-        ["future"]
+        ["future", "futures"]
     )
 
 setup(
@@ -36,6 +37,8 @@ setup(
     version="0.1.6",
     packages=find_packages(exclude=["contrib", "docs", "tests*", "tasks", "venv"]),
     install_requires=requires,
+    # YAML plans for `didata apply`, JSON plans work without it
+    extras_require={'yaml': ['PyYAML']},
     setup_requires=[],
     classifiers=[
                 'Development Status :: 4 - Beta',
@@ -48,6 +51,6 @@ setup(
     dependency_links = ['https://github.com/apache/libcloud/tarball/trunk#egg=apache-libcloud-1.0.0-pre1-71'],
     entry_points='''
         [console_scripts]
-        didata=didata_cli.cli:cli
+        didata=didata_cli.agent:main
     ''',
 )
@@ -0,0 +1,344 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+try:
+    from urllib.parse import urlsplit, parse_qsl
+except ImportError:
+    from urlparse import urlsplit, parse_qsl
+
+from xml.sax.saxutils import escape, quoteattr
+
+ORG_ID = '8a8f6abc-2745-4d8a-9cbc-8dabe5a7d0e4'
+TYPES_NS = 'urn:didata.com:api:cloud:types'
+BACKUP_NS = 'http://oec.api.opsource.net/schemas/backup'
+NETWORK_NS = 'http://oec.api.opsource.net/schemas/network'
+DATACENTERS = [
+    ('NA9', 'US - East 3 - MCP 2.0', 'US'),
+    ('NA12', 'US - West - MCP 2.0', 'US'),
+    ('EU6', 'Europe (Germany) - MCP 2.0', 'DE'),
+    ('AP3', 'Asia Pacific (Singapore) - MCP 2.0', 'SG'),
+]
+
+_CAAS_PATH = re.compile(r'^/caas/[0-9.]+/[^/]+/(.*)$')
+_OEC_PATH = re.compile(r'^/oec/0\.9/[^/]+/(.*)$')
+
+
+def fixture_name(method, url):
+    """File name a response to ``method url`` is recorded under."""
+    parts = urlsplit(url)
+    name = '{0}{1}'.format(method.upper(), parts.path)
+    query = sorted(parse_qsl(parts.query))
+    if query:
+        name += '__' + '&'.join('{0}={1}'.format(key, value) for key, value in query)
+    name = re.sub(r'[^A-Za-z0-9.=&-]+', '_', name)
+    if len(name) > 200:
+        name = '{0}_{1}'.format(name[:150], hashlib.sha1(name.encode('utf-8')).hexdigest())
+    return name + '.json'
+
+
+def make_response(request, status, body, reason=None):
+    response = Response()
+    response.status_code = status
+    response.reason = reason or ('OK' if status == 200 else 'Error')
+    response.headers = CaseInsensitiveDict({'Content-Type': 'text/xml; charset=utf-8'})
+    response.encoding = 'utf-8'
+    response._content = body.encode('utf-8')
+    response.url = request.url
+    response.request = request
+    return response
+
+
+def error_body(code, message):
+    return ('<?xml version="1.0" encoding="UTF-8"?><response xmlns="{0}"><operation>REPLAY</operation>'
+            '<responseCode>{1}</responseCode><message>{2}</message></response>').format(
+        TYPES_NS, escape(code), escape(message))
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Sends requests to the real API and saves every response to ``directory``.
+
+    Recordings contain whatever the API returned, including the account's
+    user name and e-mail address, so check them before sharing.
+    """
+
+    def __init__(self, directory, **kwargs):
+        super(RecordingAdapter, self).__init__(**kwargs)
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def send(self, request, **kwargs):
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        path = os.path.join(self.directory, fixture_name(request.method, request.url))
+        with open(path, 'w') as f:
+            json.dump({'status': response.status_code, 'body': response.text}, f)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Answers requests from recorded responses and/or a SyntheticFleet.
+
+    Nothing is sent over the network. Requests that have neither a recording
+    nor a synthetic answer get the API's RESOURCE_NOT_FOUND error.
+    """
+
+    def __init__(self, directory=None, fleet=None):
+        super(ReplayAdapter, self).__init__()
+        self.directory = directory
+        self.fleet = fleet
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            self.requests += 1
+        answer = self._recorded(request)
+        if answer is None and self.fleet is not None:
+            parts = urlsplit(request.url)
+            answer = self.fleet.respond(request.method, parts.path, dict(parse_qsl(parts.query)))
+        if answer is None:
+            answer = (400, error_body('RESOURCE_NOT_FOUND', 'No replay response for {0} {1}'.format(
+                request.method, request.url)))
+        return make_response(request, *answer)
+
+    def _recorded(self, request):
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, fixture_name(request.method, request.url))
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError):
+            return None
+        return data['status'], data['body']
+
+    def close(self):
+        pass
+
+
+class SyntheticFleet(object):
+    """Generates CloudControl XML for a made up account with ``size`` servers.
+
+    Servers are derived from their position rather than stored, so a fleet
+    of any size answers paginated and filtered server listings, single
+    server lookups, datacenters, network domains and backup details.
+    """
+
+    def __init__(self, size, datacenters=DATACENTERS):
+        self.size = size
+        self.datacenters = datacenters
+        self._listing = None
+
+    @staticmethod
+    def server_id(index):
+        return '00000000-0000-4000-8000-{0:012x}'.format(index)
+
+    @staticmethod
+    def network_domain_id(datacenter):
+        digest = hashlib.sha1(datacenter.encode('utf-8')).hexdigest()
+        return '00000000-0000-4000-9000-{0}'.format(digest[:12])
+
+    def server(self, index):
+        datacenter = self.datacenters[index % len(self.datacenters)][0]
+        return {
+            'id': self.server_id(index),
+            'name': 'server{0:05d}'.format(index),
+            'datacenterId': datacenter,
+            'networkDomainId': self.network_domain_id(datacenter),
+            'privateIpv4': '10.{0}.{1}.{2}'.format((index >> 16) & 255, (index >> 8) & 255, index & 255),
+            'ipv6': '2607:f480:111:1000::{0:x}'.format(index),
+            'started': 'false' if index % 10 == 9 else 'true',
+            'backup': index % 3 != 2,
+        }
+
+    def respond(self, method, path, params):
+        """Return (status, body) for a request, or None if it is not simulated."""
+        if method != 'GET':
+            return None
+        if path == '/oec/0.9/myaccount':
+            return 200, self.account_xml()
+        match = _CAAS_PATH.match(path)
+        if match:
+            action = match.group(1)
+            if action == 'server/server':
+                return 200, self.servers_xml(params)
+            if action.startswith('server/server/'):
+                return self.server_xml(action.split('/')[-1])
+            if action == 'infrastructure/datacenter':
+                return 200, self.datacenters_xml(params)
+            if action == 'network/networkDomain':
+                return 200, self.network_domains_xml(params)
+            if action == 'network/vlan':
+                return 200, self.vlans_xml(params)
+            return None
+        match = _OEC_PATH.match(path)
+        if match and match.group(1).startswith('networkWithLocation'):
+            # only MCP 2.0 datacenters, which have no networks
+            return 200, '<?xml version="1.0" encoding="UTF-8"?><NetworkWithLocations xmlns="{0}"/>'.format(NETWORK_NS)
+        if match and re.match(r'^server/[^/]+/backup$', match.group(1)):
+            return self.backup_xml(match.group(1).split('/')[1])
+        if match and re.match(r'^server/[^/]+/backup/client/(type|storagePolicy|schedulePolicy)$', match.group(1)):
+            parts = match.group(1).split('/')
+            return self.backup_list_xml(parts[1], parts[-1])
+        return None
+
+    def _index(self, server_id):
+        if not server_id.startswith('00000000-0000-4000-8000-'):
+            return None
+        index = int(server_id.rsplit('-', 1)[1], 16)
+        return index if index < self.size else None
+
+    def _matches(self, server, params):
+        for key in ('id', 'name', 'datacenterId', 'networkDomainId', 'privateIpv4', 'ipv6', 'started'):
+            if key in params and params[key] != server[key]:
+                return False
+        return True
+
+    def account_xml(self):
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<ns3:Account xmlns:ns3="http://oec.api.opsource.net/schemas/directory">'
+                '<ns3:userName>replay</ns3:userName><ns3:orgId>{0}</ns3:orgId></ns3:Account>').format(ORG_ID)
+
+    def _page(self, root, items, params, render=None):
+        page_size = int(params.get('pageSize', 250))
+        page_number = int(params.get('pageNumber', 1))
+        page = items[(page_number - 1) * page_size:page_number * page_size]
+        if render is not None:
+            page = [render(item) for item in page]
+        return ('<?xml version="1.0" encoding="UTF-8"?><{0} xmlns="{1}" pageNumber="{2}" pageCount="{3}" '
+                'totalCount="{4}" pageSize="{5}">{6}</{0}>').format(
+            root, TYPES_NS, page_number, len(page), len(items), page_size, ''.join(page))
+
+    def servers_xml(self, params):
+        # paging through a listing re-sends the same filters, so the matching
+        # servers are only worked out once; only the requested page is rendered
+        filters = tuple(sorted((key, value) for key, value in params.items()
+                               if key not in ('pageSize', 'pageNumber')))
+        if self._listing is None or self._listing[0] != filters:
+            indexes = [index for index in range(self.size) if self._matches(self.server(index), params)]
+            self._listing = (filters, indexes)
+        return self._page('servers', self._listing[1], params,
+                          lambda index: self._server_element(self.server(index)))
+
+    def server_xml(self, server_id):
+        index = self._index(server_id)
+        if index is None:
+            return 400, error_body('RESOURCE_NOT_FOUND', 'Server {0} not found.'.format(server_id))
+        return 200, '<?xml version="1.0" encoding="UTF-8"?>' + self._server_element(self.server(index), TYPES_NS)
+
+    def _server_element(self, server, namespace=None):
+        backup = ''
+        if server['backup']:
+            backup = '<backup assetId="{0}-backup" servicePlan="Enterprise" state="NORMAL"/>'.format(server['id'])
+        return (
+            '<server{xmlns} id="{id}" datacenterId="{datacenterId}"><name>{name}</name>'
+            '<description>synthetic server</description><guest osCustomization="true">'
+            '<operatingSystem id="CENTOS764" displayName="CENTOS7/64" family="UNIX"/>'
+            '<vmTools versionStatus="CURRENT" runningStatus="RUNNING" apiVersion="9354"/></guest>'
+            '<cpu count="2" speed="STANDARD" coresPerSocket="1"/><memoryGb>4</memoryGb>'
+            '<disk id="{id}-0" scsiId="0" sizeGb="10" speed="STANDARD" state="NORMAL"/>'
+            '<networkInfo networkDomainId="{networkDomainId}"><primaryNic id="{id}-nic" '
+            'privateIpv4="{privateIpv4}" ipv6="{ipv6}" vlanId="{networkDomainId}" vlanName="default" '
+            'state="NORMAL"/></networkInfo>{backup}<sourceImageId>00000000-0000-4000-a000-000000000001</sourceImageId>'
+            '<createTime>2016-01-01T00:00:00.000Z</createTime><deployed>true</deployed>'
+            '<started>{started}</started><state>NORMAL</state></server>'
+        ).format(xmlns=' xmlns="{0}"'.format(namespace) if namespace else '', **dict(server, backup=backup))
+
+    def datacenters_xml(self, params):
+        datacenters = [
+            '<datacenter id={0} type="MCP 2.0"><displayName>{1}</displayName>'
+            '<country>{2}</country></datacenter>'.format(quoteattr(datacenter), escape(name), country)
+            for datacenter, name, country in self.datacenters
+            if params.get('id') in (None, datacenter)]
+        return self._page('datacenters', datacenters, params)
+
+    def network_domains_xml(self, params):
+        network_domains = [
+            '<networkDomain id="{0}" datacenterId={1}><name>{2}-domain</name><description/><type>ESSENTIALS</type>'
+            '<snatIpv4Address>168.128.0.1</snatIpv4Address><createTime>2016-01-01T00:00:00.000Z</createTime>'
+            '<state>NORMAL</state></networkDomain>'.format(
+                self.network_domain_id(datacenter), quoteattr(datacenter), escape(datacenter))
+            for datacenter, _, _ in self.datacenters
+            if params.get('datacenterId') in (None, datacenter)]
+        return self._page('networkDomains', network_domains, params)
+
+    def vlans_xml(self, params):
+        # every server is on its network domain's one VLAN, which shares its ID
+        vlans = [
+            '<vlan id="{0}" datacenterId={1}><networkDomain id="{0}" name={2}/><name>{3}-vlan</name>'
+            '<description/><privateIpv4Range address="10.0.0.0" prefixSize="8"/>'
+            '<ipv6Range address="2607:f480:111:1000::" prefixSize="64"/><ipv4GatewayAddress>10.0.0.1'
+            '</ipv4GatewayAddress><createTime>2016-01-01T00:00:00.000Z</createTime><state>NORMAL</state>'
+            '</vlan>'.format(self.network_domain_id(datacenter), quoteattr(datacenter),
+                             quoteattr(datacenter + '-domain'), escape(datacenter))
+            for datacenter, _, _ in self.datacenters
+            if params.get('datacenterId') in (None, datacenter)]
+        return self._page('vlans', vlans, params)
+
+    def backup_xml(self, server_id):
+        index = self._index(server_id)
+        if index is None or not self.server(index)['backup']:
+            return 400, error_body('RESOURCE_NOT_FOUND', 'Server {0} has no backup.'.format(server_id))
+        return 200, (
+            '<?xml version="1.0" encoding="UTF-8"?><BackupDetails xmlns="http://oec.api.opsource.net/schemas/backup" '
+            'assetId="{0}-backup" servicePlan="Enterprise" state="NORMAL"><backupClient id="{0}-client" '
+            'type="FA.Linux" isFileSystem="true" status="Active"><description>Linux File Agent</description>'
+            '<schedulePolicyName>12AM - 6AM</schedulePolicyName><storagePolicyName>14 Day Storage Policy'
+            '</storagePolicyName><times nextBackup="2016-02-09T00:00:00" lastOnline="2016-02-08T06:10:25"/>'
+            '<totalBackupSizeGb>{1}</totalBackupSizeGb></backupClient></BackupDetails>'
+        ).format(server_id, index % 100)
+
+    def backup_list_xml(self, server_id, kind):
+        index = self._index(server_id)
+        if index is None or not self.server(index)['backup']:
+            return 400, error_body('RESOURCE_NOT_FOUND', 'Server {0} has no backup.'.format(server_id))
+        elements = {
+            'type': '<backupClientType type="FA.Linux" isFileSystem="true" description="Linux File Agent"/>'
+                    '<backupClientType type="MySQL" isFileSystem="false" description="MySQL Agent"/>',
+            'storagePolicy': '<storagePolicy name="14 Day Storage Policy" retentionPeriodInDays="14"/>'
+                             '<storagePolicy name="30 Day Storage Policy" retentionPeriodInDays="30"/>',
+            'schedulePolicy': '<schedulePolicy name="12AM - 6AM" description="Daily backup will start between '
+                              '12AM - 6AM"/>',
+        }
+        return 200, '<?xml version="1.0" encoding="UTF-8"?><BackupList xmlns="{0}">{1}</BackupList>'.format(
+            BACKUP_NS, elements[kind])
+
+
+def main(args=None):
+    """Run didata against a recording or a synthetic fleet instead of the API.
+
+        python -m tests.replay --fleet 1000 server list
+        python -m tests.replay --record DIR server list
+        python -m tests.replay --replay DIR server list
+
+    Recordings contain the account's details, see RecordingAdapter.
+    """
+    from didata_cli.cli import cli, DiDataCLIClient
+    args = list(sys.argv[1:] if args is None else args)
+    record_dir = replay_dir = fleet = None
+    while args and args[0] in ('--record', '--replay', '--fleet'):
+        option, value = args.pop(0), args.pop(0)
+        if option == '--record':
+            record_dir = value
+        elif option == '--replay':
+            replay_dir = value
+        else:
+            fleet = SyntheticFleet(int(value))
+    client = DiDataCLIClient()
+    if record_dir:
+        client.adapter_factory = lambda size: RecordingAdapter(record_dir, pool_connections=4, pool_maxsize=size)
+    else:
+        adapter = ReplayAdapter(replay_dir, fleet)
+        client.adapter_factory = lambda size: adapter
+    cli.main(args, obj=client, prog_name='didata')
+
+
+if __name__ == '__main__':
+    main()
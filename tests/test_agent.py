@@ -0,0 +1,80 @@
+from didata_cli.agent import Agent, can_forward, control, forward
+from didata_cli.cli import DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet
+from io import StringIO
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+
+
+class AgentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'agent', 'agent.sock')
+        self.environ = {'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass', 'DIDATA_CACHE_DIR': self.tmp_dir}
+        self.adapter = ReplayAdapter(fleet=SyntheticFleet(20))
+        client = DiDataCLIClient()
+        client.adapter_factory = lambda size: self.adapter
+        self.agent = Agent(self.path, idle_timeout=30, client=client)
+        self.agent.bind()
+        thread = threading.Thread(target=self.agent.serve)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(control, 'stop', self.path)
+
+    def forward(self, argv, cwd=None):
+        out, err = StringIO(), StringIO()
+        code = forward(argv, self.path, self.environ, out, err, cwd=cwd)
+        return code, out.getvalue(), err.getvalue()
+
+    def test_commands_run_on_the_agent(self):
+        code, out, _ = self.forward(['location', 'list'])
+        assert code == 0
+        assert 'ID: NA9' in out
+        code, out, _ = self.forward(['server', 'list', '--datacenterId', 'NA12', '--output', 'jsonl'])
+        assert code == 0
+        assert len(out.splitlines()) == 5
+        # the driver and its org id lookup were reused
+        assert self.adapter.requests == 3
+        assert control('status', self.path)['commands'] == 2
+
+    def test_errors_are_returned(self):
+        code, _, err = self.forward(['server', 'list', '--bogus'])
+        assert code == 2
+        assert 'No such option' in err
+        code, out, _ = self.forward(['server', 'reboot'])
+        assert code == 1
+        assert 'No serverId or filters' in out
+
+    def test_relative_paths_are_the_callers(self):
+        caller_dir = os.path.join(self.tmp_dir, 'caller')
+        os.mkdir(caller_dir)
+        cwd = os.getcwd()
+        code, out, _ = self.forward(['--profileOutput', 'trace.json', 'inventory', 'record',
+                                     '--database', 'history.sqlite'], cwd=caller_dir)
+        assert code == 0, out
+        assert sorted(os.listdir(caller_dir)) == ['history.sqlite', 'trace.json']
+        assert not os.path.exists(os.path.join(cwd, 'trace.json'))
+        assert os.getcwd() == cwd
+
+    def test_busy_agent_turns_commands_away(self):
+        with self.agent.busy:
+            assert self.forward(['location', 'list']) == (None, '', '')
+            assert control('status', self.path)['commands'] == 0
+        assert self.forward(['location', 'list'])[0] == 0
+
+    def test_socket_is_private(self):
+        assert stat.S_IMODE(os.stat(self.path).st_mode) == 0o600
+        assert stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode) == 0o700
+
+    def test_falls_back_without_agent(self):
+        assert forward(['location', 'list'], os.path.join(self.tmp_dir, 'missing.sock'), self.environ) is None
+        assert not can_forward(['shell'], self.environ)
+        assert not can_forward(['server', 'watch', '--interval', '5'], self.environ)
+        assert not can_forward(['location', 'list'], {'DIDATA_USER': 'fakeuser'})
+        assert can_forward(['--password', 'x', 'location', 'list'], {'DIDATA_USER': 'fakeuser'})
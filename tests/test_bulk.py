@@ -0,0 +1,61 @@
+import threading
+import time
+
+from didata_cli.bulk import WorkerPool, ProgressFile, read_id_file
+
+
+def test_worker_pool_collects_results_and_errors():
+    def work(item, pool):
+        if item == 3:
+            raise ValueError('bad item')
+        return item * 2
+
+    results = WorkerPool(concurrency=4).map(work, range(5))
+    assert sorted(r.value for r in results if r.error is None) == [0, 2, 4, 8]
+    errors = [r for r in results if r.error is not None]
+    assert len(errors) == 1
+    assert errors[0].item == 3
+
+
+def test_worker_pool_per_key_limit():
+    lock = threading.Lock()
+    in_flight = {}
+    peak = {}
+
+    def work(item, pool):
+        key = item % 2
+        with pool.key_slot(key):
+            with lock:
+                in_flight[key] = in_flight.get(key, 0) + 1
+                peak[key] = max(peak.get(key, 0), in_flight[key])
+            time.sleep(0.01)
+            with lock:
+                in_flight[key] -= 1
+
+    WorkerPool(concurrency=8, per_key_limit=2).map(work, range(16))
+    assert peak == {0: 2, 1: 2}
+
+
+def test_read_id_file():
+    lines = ['abc\n', '\n', '# comment\n', 'def  # trailing\n']
+    assert read_id_file(lines) == ['abc', 'def']
+
+
+def test_worker_pool_throttle():
+    calls = []
+
+    def work(item, pool):
+        pool.throttle()
+        return item
+
+    WorkerPool(concurrency=2, throttle=lambda: calls.append(1)).map(work, range(3))
+    assert len(calls) == 3
+    WorkerPool(concurrency=2).map(work, range(3))
+
+
+def test_progress_file(tmpdir):
+    path = str(tmpdir.join('progress'))
+    progress = ProgressFile(path)
+    progress.mark_done('one')
+    assert ProgressFile(path).done == set(['one'])
+    ProgressFile(None).mark_done('two')
@@ -0,0 +1,77 @@
+from didata_cli.catalog import CatalogCache
+from didata_cli.cli import cli, DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet
+from click.testing import CliRunner
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class CatalogCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.path = os.path.join(self.cache_dir, 'catalog.json')
+
+    def test_concurrent_fetches_are_deduplicated(self):
+        cache = CatalogCache(self.path)
+        fetched = []
+        barrier = threading.Barrier(4, timeout=5)
+
+        def fetch():
+            fetched.append(1)
+            time.sleep(0.05)
+            return ['14 Day Storage Policy']
+
+        def get():
+            barrier.wait()
+            assert cache.get('backup/NA9/Essentials/storage_policies', fetch) == ['14 Day Storage Policy']
+        threads = [threading.Thread(target=get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(fetched) == 1
+        assert CatalogCache(self.path).get('backup/NA9/Essentials/storage_policies', fetch) == ['14 Day Storage Policy']
+        assert len(fetched) == 1
+
+    def test_expired_and_disabled(self):
+        CatalogCache(self.path).get('locations', lambda: [['NA9', 'US - East', 'US']])
+        assert CatalogCache(self.path, ttl=0).get('locations', lambda: []) == []
+        CatalogCache(self.path, enabled=False).get('other', lambda: [])
+        assert sorted(CatalogCache(self.path).load()) == ['locations']
+
+
+class CacheCommandTestCase(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.adapter = ReplayAdapter(fleet=SyntheticFleet(8))
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                     'DIDATA_CACHE_DIR': cache_dir})
+
+    def invoke(self, *args):
+        client = DiDataCLIClient()
+        client.adapter_factory = lambda size: self.adapter
+        result = self.runner.invoke(cli, list(args), obj=client)
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    def test_warm_then_commands_skip_the_api(self):
+        output = self.invoke('cache', 'warm')
+        assert 'Servers: 8' in output and 'Locations: 4' in output
+        # one representative server per datacenter and plan
+        assert output.count('Backup Enterprise in ') == 4
+        assert '2 client types, 2 storage policies, 1 schedule policies' in output
+        requests = self.adapter.requests
+        assert 'ID: EU6' in self.invoke('location', 'list', '--datacenterId', 'EU6')
+        output = self.invoke('backup', 'list-available-storage-policies', '--serverId', SyntheticFleet.server_id(4))
+        assert '30 Day Storage Policy' in output
+        assert self.adapter.requests == requests
+        self.invoke('cache', 'clear')
+        self.invoke('location', 'list')
+        # the account's orgId and the datacenters
+        assert self.adapter.requests == requests + 2
@@ -1,7 +1,9 @@
-from didata_cli.cli import cli
+from didata_cli.cli import cli, COMMANDS, DiDataCLIClient
 from click.testing import CliRunner
 import unittest
 import os
+import subprocess
+import sys
 import configparser
 
 
@@ -21,3 +23,20 @@ class DimensionDataCLITestCase(unittest.TestCase):
     def test_servers_help(self):
         result = self.runner.invoke(cli, ['server'], catch_exceptions=False)
         assert result.exit_code == 0
+
+    def test_command_registry_matches_modules(self):
+        cmd_folder = os.path.join(os.path.dirname(__file__), '..', 'didata_cli', 'commands')
+        modules = sorted(f[4:-3] for f in os.listdir(cmd_folder) if f.startswith('cmd_') and f.endswith('.py'))
+        assert [name for name, _ in COMMANDS] == modules
+
+    def test_help_does_not_import_libcloud(self):
+        script = 'import sys; from didata_cli.cli import cli; cli(["--help"], standalone_mode=False); ' \
+                 'sys.exit(int("libcloud" in sys.modules))'
+        assert subprocess.call([sys.executable, '-c', script], stdout=subprocess.PIPE) == 0
+
+    def test_drivers_are_built_lazily(self):
+        client = DiDataCLIClient()
+        client.init_client('fakeuser', 'fakepass')
+        assert client._drivers == {}
+        assert client.node is client.node
+        assert list(client._drivers) == ['node']
@@ -0,0 +1,149 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from didata_cli.commands.cmd_backup import bulk_enable
+from didata_cli.inventory import InventoryCache
+from click.testing import CliRunner
+from libcloud.backup.drivers.dimensiondata import DimensionDataBackupClientType, DimensionDataBackupStoragePolicy, \
+    DimensionDataBackupSchedulePolicy
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class BackupBulkEnableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                     'DIDATA_CACHE_DIR': self.cache_dir})
+        self.driver = mock.Mock()
+        patcher = mock.patch.object(DiDataCLIClient, 'worker_driver', return_value=self.driver)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.driver.ex_list_available_client_types.return_value = [
+            DimensionDataBackupClientType('FA.Linux', True, 'File system')]
+        self.driver.ex_list_available_storage_policies.return_value = [
+            DimensionDataBackupStoragePolicy('14 Day Storage Policy', 14, None)]
+        self.driver.ex_list_available_schedule_policies.return_value = [
+            DimensionDataBackupSchedulePolicy('12AM - 6AM', 'Nightly')]
+
+    def test_bulk_enable_skips_enrolled_and_resumes(self):
+        existing = mock.Mock(type=DimensionDataBackupClientType('FA.Linux', False, 'File system'))
+        enrolled = mock.Mock(extra={'datacenterId': 'NA9', 'servicePlan': 'Essentials'})
+        self.driver.ex_get_target_by_id.side_effect = \
+            lambda server_id: enrolled if server_id == 'old' or self.driver.create_target.called else None
+        self.driver.ex_get_backup_details_for_target.side_effect = lambda server_id: mock.Mock(
+            status='NORMAL', clients=[existing] if server_id == 'old' else [])
+        with self.runner.isolated_filesystem():
+            with open('ids.txt', 'w') as id_file:
+                id_file.write('new\nold\n')
+            args = ['backup', bulk_enable.name, '--servicePlan', 'Essentials', '--clientType', 'FA.Linux',
+                    '--storagePolicy', '14 Day Storage Policy', '--schedulePolicy', '12AM - 6AM',
+                    '--triggerOn', 'ON_FAILURE', '--notifyEmail', 'ops@example.com',
+                    '--serverIdFile', 'ids.txt', '--stateFile', 'progress']
+            result = self.runner.invoke(cli, args)
+            assert result.exit_code == 0, result.output
+            assert 'new: backups enabled, FA.Linux client added' in result.output
+            assert 'old: already enrolled, FA.Linux client already present' in result.output
+            self.driver.create_target.assert_called_once_with('new', 'new', extra={'servicePlan': 'Essentials'})
+            self.driver.ex_add_client_to_target.assert_called_once_with(
+                'new', 'FA.Linux', '14 Day Storage Policy', '12AM - 6AM', 'ON_FAILURE', 'ops@example.com')
+
+            result = self.runner.invoke(cli, args)
+            assert result.output.count('already done by a previous run') == 2
+            assert self.driver.create_target.call_count == 1
+
+    def test_bulk_enable_checks_policies_once_per_datacenter_and_plan(self):
+        self.driver.ex_get_target_by_id.return_value = mock.Mock(extra={'datacenterId': 'NA9',
+                                                                        'servicePlan': 'Essentials'})
+        self.driver.ex_get_backup_details_for_target.return_value = mock.Mock(status='NORMAL', clients=[])
+        with self.runner.isolated_filesystem():
+            with open('ids.txt', 'w') as id_file:
+                id_file.write('a\nb\nc\n')
+            result = self.runner.invoke(cli, ['backup', bulk_enable.name, '--servicePlan', 'Essentials',
+                                              '--clientType', 'FA.Linux', '--storagePolicy', '30 Day Storage Policy',
+                                              '--schedulePolicy', '12AM - 6AM', '--triggerOn', 'ON_FAILURE',
+                                              '--notifyEmail', 'ops@example.com', '--serverIdFile', 'ids.txt'])
+        assert result.exit_code == 1
+        assert result.output.count('30 Day Storage Policy is not available for Essentials backups in NA9, '
+                                   'pick one of: 14 Day Storage Policy') == 3
+        assert self.driver.ex_list_available_storage_policies.call_count == 1
+        self.driver.ex_add_client_to_target.assert_not_called()
+
+    def test_bulk_enable_checks_policies_before_enrolling(self):
+        def record(server_id, backup_plan=None):
+            return {'id': server_id, 'name': server_id, 'datacenter': 'NA9', 'backup_plan': backup_plan}
+        with mock.patch.dict(os.environ, {'DIDATA_CACHE_DIR': self.cache_dir}):
+            InventoryCache.for_account('dd-na', 'fakeuser').save([record('a'), record('b'), record('z', 'Essentials')])
+        with self.runner.isolated_filesystem():
+            with open('ids.txt', 'w') as id_file:
+                id_file.write('a\nb\n')
+            result = self.runner.invoke(cli, ['backup', bulk_enable.name, '--servicePlan', 'Essentials',
+                                              '--clientType', 'FA.Linux', '--storagePolicy', '30 Day Storage Policy',
+                                              '--schedulePolicy', '12AM - 6AM', '--triggerOn', 'ON_FAILURE',
+                                              '--notifyEmail', 'ops@example.com', '--serverIdFile', 'ids.txt'])
+        assert result.exit_code == 1
+        assert result.output.count('30 Day Storage Policy is not available for Essentials backups in NA9') == 1
+        self.driver.ex_list_available_storage_policies.assert_called_once_with('z')
+        self.driver.create_target.assert_not_called()
+
+    def test_bulk_enable_client_needs_policies_and_alerting(self):
+        args = ['backup', bulk_enable.name, '--servicePlan', 'Essentials', '--clientType', 'FA.Linux', '--name', 'web']
+        for extra in ([], ['--storagePolicy', '14 Day Storage Policy', '--schedulePolicy', '12AM - 6AM',
+                           '--triggerOn', 'ON_FAILURE']):
+            result = self.runner.invoke(cli, args + extra)
+            assert result.exit_code == 1
+            assert '--triggerOn and --notifyEmail are required with --clientType' in result.output
+        self.driver.create_target.assert_not_called()
+
+
+class BackupReportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass'})
+        self.driver = mock.Mock()
+        for name in ('driver', 'worker_driver'):
+            patcher = mock.patch.object(DiDataCLIClient, name, return_value=self.driver)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.driver.list_nodes.return_value = [mock.Mock(id=server_id) for server_id in ('a', 'b', 'c')]
+        job = mock.Mock(status='RUNNING', percentage=40)
+        backup_client = mock.Mock(type=DimensionDataBackupClientType('FA.Linux', False, 'File system'),
+                                  schedule_policy='12AM - 6AM', storage_policy='14 Day', running_job=job)
+        details = {
+            'a': mock.Mock(service_plan='Essentials', clients=[backup_client]),
+            'b': mock.Mock(service_plan='Advanced', clients=[]),
+            'c': None,
+        }
+        self.driver.ex_get_backup_details_for_target.side_effect = details.get
+
+    def test_report_summary(self):
+        result = self.runner.invoke(cli, ['backup', 'report', '--datacenterId', 'NA9'])
+        assert result.exit_code == 0, result.output
+        self.driver.list_nodes.assert_called_once_with(
+            ex_location='NA9', ex_network_domain=None, ex_network=None, ex_vlan=None, ex_image=None,
+            ex_deployed=None, ex_name=None, ex_state=None, ex_started=None, ex_ipv6=None, ex_ipv4=None)
+        assert 'a: Essentials, FA.Linux (12AM - 6AM / 14 Day), job RUNNING 40%' in result.output
+        assert 'c: backups not enabled' in result.output
+        for line in ('Servers: 3', 'Backups not enabled: 1', 'No clients: 1', 'Running jobs: 1',
+                     'Storage policy 14 Day: 1'):
+            assert line in result.output
+
+    def test_report_jsonl_rows(self):
+        result = self.runner.invoke(cli, ['backup', 'report', '--output', 'jsonl', '--columns', 'serverId,servicePlan'])
+        assert result.exit_code == 0, result.output
+        assert sorted(line for line in result.output.splitlines() if line.startswith('{')) == [
+            '{"serverId":"a","servicePlan":"Essentials"}',
+            '{"serverId":"b","servicePlan":"Advanced"}',
+            '{"serverId":"c","servicePlan":null}',
+        ]
+
+    def test_info_shows_the_whole_service_plan(self):
+        result = self.runner.invoke(cli, ['backup', 'info', '--serverId', 'b'])
+        assert result.exit_code == 0, result.output
+        assert 'Service Plan: Advanced\n' in result.output
+        result = self.runner.invoke(cli, ['backup', 'info', '--serverId', 'a', '--output', 'csv'])
+        assert result.output.splitlines()[1].startswith('a,Essentials,FA.Linux,')
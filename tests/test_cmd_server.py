@@ -0,0 +1,103 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from click.testing import CliRunner
+from libcloud.common.dimensiondata import DimensionDataAPIException
+from libcloud.compute.base import Node
+from libcloud.compute.types import NodeState
+from xml.etree import ElementTree
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def fake_node(node_id, datacenter='NA9'):
+    return Node(node_id, 'server-' + node_id, NodeState.RUNNING, [], ['10.0.0.1'], None,
+                extra={'datacenterId': datacenter, 'OS_displayName': 'UBUNTU14/64', 'ipv6': '::1'})
+
+
+def server_page(*node_ids):
+    servers = ''.join(
+        '<server id="{0}" datacenterId="NA9"><name>server-{0}</name><guest><operatingSystem displayName="UBUNTU14/64"/>'
+        '</guest><networkInfo networkDomainId="nd-1"><primaryNic privateIpv4="10.0.0.1" ipv6="::1"/></networkInfo>'
+        '<started>true</started><state>NORMAL</state></server>'.format(node_id) for node_id in node_ids)
+    return ElementTree.fromstring('<servers xmlns="urn:didata.com:api:cloud:types">{0}</servers>'.format(servers))
+
+
+class ServerBulkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass'})
+        self.driver = mock.Mock()
+        patcher = mock.patch.object(DiDataCLIClient, 'worker_driver', return_value=self.driver)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bulk_requires_filters(self):
+        result = self.runner.invoke(cli, ['server', 'bulk', '--action', 'start'])
+        assert result.exit_code == 1
+        assert 'No serverIdFile or filters' in result.output
+
+    def test_bulk_from_id_file(self):
+        self.driver.ex_get_node_by_id.side_effect = lambda node_id: fake_node(node_id)
+        self.driver.reboot_node.side_effect = lambda node: node.id != 'bad'
+        with self.runner.isolated_filesystem():
+            with open('ids.txt', 'w') as id_file:
+                id_file.write('one\ntwo\nbad\n')
+            result = self.runner.invoke(cli, ['server', 'bulk', '--action', 'reboot',
+                                              '--serverIdFile', 'ids.txt', '--perDatacenter', '1'])
+        assert result.exit_code == 1
+        assert self.driver.reboot_node.call_count == 3
+        assert 'Server one is being rebooted' in result.output
+        assert 'Server bad failed' in result.output
+        assert '2 succeeded, 1 failed' in result.output
+
+
+class ServerDestroyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass'})
+        self.driver = mock.Mock()
+        patcher = mock.patch.object(DiDataCLIClient, 'driver', return_value=self.driver)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_destroy_waits_for_the_server_to_go(self):
+        gone = DimensionDataAPIException('RESOURCE_NOT_FOUND', 'gone', self.driver)
+        self.driver.ex_get_node_by_id.side_effect = [fake_node('one'), gone]
+        self.driver.destroy_node.return_value = True
+        result = self.runner.invoke(cli, ['server', 'destroy', '--serverId', 'one', '--wait'])
+        assert result.exit_code == 0, result.output
+        assert 'Server one is being destroyed' in result.output
+        assert 'one is deleted' in result.output
+        assert self.driver.ex_get_node_by_id.call_count == 2
+
+
+class ServerListTestCase(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass'})
+        self.driver = mock.Mock()
+        patcher = mock.patch.object(DiDataCLIClient, 'driver', return_value=self.driver)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_list_streams_pages(self):
+        pages = [server_page('1', '2'), server_page('3')]
+        self.driver.connection.paginated_request_with_orgId_api_2.return_value = iter(pages)
+        result = self.runner.invoke(cli, ['server', 'list', '--pageSize', '2', '--datacenterId', 'NA9'])
+        assert result.exit_code == 0
+        assert result.output.count('Datacenter: NA9') == 3
+        self.driver.connection.paginated_request_with_orgId_api_2.assert_called_once_with(
+            'server/server', params={'datacenterId': 'NA9'}, page_size=2)
+
+    def test_list_limit(self):
+        self.driver.connection.paginated_request_with_orgId_api_2.return_value = iter([server_page('1', '2')])
+        result = self.runner.invoke(cli, ['server', 'list', '--limit', '1'])
+        assert result.exit_code == 0
+        assert 'ID: 1' in result.output
+        assert 'ID: 2' not in result.output
+
+    def test_list_csv_output(self):
+        self.driver.connection.paginated_request_with_orgId_api_2.return_value = iter([server_page('1')])
+        result = self.runner.invoke(cli, ['server', 'list', '--output', 'csv'])
+        assert result.exit_code == 0
+        assert result.output == 'id,name,datacenterId,OS_displayName,privateIpv4,ipv6\n' \
+                                '1,server-1,NA9,UBUNTU14/64,10.0.0.1,::1\n'
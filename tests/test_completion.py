@@ -0,0 +1,79 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from didata_cli.completion import complete, matching_lines, index_path, SERVERS
+from tests.replay import ReplayAdapter, SyntheticFleet
+from click.testing import CliRunner
+from io import StringIO
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+SERVER_ID = '00000000-0000-4000-8000-000000000001'
+
+
+class MatchingLinesTestCase(unittest.TestCase):
+    def test_values_and_descriptions_match(self):
+        text = 'a1\tweb01\na2\tdb01\nb1\tweb02\nc1\t\n'
+        assert matching_lines(text, '') == ['a1\tweb01', 'a2\tdb01', 'b1\tweb02', 'c1\t']
+        assert matching_lines(text, 'a') == ['a1\tweb01', 'a2\tdb01']
+        assert matching_lines(text, 'web') == ['a1\tweb01', 'b1\tweb02']
+        assert matching_lines(text, 'c1') == ['c1\t']
+        assert matching_lines(text, 'x') == []
+
+
+class CompleteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        patcher = mock.patch.dict(os.environ, {'DIDATA_CACHE_DIR': self.cache_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client = DiDataCLIClient()
+        client.adapter_factory = lambda size: ReplayAdapter(fleet=SyntheticFleet(12))
+        runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                'DIDATA_CACHE_DIR': self.cache_dir})
+        result = runner.invoke(cli, ['cache', 'warm'], obj=client)
+        assert result.exit_code == 0, result.output
+
+    def complete(self, words, shell='bash', **environ):
+        environ.update({'_DIDATA_COMPLETE': shell + '_complete', 'COMP_WORDS': words,
+                        'COMP_CWORD': '{0}'.format(len(words.split(' ')) - 1)})
+        out = StringIO()
+        with mock.patch('didata_cli.completion._refresh_in_background') as refresh:
+            handled = complete('didata', environ, out)
+        self.refresh = refresh
+        return out.getvalue() if handled else None
+
+    def test_values_come_from_the_index(self):
+        output = self.complete('didata --user fakeuser server start --serverId 00000000-0000-4000-8000-00000000000')
+        assert output.splitlines()[:2] == ['plain,00000000-0000-4000-8000-000000000000', 'plain,' + SERVER_ID]
+        assert len(output.splitlines()) == 12
+        assert not self.refresh.called
+        assert self.complete('didata server start --serverId server00001', DIDATA_USER='fakeuser') == \
+            'plain,' + SERVER_ID
+        assert self.complete('didata --user fakeuser server list --datacenterId NA', 'zsh') == \
+            'plain\nNA12\nUS - West - MCP 2.0\nplain\nNA9\nUS - East 3 - MCP 2.0'
+        assert self.complete('didata --user fakeuser backup enable --clientType F').startswith('plain,FA.')
+
+    def test_every_user_is_searched_without_a_user(self):
+        assert len(self.complete('didata server list --serverId ').splitlines()) == 12
+        assert self.complete('didata --region dd-eu server list --serverId ') == ''
+        assert not self.refresh.called
+
+    def test_stale_index_refreshes_in_background(self):
+        old = time.time() - 2 * 60 * 60
+        os.utime(index_path('dd-na', 'fakeuser', SERVERS), (old, old))
+        assert self.complete('didata --user fakeuser --password secret server start --serverId server00001')
+        region, user, environ = self.refresh.call_args[0]
+        assert (region, user, environ['DIDATA_PASSWORD']) == ('dd-na', 'fakeuser', 'secret')
+
+    def test_other_completions_are_left_to_click(self):
+        assert self.complete('didata server list --') is None
+        assert self.complete('didata ser') is None
+        assert self.complete('didata server list --name ') is None
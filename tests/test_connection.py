@@ -0,0 +1,125 @@
+import threading
+import unittest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from libcloud.backup.drivers.dimensiondata import DimensionDataBackupDriver
+from libcloud.compute.drivers.dimensiondata import DimensionDataNodeDriver
+from libcloud.http import LibcloudConnection
+from requests import Response
+from requests.adapters import BaseAdapter
+
+from didata_cli.connection import ConnectionPool
+
+MY_ACCOUNT = ('<?xml version="1.0" encoding="UTF-8"?>'
+              '<ns3:Account xmlns:ns3="http://oec.api.opsource.net/schemas/directory">'
+              '<ns3:userName>fakeuser</ns3:userName><ns3:orgId>8a8f6abc-2745-4d8a-9cbc-8dabe5a7d0e4</ns3:orgId>'
+              '</ns3:Account>')
+DATACENTERS = ('<?xml version="1.0" encoding="UTF-8"?><datacenters xmlns="urn:didata.com:api:cloud:types" '
+               'pageNumber="1" pageCount="1" totalCount="1" pageSize="250"><datacenter id="NA9" type="MCP 2.0">'
+               '<displayName>US - East 3 - MCP 2.0</displayName><country>US</country></datacenter></datacenters>')
+CLIENT_TYPES = ('<?xml version="1.0" encoding="UTF-8"?><BackupList xmlns="http://oec.api.opsource.net/schemas/backup">'
+                '<backupClientType type="FA.Linux" isFileSystem="true" description="Linux File Agent"/></BackupList>')
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    block_on_close = False
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self.connection = type('Connection', (object,), {'conn_class': LibcloudConnection})()
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def request(self, driver):
+        connection = driver.connection.conn_class(host='127.0.0.1', port=self.server.server_port, secure=False)
+        connection.request('GET', '/')
+        assert connection.response.content == b'ok'
+
+    def test_drivers_share_connections(self):
+        pool = ConnectionPool(size=2)
+        node, backup = pool.attach(FakeDriver()), pool.attach(FakeDriver())
+        for _ in range(2):
+            self.request(node)
+            self.request(backup)
+        assert pool.stats() == (1, 3)
+
+    def test_ensure_size_keeps_counts(self):
+        pool = ConnectionPool(size=1)
+        driver = pool.attach(FakeDriver())
+        self.request(driver)
+        pool.ensure_size(8)
+        self.request(driver)
+        assert pool.size == 8
+        assert pool.stats() == (2, 0)
+
+
+class DimensionDataAdapter(BaseAdapter):
+    """Answers the few CloudControl requests the tests make, counting them."""
+
+    def __init__(self):
+        super(DimensionDataAdapter, self).__init__()
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        response = Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/xml'
+        response.request = request
+        response.url = request.url
+        if request.url.endswith('/myaccount'):
+            body = MY_ACCOUNT
+        elif '/backup/client/type' in request.url:
+            body = CLIENT_TYPES
+        else:
+            body = DATACENTERS
+        response._content = body.encode('utf-8')
+        return response
+
+    def close(self):
+        pass
+
+
+class DimensionDataDriverTestCase(unittest.TestCase):
+    def test_real_drivers_use_the_shared_session(self):
+        pool = ConnectionPool(size=2)
+        node = pool.attach(DimensionDataNodeDriver('fakeuser', 'fakepass', 'dd-na'))
+        backup = pool.attach(DimensionDataBackupDriver('fakeuser', 'fakepass', 'dd-na'))
+        other_node = pool.attach(DimensionDataNodeDriver('fakeuser', 'fakepass', 'dd-na'))
+        adapter = DimensionDataAdapter()
+        pool.session.mount('https://', adapter)
+        for driver in (node, other_node):
+            assert [location.id for location in driver.list_locations()] == ['NA9']
+        assert [client_type.type for client_type in backup.ex_list_available_client_types('server-1')] == ['FA.Linux']
+        # every request, org id lookups included, went through the shared session
+        assert adapter.requests == 6
+        for driver in (node, backup, other_node):
+            assert driver.connection.connection.session is pool.session
@@ -0,0 +1,90 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from didata_cli.history import HistoryStore, parse_time
+from tests.replay import ReplayAdapter, SyntheticFleet
+from click.testing import CliRunner
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+DAY = 86400
+START = parse_time('2026-09-01')
+
+
+def server(server_id, datacenter='NA9', state='running'):
+    return {'id': server_id, 'name': 'server-' + server_id, 'state': state, 'datacenter': datacenter,
+            'cpu_count': 2, 'memory_gb': 4, 'ipv4': ['10.0.0.' + server_id], 'ipv6': None}
+
+
+class HistoryStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.store = HistoryStore(os.path.join(cache_dir, 'history.sqlite'))
+        self.addCleanup(self.store.close)
+        self.store.record([server('1'), server('2'), server('3', 'EU6')], taken=START)
+        self.store.record([server('1'), server('2'), server('3', 'EU6')], taken=START + 300)
+        self.store.record([server('1', state='stopped'), server('2')], taken=START + DAY)
+        self.store.record([server('1'), server('2'), server('4')], taken=START + 2 * DAY)
+
+    def test_only_changes_are_stored(self):
+        assert self.store.db.execute('SELECT count(*) FROM changes').fetchone()[0] == 3 + 2 + 2
+        snapshot_id, counts = self.store.record([server('1'), server('2'), server('4')], taken=START + 3 * DAY)
+        assert snapshot_id == 5 and list(counts.values()) == [0, 0, 0]
+
+    def test_concurrent_records_wait_for_each_other(self):
+        self.store.db.execute('BEGIN IMMEDIATE')
+        results = []
+
+        def record():
+            other = HistoryStore(self.store.path)
+            try:
+                results.append(other.record([server('1'), server('2'), server('5')], taken=START + 3 * DAY))
+            finally:
+                other.close()
+        thread = threading.Thread(target=record)
+        thread.start()
+        time.sleep(0.2)
+        assert not results
+        self.store.db.execute('DELETE FROM current WHERE server_id = ?', ('4',))
+        self.store.db.commit()
+        thread.join()
+        # the waiting record diffed against what was committed while it waited
+        assert list(results[0][1].values()) == [1, 0, 0]
+
+    def test_server_changes(self):
+        changes = list(self.store.server_changes('1', START + 1, START + 3 * DAY))
+        assert [(change['time'], change['change']) for change in changes] == [
+            ('2026-09-02T00:00:00Z', 'changed'), ('2026-09-03T00:00:00Z', 'changed')]
+        assert changes[0]['fields'] == {'state': ['running', 'stopped']}
+        assert [change['change'] for change in self.store.server_changes('3', START, START + 3 * DAY)] == \
+            ['added', 'removed']
+
+    def test_datacenter_counts_per_day(self):
+        counts = list(self.store.datacenter_counts(START, START + 3 * DAY, DAY))
+        assert counts == [(START, {'EU6': 1, 'NA9': 2}), (START + DAY, {'EU6': 0, 'NA9': 2}),
+                          (START + 2 * DAY, {'EU6': 0, 'NA9': 3})]
+        assert list(self.store.datacenter_counts(START + DAY, START + DAY, DAY, 'NA9')) == [(START + DAY, {'NA9': 2})]
+
+
+class InventoryCommandTestCase(unittest.TestCase):
+    def test_record_and_history(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass', 'DIDATA_CACHE_DIR': cache_dir})
+
+        def invoke(*args):
+            client = DiDataCLIClient()
+            client.adapter_factory = lambda size: ReplayAdapter(fleet=SyntheticFleet(6))
+            result = runner.invoke(cli, ['inventory'] + list(args), obj=client)
+            assert result.exit_code == 0, result.output
+            return result.output
+        assert 'Snapshot 1: 6 servers, 6 added, 0 changed, 0 removed' in invoke('record')
+        assert 'Snapshot 2: 6 servers, 0 added, 0 changed, 0 removed' in invoke('record')
+        [counts] = [json.loads(line) for line in invoke('history', '--since', '1d', '--output', 'jsonl').splitlines()]
+        assert (counts['NA9'], counts['NA12'], counts['EU6'], counts['AP3']) == (2, 2, 1, 1)
+        output = invoke('history', '--serverId', SyntheticFleet.server_id(0))
+        assert output.endswith('added server00000 in NA9, running\n')
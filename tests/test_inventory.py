@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from libcloud.compute.base import Node
+from libcloud.compute.types import NodeState
+
+from didata_cli.inventory import InventoryCache, node_to_record
+from didata_cli.query import parse_query
+
+
+def fake_node(node_id, ipv6, datacenter='NA9'):
+    return Node(node_id, 'server-' + node_id, NodeState.RUNNING, [], ['10.0.0.' + node_id], None,
+                extra={'datacenterId': datacenter, 'ipv6': ipv6, 'networkDomainId': 'nd-1'})
+
+
+class InventoryCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.path = os.path.join(self.cache_dir, 'inventory.json')
+        self.driver = mock.Mock()
+        self.driver.list_nodes.return_value = [fake_node('1', '::1'), fake_node('2', '::2', 'NA12')]
+        patcher = mock.patch('didata_cli.inventory.fetch_nodes', side_effect=lambda driver: driver.list_nodes())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_find_builds_and_reuses_cache(self):
+        cache = InventoryCache(self.path)
+        assert [r['id'] for r in cache.find(self.driver, ex_ipv6='::2')] == ['2']
+        assert InventoryCache(self.path).find(self.driver, ex_ipv4='10.0.0.1')[0]['id'] == '1'
+        assert self.driver.list_nodes.call_count == 1
+
+    def test_find_intersects_filters(self):
+        cache = InventoryCache(self.path)
+        assert cache.find(self.driver, ex_ipv6='::2', ex_location='NA9') == []
+        assert len(cache.find(self.driver, ex_network_domain='nd-1')) == 2
+
+    def test_unsupported_filter_or_disabled_falls_back(self):
+        assert InventoryCache(self.path).find(self.driver, ex_state='STOPPED') is None
+        assert InventoryCache(self.path, enabled=False).find(self.driver, ex_ipv6='::1') is None
+        assert self.driver.list_nodes.call_count == 0
+
+    def test_expired_cache_and_refresh(self):
+        with open(self.path, 'w') as f:
+            json.dump({'created': time.time() - 60, 'nodes': [node_to_record(fake_node('9', '::9'))]}, f)
+        assert InventoryCache(self.path, ttl=300).find(self.driver, ex_ipv6='::9')[0]['id'] == '9'
+        assert InventoryCache(self.path, ttl=300, refresh=True).find(self.driver, ex_ipv6='::9') == []
+        assert self.driver.list_nodes.call_count == 1
+        assert InventoryCache(self.path, ttl=0).load() is None
+
+    def test_invalidate(self):
+        cache = InventoryCache(self.path)
+        cache.find(self.driver, ex_ipv6='::1')
+        cache.invalidate()
+        assert not os.path.exists(self.path)
+
+    def test_query_refreshes_stale_cache_once(self):
+        with open(self.path, 'w') as f:
+            json.dump({'created': time.time(), 'nodes': [node_to_record(fake_node('9', '::9'))]}, f)
+        cache = InventoryCache(self.path)
+        assert [r['id'] for r in cache.query(self.driver, parse_query('datacenter=NA12'))] == ['2']
+        assert cache.query(self.driver, parse_query('name=nothing')) == []
+        assert self.driver.list_nodes.call_count == 1
+
+    def test_query_without_disk_cache(self):
+        cache = InventoryCache(self.path, enabled=False)
+        assert [r['id'] for r in cache.query(self.driver, parse_query('state=running ipv6!=::1'))] == ['2']
+        assert not os.path.exists(self.path)
@@ -0,0 +1,29 @@
+from didata_cli.inventory import node_to_record
+from didata_cli.nodes import NodeRecord, parse_nodes, RECORD_FIELDS, SUMMARY_FIELDS
+from tests.replay import SyntheticFleet
+from didata_cli.utils import _add_dropped_details
+from libcloud.compute.drivers.dimensiondata import DimensionDataNodeDriver
+from xml.etree import ElementTree
+import unittest
+
+
+class NodeRecordTestCase(unittest.TestCase):
+    def setUp(self):
+        fleet = SyntheticFleet(12)
+        self.page = ElementTree.fromstring(fleet.servers_xml({}).encode('utf-8'))
+
+    def test_matches_libcloud_nodes(self):
+        driver = DimensionDataNodeDriver('fakeuser', 'fakepass')
+        nodes = driver._to_nodes(self.page)
+        _add_dropped_details(self.page, nodes)
+        records = parse_nodes(self.page, RECORD_FIELDS)
+        assert [node_to_record(record) for record in records] == [node_to_record(node) for node in nodes]
+        assert [record.public_ips for record in records] == [node.public_ips for node in nodes]
+
+    def test_only_parses_the_fields_asked_for(self):
+        record = parse_nodes(self.page, SUMMARY_FIELDS)[0]
+        assert sorted(record.extra) == sorted(SUMMARY_FIELDS)
+        assert record.extra['OS_displayName'] == 'CENTOS7/64'
+        with self.assertRaises(AttributeError):
+            record.size = None
+        assert isinstance(record, NodeRecord)
@@ -0,0 +1,54 @@
+import json
+from collections import OrderedDict
+
+from didata_cli.output import Renderer, plain
+
+
+def record(item):
+    return OrderedDict([('id', item), ('name', 'server-{0}'.format(item)), ('ips', ['10.0.0.1', '10.0.0.2'])])
+
+
+def lines(item):
+    return ['server-{0}'.format(item), '']
+
+
+def test_text_output(capsys):
+    Renderer('text').render([1, 2], record, lines)
+    assert capsys.readouterr().out == 'server-1\n\nserver-2\n\n'
+
+
+def test_jsonl_output_with_columns(capsys):
+    Renderer('jsonl', 'name,missing').render([1], record, lines)
+    assert json.loads(capsys.readouterr().out) == {'name': 'server-1', 'missing': None}
+
+
+def test_csv_header_written_once(capsys):
+    renderer = Renderer('csv')
+    renderer.render([1], record, lines)
+    renderer.render([2], record, lines)
+    renderer.close()
+    assert capsys.readouterr().out == 'id,name,ips\n1,server-1,10.0.0.1 10.0.0.2\n2,server-2,10.0.0.1 10.0.0.2\n'
+
+
+def test_csv_header_has_every_key(capsys):
+    renderer = Renderer('csv')
+    renderer.render([1], lambda item: OrderedDict([('id', item)]), lines)
+    assert capsys.readouterr().out == ''
+    renderer.render([2], lambda item: OrderedDict([('id', item), ('disks.0.sizeGb', 10)]), lines)
+    renderer.close()
+    assert capsys.readouterr().out == 'id,disks.0.sizeGb\n1,\n2,10\n'
+
+
+def test_tsv_output(capsys):
+    Renderer('tsv', 'name, id').render([1], record, lines)
+    assert capsys.readouterr().out == 'name\tid\nserver-1\t1\n'
+
+
+class Spec(object):
+    def __init__(self):
+        self.cpu_count = 2
+        self.driver = object()
+
+
+def test_plain_converts_objects():
+    assert plain({'cpu': Spec(), 'disks': (Spec(),)}) == {'cpu': {'cpu_count': 2}, 'disks': [{'cpu_count': 2}]}
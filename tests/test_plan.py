@@ -0,0 +1,140 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from didata_cli.plan import Plan, PlanError, Step, run_steps, CREATED, FAILED, SKIPPED
+from click.testing import CliRunner
+from libcloud.backup.drivers.dimensiondata import DimensionDataBackupDriver
+from libcloud.compute.base import Node
+from libcloud.compute.types import NodeState
+import json
+import threading
+import unittest
+import xml.etree.ElementTree as ET
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+PLAN = {
+    'networkDomains': [{'name': 'demo', 'datacenterId': 'NA9'}],
+    'vlans': [{'name': 'demo-web', 'networkDomain': 'demo', 'privateIpv4BaseAddress': '10.0.1.0'}],
+    'servers': [
+        {'name': 'web01', 'vlan': 'demo-web', 'imageId': 'image-1', 'administratorPassword': 'Passw0rd!',
+         'backup': {'servicePlan': 'Essentials',
+                    'clients': [{'clientType': 'FA.Linux', 'storagePolicy': '14 Day Storage Policy',
+                                 'schedulePolicy': '12AM - 6AM', 'triggerOn': 'ON_FAILURE',
+                                 'notifyEmail': 'ops@example.com'}]}},
+        {'name': 'web02', 'vlan': 'demo-web', 'imageId': 'image-1', 'administratorPassword': 'Passw0rd!'},
+    ],
+}
+
+
+def named(name, resource_id, status='NORMAL'):
+    resource = mock.Mock(id=resource_id, status=status)
+    resource.name = name
+    return resource
+
+
+class RunStepsTestCase(unittest.TestCase):
+    def test_independent_steps_run_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+        order = []
+
+        def run(step):
+            if step.key in ('a', 'b'):
+                # both roots must be running at once to get past the barrier
+                barrier.wait()
+            order.append(step.key)
+            return CREATED, step.key
+        steps = dict((key, Step(key, requires, None)) for key, requires in [('a', []), ('b', []), ('c', ['a', 'b'])])
+        results = run_steps(steps, run, concurrency=2)
+        assert order[-1] == 'c'
+        assert all(result.status == CREATED for result in results.values())
+
+    def test_failure_skips_dependants(self):
+        def run(step):
+            if step.key == 'a':
+                raise RuntimeError('boom')
+            return CREATED, step.key
+        steps = dict((key, Step(key, requires, None)) for key, requires in [('a', []), ('b', ['a']), ('c', ['b']), ('d', [])])
+        results = run_steps(steps, run)
+        assert [results[key].status for key in 'abcd'] == [FAILED, SKIPPED, SKIPPED, CREATED]
+        assert results['a'].detail == 'boom'
+
+
+class ApplyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass'})
+        self.node = mock.Mock()
+        self.node.ex_list_network_domains.return_value = [named('demo', 'nd-1')]
+        self.node.ex_list_vlans.return_value = []
+        self.node.ex_create_vlan.return_value = named('demo-web', 'vlan-1', status='PENDING_ADD')
+        self.node.ex_get_vlan.return_value = named('demo-web', 'vlan-1')
+        self.node.list_nodes.side_effect = lambda ex_name, ex_network_domain: \
+            [Node('srv-2', ex_name, NodeState.RUNNING, [], [], None)] if ex_name == 'web02' else []
+        self.node.create_node.return_value = Node('srv-1', 'web01', NodeState.PENDING, [], [], None,
+                                                  extra={'datacenterId': 'NA9'})
+        self.node.ex_get_node_by_id.return_value = Node('srv-1', 'web01', NodeState.RUNNING, [], [], None,
+                                                        extra={'datacenterId': 'NA9'})
+        self.backup = mock.Mock()
+        self.backup.ex_get_target_by_id.return_value = None
+        self.backup.ex_get_backup_details_for_target.return_value = mock.Mock(status='NORMAL', clients=[])
+        self.drivers = {'node': self.node, 'backup': self.backup}
+        patcher = mock.patch.object(DiDataCLIClient, 'worker_driver',
+                                    side_effect=lambda kind='node': self.drivers[kind])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('didata_cli.waiter.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def apply(self, *args):
+        with self.runner.isolated_filesystem():
+            with open('plan.json', 'w') as f:
+                json.dump(PLAN, f)
+            return self.runner.invoke(cli, ['apply', 'plan.json'] + list(args))
+
+    def test_apply_creates_what_is_missing(self):
+        result = self.apply()
+        assert result.exit_code == 0, result.output
+        assert 'networkDomain:demo: unchanged (nd-1)' in result.output
+        assert 'server:web02: unchanged (srv-2)' in result.output
+        assert '4 created, 2 unchanged' in result.output
+        self.node.ex_create_network_domain.assert_not_called()
+        self.node.create_node.assert_called_once_with('web01', 'image-1', 'Passw0rd!', ex_network_domain='nd-1',
+                                                      ex_primary_nic_vlan='vlan-1', ex_description=None,
+                                                      ex_is_started=True)
+        self.backup.create_target.assert_called_once_with('srv-1', 'srv-1', extra={'servicePlan': 'Essentials'})
+        self.backup.ex_add_client_to_target.assert_called_once_with('srv-1', 'FA.Linux', '14 Day Storage Policy',
+                                                                    '12AM - 6AM', 'ON_FAILURE', 'ops@example.com')
+
+    def test_apply_builds_the_backup_requests(self):
+        driver = DimensionDataBackupDriver('fakeuser', 'fakepass', region='dd-na')
+        driver.ex_get_target_by_id = mock.Mock(return_value=None)
+        driver.ex_get_backup_details_for_target = self.backup.ex_get_backup_details_for_target
+        request = driver.connection.request_with_orgId_api_1 = mock.Mock(
+            return_value=mock.Mock(object=ET.Element('response')))
+        self.drivers['backup'] = driver
+        result = self.apply()
+        assert result.exit_code == 0, result.output
+        assert [call[0][0] for call in request.call_args_list] == ['server/srv-1/backup', 'server/srv-1/backup/client']
+        target, backup_client = [ET.fromstring(call[1]['data']) for call in request.call_args_list]
+        assert target.get('servicePlan') == 'Essentials'
+        alerting = backup_client.find('{*}alerting')
+        assert alerting.get('trigger') == 'ON_FAILURE'
+        assert alerting.find('{*}emailAddress').text == 'ops@example.com'
+
+    def test_dry_run_changes_nothing(self):
+        result = self.apply('--dryRun')
+        assert result.exit_code == 0, result.output
+        assert '5 would create, 1 unchanged' in result.output
+        self.node.ex_create_vlan.assert_not_called()
+        self.node.create_node.assert_not_called()
+
+    def test_invalid_plan(self):
+        with self.assertRaises(PlanError):
+            Plan({'servers': [{'name': 'web01', 'vlan': 'missing', 'imageId': 'i', 'administratorPassword': 'p'}]})
+        with self.assertRaises(PlanError):
+            Plan({'vms': []})
+        backup = {'servicePlan': 'Essentials',
+                  'clients': [dict(PLAN['servers'][0]['backup']['clients'][0], notifyEmail=None)]}
+        with self.assertRaises(PlanError):
+            Plan(dict(PLAN, servers=[dict(PLAN['servers'][0], backup=backup)]))
@@ -0,0 +1,48 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from didata_cli.profile import Profiler, activate, phase, redacted_argv
+from tests.replay import ReplayAdapter, SyntheticFleet
+from click.testing import CliRunner
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.addCleanup(activate, None)
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                     'DIDATA_CACHE_DIR': self.tmp_dir})
+
+    def test_phase_only_records_when_active(self):
+        with phase('output'):
+            pass
+        profiler = activate(Profiler())
+        with phase('output'):
+            pass
+        with phase('output'):
+            pass
+        assert profiler.phases['output'][0] == 2
+
+    def test_password_is_redacted(self):
+        assert redacted_argv(['--user', 'me', '--password', 'secret', 'server', 'list']) == \
+            '--user me --password *** server list'
+        assert redacted_argv(['--password=secret']) == '--password=***'
+
+    def test_trace_file(self):
+        client = DiDataCLIClient()
+        client.adapter_factory = lambda size: ReplayAdapter(fleet=SyntheticFleet(300))
+        trace_file = os.path.join(self.tmp_dir, 'trace.json')
+        result = self.runner.invoke(cli, ['--profile', '--profileOutput', trace_file, 'server', 'list'],
+                                    obj=client, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'API request' in result.output
+        with open(trace_file) as f:
+            trace = json.load(f)
+        assert set(['startup', 'driver init', 'list_nodes paging', 'output']) <= set(trace['phases'])
+        actions = [request['action'] for request in trace['requests']]
+        assert actions == ['/oec/0.9/myaccount'] + ['/caas/2.4/{id}/server/server'] * 2
+        assert all(request['status'] == 200 and request['bytes'] > 0 for request in trace['requests'])
@@ -0,0 +1,123 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from didata_cli.query import NodeIndex, QueryError, parse_query, matches_all
+from tests.replay import ReplayAdapter, SyntheticFleet
+from click.testing import CliRunner
+from libcloud.compute.drivers.dimensiondata import DimensionDataNodeDriver
+import json
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+RECORDS = [
+    {'id': '1', 'name': 'web01', 'ipv4': ['10.0.1.5'], 'ipv6': '2607:f480::1', 'datacenter': 'NA9', 'cpu_count': 2},
+    {'id': '2', 'name': 'web02', 'ipv4': ['10.0.2.5'], 'ipv6': '2607:f480::2', 'datacenter': 'NA12', 'cpu_count': 4},
+    {'id': '3', 'name': 'db01', 'ipv4': ['10.0.1.9'], 'ipv6': None, 'datacenter': 'NA9', 'cpu_count': 8},
+]
+FIELDS = ['id', 'name', 'ipv4', 'ipv6', 'datacenter', 'cpu_count']
+
+
+def select(text):
+    predicates = parse_query(text)
+    expected = [record['id'] for record in RECORDS if matches_all(predicates, record)]
+    found = [record['id'] for record in NodeIndex(RECORDS, FIELDS).select(predicates)]
+    # the index must agree with checking every record
+    assert found == expected
+    return found
+
+
+class QueryTestCase(unittest.TestCase):
+    def test_operators(self):
+        assert select('name=web01,db01') == ['1', '3']
+        assert select('name^=web') == ['1', '2']
+        assert select('name~=0[12]$ datacenter!=NA12') == ['1', '3']
+        assert select('ipv4=10.0.1.0/24') == ['1', '3']
+        assert select('ipv6=2607:f480::/120 cpu.count>=4') == ['2']
+        assert select('cpu.count<4') == ['1']
+        assert select('datacenterId=EU6') == []
+        assert select('cpu.count=4,8') == ['2', '3'] and select('cpu.count!=2.0') == ['2', '3']
+
+    def test_bad_queries(self):
+        for text in ['', 'name', 'colour=red', 'name>3', 'cpu.count>=many', 'cpu.count=abc', 'memoryGb!=4,x', 'ipv4=10.0.0.0/99', 'name~=(']:
+            with self.assertRaises(QueryError):
+                parse_query(text)
+
+
+class QueryCommandTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                     'DIDATA_CACHE_DIR': self.cache_dir})
+        self.adapter = ReplayAdapter(fleet=SyntheticFleet(300))
+        self.client = DiDataCLIClient()
+        self.client.adapter_factory = lambda size: self.adapter
+
+    def invoke(self, args):
+        return self.runner.invoke(cli, args, obj=self.client, catch_exceptions=False)
+
+    def test_server_list_query(self):
+        result = self.invoke(['server', 'list', '--datacenterId', 'NA12', '--query', 'name^=server000 vlan~=.',
+                              '--limit', '2', '--output', 'jsonl'])
+        assert result.exit_code == 0
+        assert [json.loads(line)['name'] for line in result.output.splitlines()] == ['server00001', 'server00005']
+
+    def test_single_server_query_uses_inventory(self):
+        listings = []
+        respond = self.adapter.fleet.respond
+
+        def spy(method, path, params):
+            if path.endswith('/server/server'):
+                listings.append(params)
+            return respond(method, path, params)
+        self.adapter.fleet.respond = spy
+        result = self.invoke(['backup', 'info', '--query', 'name=server00123', '--output', 'jsonl'])
+        assert result.exit_code == 0
+        assert SyntheticFleet(300).server_id(123) in result.output
+        # nothing cached, the name went to the API instead of listing every server
+        assert listings == [{'name': 'server00123', 'pageSize': '250'}]
+        assert self.invoke(['cache', 'warm']).exit_code == 0
+        result = self.invoke(['backup', 'info', '--query', 'ipv4=10.0.0.0/8'])
+        assert 'Too many nodes found in filter' in result.output
+        requests = self.adapter.requests
+        self.invoke(['backup', 'info', '--query', 'name=server00007', '--output', 'jsonl'])
+        # answered from the inventory, only the backup target and its details are fetched
+        assert self.adapter.requests == requests + 2
+
+    def test_power_commands_check_the_cached_server(self):
+        assert self.invoke(['cache', 'warm']).exit_code == 0
+        fleet = SyntheticFleet(300)
+        path = os.path.join(self.cache_dir, [name for name in os.listdir(self.cache_dir)
+                                             if name.startswith('inventory-')][0])
+        with open(path) as f:
+            data = json.load(f)
+        # server00007 was renamed server00008 and the other way round since the cache was written
+        data['nodes'][7]['name'], data['nodes'][8]['name'] = 'server00008', 'server00007'
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        self.client = DiDataCLIClient()
+        self.client.adapter_factory = lambda size: self.adapter
+        requests = self.adapter.requests
+        with mock.patch.object(DimensionDataNodeDriver, 'reboot_node', return_value=True):
+            result = self.invoke(['server', 'reboot', '--query', 'name=server00007'])
+            assert result.exit_code == 0, result.output
+            assert 'Server {0} is being rebooted'.format(fleet.server_id(7)) in result.output
+            # the account, the cached server, a listing filtered by name and the server found by it
+            assert self.adapter.requests == requests + 4
+            requests = self.adapter.requests
+            result = self.invoke(['server', 'reboot', '--query', 'name=server00007'])
+            assert 'Server {0} is being rebooted'.format(fleet.server_id(7)) in result.output
+            # the stale inventory was dropped, so the name goes to the API again
+            assert self.adapter.requests == requests + 2
+
+    def test_bad_query_is_a_usage_error(self):
+        result = self.invoke(['server', 'start', '--query', 'colour=red'])
+        assert result.exit_code == 2
+        assert "Unknown query field 'colour'" in result.output
+        result = self.invoke(['server', 'list', '--query', 'cpu.count=abc'])
+        assert result.exit_code == 2
+        assert "'abc' is not a number" in result.output
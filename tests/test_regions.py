@@ -0,0 +1,62 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from didata_cli.regions import resolve_regions
+from tests.replay import ReplayAdapter, SyntheticFleet
+from click.testing import CliRunner
+from collections import Counter
+import inspect
+import json
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+# click 8.2 always keeps stderr apart and dropped the option
+STDERR_APART = {'mix_stderr': False} if 'mix_stderr' in inspect.signature(CliRunner).parameters else {}
+
+
+class RegionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                     'DIDATA_CACHE_DIR': self.cache_dir}, **STDERR_APART)
+        self.client = DiDataCLIClient()
+        self.client.adapter_factory = lambda size: ReplayAdapter(fleet=SyntheticFleet(300))
+
+    def invoke(self, args):
+        return self.runner.invoke(cli, args, obj=self.client, catch_exceptions=False)
+
+    def test_resolve_regions(self):
+        assert resolve_regions('dd-eu, dd-na,dd-eu') == ['dd-eu', 'dd-na']
+        regions = resolve_regions('all')
+        assert 'dd-na' in regions and 'dd-ap' in regions
+        assert not [region for region in regions if not region.startswith('dd-')]
+
+    def test_server_list_merges_regions(self):
+        result = self.invoke(['--region', 'dd-na,dd-eu', 'server', 'list', '--output', 'jsonl'])
+        assert result.exit_code == 0
+        records = [json.loads(line) for line in result.stdout.splitlines()]
+        assert Counter(record['region'] for record in records) == {'dd-na': 300, 'dd-eu': 300}
+        assert list(records[0])[:2] == ['region', 'id']
+        assert 'dd-eu: 300 results in' in result.stderr
+
+    def test_failing_region_does_not_stop_the_others(self):
+        region_driver = self.client.region_driver
+
+        def failing(region, kind='node'):
+            if region == 'dd-eu':
+                raise RuntimeError('eu is down')
+            return region_driver(region, kind)
+        with mock.patch.object(self.client, 'region_driver', side_effect=failing):
+            result = self.invoke(['--region', 'dd-na,dd-eu', 'location', 'list'])
+        assert result.exit_code == 1
+        assert result.stdout.count('Region: dd-na') == 4
+        assert 'dd-eu: failed after' in result.stdout and 'eu is down' in result.stdout
+
+    def test_other_commands_need_one_region(self):
+        result = self.invoke(['--region', 'dd-na,dd-eu', 'server', 'start', '--serverId', 'x'])
+        assert result.exit_code == 2
+        assert 'pick one with --region' in result.stderr
@@ -0,0 +1,70 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet, fixture_name
+from click.testing import CliRunner
+from requests.adapters import HTTPAdapter
+import json
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                     'DIDATA_CACHE_DIR': self.cache_dir})
+
+    def invoke(self, adapter, args):
+        client = DiDataCLIClient()
+        client.adapter_factory = lambda size: adapter
+        return self.runner.invoke(cli, args, obj=client, catch_exceptions=False)
+
+    def test_server_list_pages_through_fleet(self):
+        adapter = ReplayAdapter(fleet=SyntheticFleet(300))
+        result = self.invoke(adapter, ['server', 'list', '--output', 'jsonl'])
+        assert result.exit_code == 0
+        assert len(result.output.splitlines()) == 300
+        # the org id lookup and two pages of servers
+        assert adapter.requests == 3
+
+    def test_server_list_filters(self):
+        adapter = ReplayAdapter(fleet=SyntheticFleet(300))
+        result = self.invoke(adapter, ['server', 'list', '--datacenterId', 'NA12', '--output', 'jsonl'])
+        records = [json.loads(line) for line in result.output.splitlines()]
+        assert len(records) == 75
+        assert records[0]['name'] == 'server00001'
+
+    def test_recorded_responses_are_replayed(self):
+        fixtures = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, fixtures)
+        fleet = SyntheticFleet(1)
+        url = 'https://api-na.dimensiondata.com/caas/2.4/{0}/infrastructure/datacenter'.format('8a8f6abc-2745-4d8a-9cbc-8dabe5a7d0e4')
+        with open(os.path.join(fixtures, fixture_name('GET', url)), 'w') as f:
+            json.dump({'status': 200, 'body': SyntheticFleet(1, datacenters=[('XX1', 'Recorded', 'AU')]).datacenters_xml({})}, f)
+        adapter = ReplayAdapter(fixtures, fleet)
+        result = self.invoke(adapter, ['location', 'list'])
+        assert 'ID: XX1' in result.output
+
+    def test_unknown_requests_get_api_error(self):
+        result = self.invoke(ReplayAdapter(), ['location', 'list'])
+        assert result.exit_code == 1
+
+    def test_drivers_use_the_pool_session(self):
+        client = DiDataCLIClient()
+        client.init_client('fakeuser', 'fakepass')
+        client.adapter_factory = lambda size: ReplayAdapter(fleet=SyntheticFleet(1))
+        assert len(client.node.list_locations()) == 4
+        assert client.node.connection.connection.session is client.connection_pool().session
+
+    def test_the_cli_always_calls_the_api(self):
+        client = DiDataCLIClient()
+        client.init_client('fakeuser', 'fakepass')
+        with mock.patch.dict(os.environ, {'DIDATA_REPLAY_FLEET': '10', 'DIDATA_REPLAY_DIR': self.cache_dir}):
+            adapter = client.connection_pool().session.get_adapter('https://api-na.dimensiondata.com/')
+        assert isinstance(adapter, HTTPAdapter)
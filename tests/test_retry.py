@@ -0,0 +1,123 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet, error_body, make_response
+from didata_cli.retry import CircuitBreaker, RetryPolicy, TokenBucket, retry_code
+from click.testing import CliRunner
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def response(status, code=None):
+    request = mock.Mock(url='https://api-na.dimensiondata.com/caas/2.4/org/server/server')
+    return make_response(request, status, error_body(code, 'busy') if code else '<ok/>')
+
+
+class BusyAdapter(ReplayAdapter):
+    """Turns the first ``busy`` requests away with RESOURCE_BUSY."""
+
+    def __init__(self, busy, **kwargs):
+        super(BusyAdapter, self).__init__(**kwargs)
+        self.busy = busy
+
+    def send(self, request, **kwargs):
+        if self.busy:
+            self.busy -= 1
+            self.requests += 1
+            return make_response(request, 400, error_body('RESOURCE_BUSY', 'busy'))
+        return super(BusyAdapter, self).send(request, **kwargs)
+
+
+class RetryTestCase(unittest.TestCase):
+    def test_retry_code(self):
+        assert retry_code('POST', response(400, 'RESOURCE_BUSY')) == 'RESOURCE_BUSY'
+        assert retry_code('POST', response(400, 'INVALID_INPUT_DATA')) is None
+        assert retry_code('POST', response(429)) == 429
+        assert retry_code('GET', response(502)) == 502
+        # the change may have gone through
+        assert retry_code('POST', response(502)) is None
+        assert retry_code('GET', response(200)) is None
+
+    def test_retries_until_accepted_or_out_of_attempts(self):
+        clock = FakeClock()
+        responses = [response(400, 'RESOURCE_BUSY'), response(400, 'RESOURCE_BUSY'), response(200)]
+        policy = RetryPolicy(max_attempts=5, sleep=clock.sleep)
+        sent = []
+        policy.send('GET', lambda: sent.append(1), lambda: responses[len(sent) - 1])
+        assert len(sent) == 3 and len(clock.slept) == 2 and policy.retries == 2
+        sent = []
+        policy = RetryPolicy(max_attempts=2, sleep=clock.sleep)
+        policy.send('GET', lambda: sent.append(1), lambda: response(429))
+        assert len(sent) == 2
+
+    def test_breaker_opens_on_repeated_pushback(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(threshold=2, cooldown=5, clock=clock, sleep=clock.sleep)
+        breaker.record_pushback()
+        breaker.wait()
+        assert clock.slept == []
+        breaker.record_pushback()
+        breaker.wait()
+        assert clock.slept == [5]
+        breaker.record_pushback()
+        breaker.wait()
+        assert clock.slept == [5, 10]
+        breaker.record_success()
+        breaker.record_pushback()
+        breaker.wait()
+        assert clock.slept == [5, 10]
+
+    def test_bucket_slows_down_and_recovers(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=4, clock=clock, sleep=clock.sleep)
+        for _ in range(6):
+            bucket.acquire()
+        assert clock.now == 1000.5
+        bucket.slow_down()
+        assert bucket.rate == 2
+        for _ in range(20):
+            bucket.speed_up()
+        assert bucket.rate == 4
+
+    def test_bucket_wait_leaves_the_token(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=1, clock=clock, sleep=clock.sleep)
+        bucket.wait()
+        bucket.acquire()
+        bucket.wait()
+        assert clock.slept == [0.5]
+        bucket.acquire()
+        assert clock.slept == [0.5]
+
+    def test_busy_api_is_retried_through_the_cli(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        adapter = BusyAdapter(2, fleet=SyntheticFleet(1))
+        client = DiDataCLIClient()
+        client.adapter_factory = lambda size: adapter
+        runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass', 'DIDATA_CACHE_DIR': cache_dir})
+        with mock.patch('didata_cli.retry.time.sleep'):
+            result = runner.invoke(cli, ['--verbose', 'location', 'list'], obj=client)
+            assert result.exit_code == 0
+            assert 'ID: NA9' in result.output
+            assert '2 requests retried' in result.output
+            adapter.busy = 10
+            result = runner.invoke(cli, ['--noCache', '--maxAttempts', '2', 'location', 'list'], obj=client)
+        assert result.exit_code == 1
+        assert 'RESOURCE_BUSY' in result.output and 'still busy after retrying' in result.output
@@ -0,0 +1,54 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet
+from click.testing import CliRunner
+import shutil
+import tempfile
+import unittest
+
+
+class ShellTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                     'DIDATA_CACHE_DIR': self.cache_dir})
+        self.adapter = ReplayAdapter(fleet=SyntheticFleet(20))
+        self.client = DiDataCLIClient()
+        self.client.adapter_factory = lambda size: self.adapter
+
+    def shell(self, lines):
+        return self.runner.invoke(cli, ['shell'], obj=self.client, input=''.join(line + '\n' for line in lines),
+                                  catch_exceptions=False)
+
+    def test_commands_share_client(self):
+        result = self.shell(['location list', 'server list --datacenterId NA9 --output jsonl', 'exit'])
+        assert result.exit_code == 0
+        assert 'ID: NA9' in result.output
+        assert result.output.count('"datacenterId":"NA9"') == 5
+        # the org id is only looked up once for both commands
+        assert self.adapter.requests == 3
+
+    def test_errors_do_not_end_the_shell(self):
+        result = self.shell(['server list --bogus', 'bogus', 'server destroy', 'location list'])
+        assert result.exit_code == 0
+        assert 'No such option' in result.output
+        assert "No such command 'bogus'" in result.output
+        assert 'ID: NA9' in result.output
+
+    def test_filters_resolve_from_memory(self):
+        listings = []
+        respond = self.adapter.fleet.respond
+
+        def spy(method, path, params):
+            if path.endswith('/server/server'):
+                listings.append(params)
+            return respond(method, path, params)
+        self.adapter.fleet.respond = spy
+        self.shell(['server reboot --serverFilterIpv6 2607:f480:111:1000::1'])
+        # nothing cached, the API does the filtering
+        assert listings == [{'ipv6': '2607:f480:111:1000::1'}]
+        self.shell(['cache warm',
+                    'server reboot --serverFilterIpv6 2607:f480:111:1000::1',
+                    'server reboot --serverFilterIpv6 2607:f480:111:1000::2'])
+        # both lookups are answered by the inventory built by the warm
+        assert len(listings) == 2
@@ -0,0 +1,70 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet
+from didata_cli.stats import FleetStats, percentile
+from click.testing import CliRunner
+import json
+import shutil
+import tempfile
+import unittest
+
+
+def server(datacenter, cpu_count, memory_gb, disk_gb=None, os='CENTOS7/64'):
+    return {'datacenter': datacenter, 'os': os, 'ipv4': ['10.0.0.1'], 'cpu_count': cpu_count,
+            'cores_per_socket': 1, 'memory_gb': memory_gb, 'disk_gb': disk_gb}
+
+
+class FleetStatsTestCase(unittest.TestCase):
+    def test_percentile_interpolates(self):
+        assert percentile([], 50) is None
+        assert percentile([4.0], 95) == 4.0
+        assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+        assert percentile([1.0, 2.0, 3.0, 4.0], 100) == 4.0
+
+    def test_groups_are_totalled_largest_first(self):
+        fleet = FleetStats(['datacenter'])
+        fleet.add([server('NA9', 2, 4, 10), server('EU6', 8, 32, 100)])
+        fleet.add([server('EU6', 4, 16), server('EU6', 2, 8, 50)])
+        rows = list(fleet.rows([50]))
+        assert [(row['datacenter'], row['servers']) for row in rows] == [('EU6', 3), ('NA9', 1)]
+        assert rows[0]['cpuTotal'] == 14 and rows[0]['cpuP50'] == 4
+        assert rows[0]['memoryGbTotal'] == 56 and rows[0]['diskGbTotal'] == 150 and rows[0]['diskGbP50'] == 75
+
+    def test_list_fields_group_by_their_values(self):
+        fleet = FleetStats(['ipv4', 'os'])
+        fleet.add([server('NA9', 2, 4)])
+        assert list(fleet.rows())[0]['ipv4'] == '10.0.0.1'
+
+
+class StatsCommandTestCase(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass',
+                                     'DIDATA_CACHE_DIR': cache_dir})
+
+    def invoke(self, *args):
+        client = DiDataCLIClient()
+        self.adapter = ReplayAdapter(fleet=SyntheticFleet(12))
+        client.adapter_factory = lambda size: self.adapter
+        return self.runner.invoke(cli, ['server', 'stats'] + list(args), obj=client)
+
+    def test_stats_per_datacenter_and_state(self):
+        result = self.invoke('--groupBy', 'datacenterId,state', '--output', 'jsonl')
+        assert result.exit_code == 0, result.output
+        rows = [json.loads(line) for line in result.output.splitlines()]
+        assert sum(row['servers'] for row in rows) == 12
+        assert rows[0]['datacenterId'] == 'AP3' and rows[0]['state'] == 'running'
+        assert rows[0]['cpuTotal'] == 2 * rows[0]['servers'] and rows[0]['diskGbP95'] == 10
+
+    def test_stats_from_inventory(self):
+        assert self.invoke('--fromInventory', '--output', 'csv').exit_code == 0
+        result = self.invoke('--fromInventory', '--query', 'datacenter=NA9', '--percentiles', '90')
+        assert result.exit_code == 0, result.output
+        assert self.adapter.requests == 0
+        assert 'NA9\nServers: 3\nCPU Count: total 6, p90 2' in result.output
+        result = self.invoke('--fromInventory', '--datacenterId', 'NA9')
+        assert result.exit_code == 1 and 'Only --query' in result.output
+
+    def test_unknown_group_by(self):
+        result = self.invoke('--groupBy', 'colour')
+        assert result.exit_code == 2 and 'Group by one or more of' in result.output
@@ -0,0 +1,99 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet
+from didata_cli.commands.cmd_network import snapshot_note
+from didata_cli.topology import Topology, TopologySnapshot, KINDS
+from click.testing import CliRunner
+import json
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def server(server_id, datacenter, vlan, ip):
+    return {'id': server_id, 'name': 'server-' + server_id, 'datacenter': datacenter, 'network_domain': 'nd-' + datacenter,
+            'vlan': vlan, 'ipv4': [ip], 'ipv6': None}
+
+
+def records(datacenter, *servers):
+    return {
+        'networkDomains': [{'id': 'nd-' + datacenter, 'name': datacenter + '-domain', 'location': datacenter}],
+        'networks': [],
+        'vlans': [{'id': 'vlan-' + datacenter, 'name': 'web', 'networkDomainId': 'nd-' + datacenter,
+                   'location': datacenter}],
+        'servers': list(servers),
+    }
+
+
+class TopologyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.snapshot = TopologySnapshot(os.path.join(self.cache_dir, 'topology.json'))
+
+    def test_indexes(self):
+        topology = Topology(records('NA9', server('1', 'NA9', 'vlan-NA9', '10.0.0.1'),
+                                    server('2', 'NA9', 'vlan-NA9', '10.0.0.2')))
+        assert topology.server_by_ip['10.0.0.2']['id'] == '2'
+        [(network_domain, [(vlan, servers)])] = list(topology.tree())
+        assert network_domain['id'] == 'nd-NA9' and vlan['id'] == 'vlan-NA9'
+        assert [record['id'] for record in servers] == ['1', '2']
+
+    def test_snapshot_replaces_only_the_datacenters_taken(self):
+        self.snapshot.save(['NA9'], records('NA9', server('1', 'NA9', 'vlan-NA9', '10.0.0.1')))
+        self.snapshot.save(['EU6'], records('EU6', server('2', 'EU6', 'vlan-EU6', '10.1.0.1')))
+        topology = self.snapshot.save(['NA9'], records('NA9'))
+        assert topology.datacenters == ['EU6', 'NA9']
+        assert topology.counts('NA9') == [1, 0, 1, 0]
+        assert topology.counts('EU6') == [1, 0, 1, 1]
+        with open(self.snapshot.path) as f:
+            assert sorted(json.load(f)) == sorted(KINDS + ['created', 'datacenters'])
+
+    def test_snapshot_keeps_when_each_datacenter_was_taken(self):
+        with mock.patch('didata_cli.topology.time.time', return_value=1000.0):
+            self.snapshot.save(['NA9', 'EU6'], records('NA9'))
+        with mock.patch('didata_cli.topology.time.time', return_value=2000.0):
+            topology = self.snapshot.save(['NA9'], records('NA9'))
+        assert topology.created == {'NA9': 2000.0, 'EU6': 1000.0}
+        assert topology.taken('NA9') == 2000.0
+        assert topology.taken() == 1000.0
+        assert snapshot_note('dd-na', topology, 'NA9') == \
+            'From the network snapshot of dd-na taken 1970-01-01T00:33:20Z'
+
+
+class NetworkSnapshotCommandTestCase(unittest.TestCase):
+    def test_snapshot_then_list_from_it(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        adapter = ReplayAdapter(fleet=SyntheticFleet(8))
+        runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass', 'DIDATA_CACHE_DIR': cache_dir})
+
+        def invoke(*args):
+            client = DiDataCLIClient()
+            client.adapter_factory = lambda size: adapter
+            return runner.invoke(cli, ['network'] + list(args), obj=client)
+
+        result = invoke('list-network-domains', '--fromSnapshot')
+        assert result.exit_code == 1 and 'run network snapshot first' in result.output
+        result = invoke('snapshot', '--datacenterId', 'NA9', '--datacenterId', 'EU6')
+        assert result.exit_code == 0, result.output
+        assert 'NA9: 1 network domains, 0 networks, 1 VLANs, 2 servers' in result.output
+        requests = adapter.requests
+        result = invoke('list-network-domains', '--fromSnapshot', '--datacenterId', 'EU6')
+        assert result.exit_code == 0, result.output
+        assert 'EU6-domain' in result.output and 'Location: EU6' in result.output and 'NA9' not in result.output
+        assert result.output.startswith('From the network snapshot of dd-na taken 20')
+        result = invoke('list-network-domains', '--fromSnapshot', '--output', 'jsonl')
+        assert result.exit_code == 0 and 'From the network snapshot' not in result.output
+        for command in ('list-network-domains', 'list-networks'):
+            result = invoke(command, '--fromSnapshot', '--datacenterId', 'NA12')
+            assert result.exit_code == 1
+            assert 'NA12 is not in the network snapshot for dd-na' in result.output
+        result = invoke('topology', '--ip', '10.0.0.2')
+        assert result.exit_code == 0, result.output
+        assert 'server00002' in result.output and 'VLAN: EU6-vlan' in result.output
+        assert adapter.requests == requests
@@ -1,6 +1,64 @@
-from didata_cli.utils import flattenDict
+from collections import OrderedDict
+from didata_cli.utils import flattenDict, iter_flat_items, iter_node_pages
 
 
 def test_flatten_dict():
     data = {'a': {'b': 1}, 'c': 3}
-    flattenDict(data)
+    assert flattenDict(data) == {'a.b': 1, 'c': 3}
+
+
+def test_flatten_dict_indexes_lists():
+    data = {'disks': [{'id': 'd0', 'sizeGb': 10}, {'id': 'd1', 'sizeGb': 20}], 'ips': ['10.0.0.1', '10.0.0.2']}
+    assert flattenDict(data) == {'disks.0.id': 'd0', 'disks.0.sizeGb': 10, 'disks.1.id': 'd1',
+                                 'disks.1.sizeGb': 20, 'ips.0': '10.0.0.1', 'ips.1': '10.0.0.2'}
+
+
+def test_flatten_dict_key_whitelist():
+    data = {'cpu': {'count': 2, 'speed': 'STANDARD'}, 'disks': [{'id': 'd0', 'sizeGb': 10}], 'name': 'web'}
+    expected = {'cpu.count': 2, 'cpu.speed': 'STANDARD', 'disks.0.sizeGb': 10}
+    assert flattenDict(data, keys=['cpu', 'disks.0.sizeGb']) == expected
+
+
+def test_flatten_dict_key_whitelist_needs_the_full_path():
+    assert flattenDict({'cpu': 5}, keys=['cpu.count']) == {}
+    assert flattenDict({'cpu': {'count': 5}, 'disks': []}, keys=['cpu.count.max', 'disks.0']) == {}
+
+
+def test_flatten_dict_keeps_empty_containers():
+    data = {'tags': {}, 'disks': [], 'cpu': {'count': 2}}
+    assert flattenDict(data) == {'tags': {}, 'disks': [], 'cpu.count': 2}
+    assert flattenDict(data, keys=['disks', 'cpu']) == {'disks': [], 'cpu.count': 2}
+
+
+def test_iter_flat_items_keeps_order():
+    data = OrderedDict([('b', [1, OrderedDict([('y', 2), ('x', 3)])]), ('a', 4)])
+    assert list(iter_flat_items(data, separator='/')) == [('b/0', 1), ('b/1/y', 2), ('b/1/x', 3), ('a', 4)]
+
+
+class FakePagedDriver(object):
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+        self.connection = self
+
+    def paginated_request_with_orgId_api_2(self, action, params=None, page_size=250):
+        self.requested.append((action, dict(params), page_size))
+        for page in self.pages:
+            self.requested.append(page)
+            yield page
+
+    def _to_nodes(self, page):
+        return page
+
+
+def test_iter_node_pages_maps_filters():
+    driver = FakePagedDriver([[1, 2], [3]])
+    pages = list(iter_node_pages(driver, page_size=2, ex_location='NA9', ex_ipv6=None))
+    assert pages == [[1, 2], [3]]
+    assert driver.requested[0] == ('server/server', {'datacenterId': 'NA9'}, 2)
+
+
+def test_iter_node_pages_limit_stops_paging():
+    driver = FakePagedDriver([[1, 2], [3, 4], [5, 6]])
+    assert list(iter_node_pages(driver, page_size=2, limit=3)) == [[1, 2], [3]]
+    assert driver.requested[1:] == [[1, 2], [3, 4]]
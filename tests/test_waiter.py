@@ -0,0 +1,73 @@
+from libcloud.common.dimensiondata import DimensionDataAPIException, DimensionDataStatus
+from libcloud.compute.base import Node
+from libcloud.compute.types import NodeState
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from didata_cli.waiter import Backoff, BackupPoller, NodePoller, Waiter, RUNNING, STOPPED, DELETED, BACKUP_ENABLED
+
+
+def fake_node(node_id, state, action=None, datacenter='NA9'):
+    return Node(node_id, node_id, state, [], [], None,
+                extra={'datacenterId': datacenter, 'status': DimensionDataStatus(action=action)})
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_backoff_grows_and_resets():
+    backoff = Backoff(initial=1, maximum=4, factor=2, jitter=0)
+    assert [backoff.next() for _ in range(4)] == [1, 2, 4, 4]
+    backoff.reset()
+    assert backoff.next() == 1
+
+
+def test_waiter_times_out():
+    clock = FakeClock()
+    waiter = Waiter(lambda pending: {}, timeout=10, backoff=Backoff(jitter=0), sleep=clock.sleep, clock=clock)
+    waiter.add('a', RUNNING)
+    results = waiter.wait()
+    assert [(r.id, r.ok, r.detail) for r in results] == [('a', False, 'timed out')]
+    assert clock.now == 10
+
+
+def test_node_poller_batches_by_datacenter():
+    driver = mock.Mock()
+    driver.list_nodes.return_value = [fake_node(str(i), NodeState.RUNNING) for i in range(3)]
+    driver.ex_get_node_by_id.side_effect = DimensionDataAPIException('RESOURCE_NOT_FOUND', 'gone', driver)
+    clock = FakeClock()
+    poller = NodePoller(driver, batch_threshold=3)
+    waiter = Waiter(poller, sleep=clock.sleep, clock=clock)
+    for i in range(3):
+        poller.add(waiter, fake_node(str(i), NodeState.STOPPED), RUNNING)
+    poller.add(waiter, fake_node('old', NodeState.RUNNING, datacenter='NA12'), DELETED)
+    results = waiter.wait()
+    assert all(r.ok for r in results)
+    assert len(results) == 4
+    driver.list_nodes.assert_called_once_with(ex_location='NA9')
+    driver.ex_get_node_by_id.assert_called_once_with('old')
+
+
+def test_node_poller_check():
+    assert NodePoller.check(fake_node('a', NodeState.STOPPED), STOPPED) == (True, 'stopped')
+    assert NodePoller.check(fake_node('a', NodeState.STOPPING, action='SHUTDOWN_SERVER'), STOPPED) is None
+    assert NodePoller.check(None, RUNNING) == (False, 'server not found')
+
+
+def test_backup_poller_throttles_each_poll():
+    driver = mock.Mock()
+    driver.ex_get_backup_details_for_target.side_effect = \
+        lambda server_id: mock.Mock(status='NORMAL' if server_id == 'a' else 'PROVISIONING')
+    throttle = mock.Mock()
+    assert BackupPoller(driver, throttle)({'a': BACKUP_ENABLED, 'b': BACKUP_ENABLED}) == {'a': (True, 'backup enabled')}
+    assert throttle.call_count == 2
@@ -0,0 +1,81 @@
+from didata_cli.cli import cli, DiDataCLIClient
+from tests.replay import ReplayAdapter, SyntheticFleet
+from didata_cli.watch import Watcher
+from click.testing import CliRunner
+from libcloud.common.dimensiondata import DimensionDataStatus
+from libcloud.compute.base import Node
+from libcloud.compute.types import NodeState
+import json
+import shutil
+import tempfile
+import unittest
+
+
+def fake_node(node_id, state=NodeState.RUNNING, ips=None, action=None):
+    return Node(node_id, 'server-' + node_id, state, [], ips or ['10.0.0.' + node_id], None,
+                extra={'datacenterId': 'NA9', 'status': DimensionDataStatus(action=action)})
+
+
+class FakeFleet(object):
+    def __init__(self, *nodes):
+        self.nodes = dict((node.id, node) for node in nodes)
+        self.lists = 0
+        self.gets = []
+        self.now = 0.0
+        self.sleeps = []
+
+    def list_nodes(self):
+        self.lists += 1
+        return [self.nodes[node_id] for node_id in sorted(self.nodes)]
+
+    def get_node(self, node_id):
+        self.gets.append(node_id)
+        return self.nodes.get(node_id)
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def watcher(self, **kwargs):
+        return Watcher(self.list_nodes, self.get_node, clock=self.clock, sleep=self.sleep, **kwargs)
+
+
+class WatchTestCase(unittest.TestCase):
+    def test_events_for_changes_between_polls(self):
+        fleet = FakeFleet(fake_node('1'), fake_node('2'))
+        watcher = fleet.watcher()
+        assert watcher.poll_all() == []
+        del fleet.nodes['2']
+        fleet.nodes['1'] = fake_node('1', NodeState.STOPPED, ['10.0.0.9'])
+        fleet.nodes['3'] = fake_node('3')
+        events = watcher.poll_all()
+        assert [(e['event'], e['id']) for e in events] == [('changed', '1'), ('added', '3'), ('removed', '2')]
+        assert events[0]['changes'] == {'state': ['running', 'stopped'], 'privateIpv4': [['10.0.0.1'], ['10.0.0.9']]}
+
+    def test_polls_pending_servers_quickly_and_idle_fleets_slowly(self):
+        fleet = FakeFleet(fake_node('1', action='SHUTDOWN_SERVER'), fake_node('2'))
+        events = []
+        fleet.watcher(interval=60, fast_interval=5).watch(events.append, polls=3)
+        # one full poll, then only the pending server
+        assert fleet.lists == 1 and fleet.gets == ['1', '1']
+        assert fleet.sleeps == [5, 5]
+        fleet.nodes['1'] = fake_node('1', NodeState.STOPPED)
+        fleet.sleeps = []
+        watcher = fleet.watcher(interval=60, fast_interval=5)
+        watcher.watch(events.append, polls=4)
+        assert fleet.sleeps == [60, 120, 240]
+
+    def test_server_watch_command(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        client = DiDataCLIClient()
+        client.adapter_factory = lambda size: ReplayAdapter(fleet=SyntheticFleet(5))
+        runner = CliRunner(env={'DIDATA_USER': 'fakeuser', 'DIDATA_PASSWORD': 'fakepass', 'DIDATA_CACHE_DIR': cache_dir})
+        result = runner.invoke(cli, ['server', 'watch', '--initial', '--polls', '1', '--datacenterId', 'NA9'], obj=client)
+        assert result.exit_code == 0
+        events = [json.loads(line) for line in result.output.splitlines()]
+        assert [(e['event'], e['name']) for e in events] == [('added', 'server00000'), ('added', 'server00004')]
+        assert events[0]['server']['state'] == 'running'